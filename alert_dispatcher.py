@@ -0,0 +1,204 @@
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+
+from resilience import RateLimiter, backoff_delays
+from vitals_schema import VITALS_SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+ALERT_TRANSPORT = os.getenv("ALERT_TRANSPORT", "twilio").lower()
+ALERT_RECIPIENTS = [n.strip() for n in os.getenv("ALERT_RECIPIENTS", "").split(",") if n.strip()]
+ALERT_COALESCE_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS", "300"))
+ALERT_RATE_PER_SECOND = float(os.getenv("ALERT_RATE_PER_SECOND", "1"))
+ALERT_MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "4"))
+ALERT_ON_NEGATIVE_SENTIMENT = os.getenv("ALERT_ON_NEGATIVE_SENTIMENT", "true").lower() == "true"
+ALERT_RED_FLAG_SYMPTOMS = [s.strip().lower() for s in os.getenv(
+    "ALERT_RED_FLAG_SYMPTOMS", "chest pain,shortness of breath,fainting,confusion,bleeding,palpitations,blurred vision,numbness",
+).split(",") if s.strip()]
+
+SMS_MAX_CHARS = 1600
+
+
+def alert_reasons(sentiment=None, symptoms=None, vitals=None, anomalies=None):
+    """Why a check-in needs a clinician's attention; empty when it does not."""
+    reasons = []
+    if ALERT_ON_NEGATIVE_SENTIMENT and sentiment == "Negative":
+        reasons.append("negative check-in")
+    red_flags = [s for s in symptoms or [] if isinstance(s, str) and any(flag in s.lower() for flag in ALERT_RED_FLAG_SYMPTOMS)]
+    if red_flags:
+        reasons.append("red-flag symptoms: " + ", ".join(red_flags))
+    return reasons + VITALS_SCHEMA.abnormal(vitals or {}) + [a.describe() for a in anomalies or []]
+
+
+class TwilioTransport:
+    def __init__(self, client, from_number):
+        self.client = client
+        self.from_number = from_number
+
+    def send(self, to, body):
+        return self.client.messages.create(to=to, from_=self.from_number, body=body).sid
+
+
+class FakeTransport:
+    """In-memory stand-in for Twilio: keeps every message, optionally slow or failing."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, body):
+        if self.latency: time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("fake transport failure")
+        with self._lock:
+            self.sent.append((to, body))
+            return f"fake-{len(self.sent)}"
+
+
+def _retryable(error):
+    # Twilio raises TwilioRestException with the HTTP status; 4xx other than 429 will not succeed on retry.
+    status = getattr(error, "status", None)
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+
+class AlertDispatcher:
+    """Sends clinician alerts from a background thread so ingest never waits on Twilio.
+
+    The first alert for a patient goes out immediately. Alerts arriving within `coalesce_seconds`
+    of the last message for that patient are merged into one follow-up sent when the window
+    closes. Sends share a token-bucket rate limit and transient failures are retried with
+    jittered backoff.
+    """
+
+    def __init__(self, transport, recipients, coalesce_seconds=ALERT_COALESCE_SECONDS, rate=ALERT_RATE_PER_SECOND,
+                 max_attempts=ALERT_MAX_ATTEMPTS):
+        self.transport = transport
+        self.recipients = list(recipients)
+        self.coalesce_seconds = coalesce_seconds
+        self.max_attempts = max_attempts
+        self.limiter = RateLimiter(rate)
+        self.stats = {"alerts": 0, "coalesced": 0, "messages": 0, "sent": 0, "retries": 0, "failed": 0}
+        self._cond = threading.Condition()
+        self._pending = {}    # patient_id -> {"name", "reasons", "count", "first_at"}
+        self._due = []        # heap of (send at, patient_id), one entry per pending patient
+        self._last_sent = {}  # patient_id -> monotonic time the last message left the queue
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+
+    def check(self, patient_id, patient_name, sentiment=None, symptoms=None, vitals=None, anomalies=None):
+        """Evaluate a check-in and queue an alert if it needs one; never blocks on delivery."""
+        reasons = alert_reasons(sentiment, symptoms, vitals, anomalies)
+        return self.notify(patient_id, patient_name, reasons) if reasons else False
+
+    def notify(self, patient_id, patient_name, reasons):
+        now = time.monotonic()
+        with self._cond:
+            self.stats["alerts"] += 1
+            entry = self._pending.get(patient_id)
+            if entry is not None:
+                entry["count"] += 1
+                entry["reasons"] += [r for r in reasons if r not in entry["reasons"]]
+                self.stats["coalesced"] += 1
+                return True
+            send_at = max(now, self._last_sent.get(patient_id, float("-inf")) + self.coalesce_seconds)
+            self._pending[patient_id] = {"name": patient_name, "reasons": list(reasons), "count": 1, "first_at": time.time()}
+            heapq.heappush(self._due, (send_at, patient_id))
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _next(self):
+        """Block until a patient's alert is due (or, when stopping, return any left); None once drained."""
+        with self._cond:
+            while True:
+                if self._due and (self._stopping or self._due[0][0] <= time.monotonic()):
+                    _, patient_id = heapq.heappop(self._due)
+                    now = time.monotonic()
+                    self._last_sent[patient_id] = now
+                    if len(self._last_sent) > 4096:
+                        self._last_sent = {p: t for p, t in self._last_sent.items() if now - t < self.coalesce_seconds}
+                    return patient_id, self._pending.pop(patient_id)
+                if self._stopping:
+                    return None
+                self._cond.wait(self._due[0][0] - time.monotonic() if self._due else None)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None: return
+            patient_id, entry = item
+            body = self.format(patient_id, entry)
+            self.stats["messages"] += 1
+            for to in self.recipients:
+                self._send(to, body)
+
+    def format(self, patient_id, entry):
+        body = f"ALERT {entry['name']} ({patient_id}): " + "; ".join(entry["reasons"])
+        if entry["count"] > 1:
+            body += f" [{entry['count']} reports since {time.strftime('%H:%M', time.localtime(entry['first_at']))}]"
+        return body[:SMS_MAX_CHARS]
+
+    def _send(self, to, body):
+        delays = backoff_delays(self.max_attempts, base=1.0, cap=30.0)
+        while True:
+            self.limiter.acquire()
+            try:
+                self.transport.send(to, body)
+                self.stats["sent"] += 1
+                return True
+            except Exception as e:
+                delay = next(delays, None) if _retryable(e) else None
+                if delay is None:
+                    self.stats["failed"] += 1
+                    logger.error(f"Alert to {to} failed: {e}")
+                    return False
+                self.stats["retries"] += 1
+                logger.info(f"Alert to {to} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def close(self, timeout=10.0):
+        """Send everything still queued (ignoring coalescing windows) and stop the worker."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+def make_transport(name=ALERT_TRANSPORT, twilio_client=None, from_number=None):
+    if name == "fake":
+        return FakeTransport()
+    if twilio_client is None or not from_number:
+        return None
+    return TwilioTransport(twilio_client, from_number)
+
+
+def create_dispatcher(get_twilio_client, from_number=None, recipients=None):
+    """Dispatcher for the configured transport, or None when alerts are not configured.
+
+    `get_twilio_client` is only called for the Twilio transport, so the Twilio SDK stays optional.
+    """
+    recipients = ALERT_RECIPIENTS if recipients is None else recipients
+    if not recipients:
+        logger.info("Clinician alerts disabled: ALERT_RECIPIENTS is not set.")
+        return None
+    twilio_client = None
+    if ALERT_TRANSPORT == "twilio":
+        try: twilio_client = get_twilio_client()
+        except Exception as e: logger.warning(f"Twilio client unavailable for alerts: {e}")
+    transport = make_transport(ALERT_TRANSPORT, twilio_client, from_number)
+    if transport is None:
+        logger.warning("Clinician alerts disabled: Twilio credentials or TWILIO_PHONE_NUMBER missing.")
+        return None
+    logger.info(f"Clinician alerts via {ALERT_TRANSPORT} to {len(recipients)} recipient(s)")
+    return AlertDispatcher(transport, recipients)
@@ -0,0 +1,285 @@
+import bisect
+import collections
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from local_mirror import object_row
+from vitals_schema import VITALS_SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_SNAPSHOT_PATH = os.getenv("ANOMALY_SNAPSHOT_PATH", "data/anomaly_state.npz")
+ANOMALY_SNAPSHOT_SECONDS = float(os.getenv("ANOMALY_SNAPSHOT_SECONDS", "60"))
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "31"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", "7"))
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "3.5"))
+# Smallest spread assumed for a metric, as a fraction of its plausible range, so a patient whose
+# readings never changed is not flagged for the first small wobble.
+ANOMALY_MIN_SCALE_FRACTION = float(os.getenv("ANOMALY_MIN_SCALE_FRACTION", "0.01"))
+
+MAD_TO_SIGMA = 1.4826
+
+
+class Anomaly(NamedTuple):
+    patient_id: str
+    metric: str
+    value: float
+    median: float
+    robust_z: float
+    z: float
+    ewma: float
+
+    def describe(self):
+        spec = VITALS_SCHEMA.by_name[self.metric]
+        direction = "above" if self.robust_z > 0 else "below"
+        return f"{spec.label} {self.value:g} {spec.unit} unusually {direction} this patient's baseline ({self.median:g}, robust z {self.robust_z:+.1f})"
+
+
+class MetricState:
+    """Rolling statistics for one patient's metric in constant memory.
+
+    Welford running mean/variance over all readings, an EWMA mean/variance that follows drift,
+    and the last `window` readings (kept in arrival order and sorted) for median and MAD.
+    """
+
+    __slots__ = ("n", "mean", "m2", "ewma", "ewvar", "recent", "ordered")
+
+    def __init__(self, window):
+        self.n = 0
+        self.mean = self.m2 = self.ewma = self.ewvar = 0.0
+        self.recent = collections.deque(maxlen=window)
+        self.ordered = []
+
+    def push(self, x, alpha):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.n == 1:
+            self.ewma, self.ewvar = x, 0.0
+        else:
+            d = x - self.ewma
+            self.ewma += alpha * d
+            self.ewvar = (1.0 - alpha) * (self.ewvar + alpha * d * d)
+        if len(self.recent) == self.recent.maxlen:
+            del self.ordered[bisect.bisect_left(self.ordered, self.recent[0])]
+        self.recent.append(x)
+        bisect.insort(self.ordered, x)
+
+    def median(self):
+        o, k = self.ordered, len(self.ordered)
+        return o[k // 2] if k % 2 else 0.5 * (o[k // 2 - 1] + o[k // 2])
+
+    def mad(self, median):
+        deviations = sorted([abs(v - median) for v in self.ordered])
+        k = len(deviations)
+        return deviations[k // 2] if k % 2 else 0.5 * (deviations[k // 2 - 1] + deviations[k // 2])
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+
+class AnomalyEngine:
+    """Per-patient, per-vital baselines updated on every submission.
+
+    A reading is scored against the patient's baseline before it is added to it, and flagged
+    when its robust z-score (distance from the rolling median in MAD units) reaches `threshold`.
+    State is snapshotted to a compressed .npz file every `snapshot_seconds` when it has changed.
+    While a background warm start runs, readings are held back unscored and added after the history.
+    """
+
+    def __init__(self, metrics=None, window=ANOMALY_WINDOW, alpha=ANOMALY_EWMA_ALPHA, min_history=ANOMALY_MIN_HISTORY,
+                 threshold=ANOMALY_THRESHOLD, snapshot_path=ANOMALY_SNAPSHOT_PATH, snapshot_seconds=ANOMALY_SNAPSHOT_SECONDS):
+        self.metrics = list(metrics or VITALS_SCHEMA.by_name)
+        self.window = window
+        self.alpha = alpha
+        self.min_history = min_history
+        self.threshold = threshold
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self.min_scale = {m: ANOMALY_MIN_SCALE_FRACTION * (VITALS_SCHEMA.by_name[m].maximum - VITALS_SCHEMA.by_name[m].minimum) for m in self.metrics}
+        self.stats = {"observations": 0, "anomalies": 0, "snapshots": 0}
+        self._states = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.warming = False
+        self._held = []
+
+    def __len__(self):
+        return len(self._states)
+
+    def _state(self, patient_id, metric):
+        state = self._states.get((patient_id, metric))
+        if state is None:
+            state = self._states[(patient_id, metric)] = MetricState(self.window)
+        return state
+
+
+    def observe(self, patient_id, values):
+        """Score validated vitals ({metric: value}) against the patient's baseline, then add them.
+
+        Returns the anomalies found; metrics outside the engine or with too little history are not scored.
+        """
+        anomalies = []
+        with self._lock:
+            if self.warming:
+                self._held.append((patient_id, values)); return anomalies
+            for metric, value in values.items():
+                if metric not in self.min_scale or value is None: continue
+                x = float(value)
+                state = self._state(patient_id, metric)
+                if state.n >= self.min_history:
+                    floor = self.min_scale[metric]
+                    median = state.median()
+                    robust_z = (x - median) / max(MAD_TO_SIGMA * state.mad(median), floor)
+                    if abs(robust_z) >= self.threshold:
+                        z = (x - state.mean) / max(state.std(), floor)
+                        anomalies.append(Anomaly(patient_id, metric, x, median, round(robust_z, 2), round(z, 2), round(state.ewma, 2)))
+                state.push(x, self.alpha)
+                self.stats["observations"] += 1
+            self.stats["anomalies"] += len(anomalies)
+            self._dirty = True
+        return anomalies
+
+    def baseline(self, patient_id, metric):
+        with self._lock:
+            state = self._states.get((patient_id, metric))
+            if state is None or not state.n: return None
+            median = state.median()
+            return {"n": state.n, "mean": state.mean, "std": state.std(), "ewma": state.ewma, "ewma_std": math.sqrt(state.ewvar),
+                    "median": median, "mad": state.mad(median)}
+
+    def warm_start(self, frame):
+        """Build baselines from historical vitals: a DataFrame with `patient`, `date_` and vital columns.
+
+        Readings are validated in one vectorized pass; values equal to a vital's legacy fill (the 0
+        written when it was not measured) are treated as missing.
+        """
+        if frame is None or frame.empty: return 0
+        frame = frame.sort_values("date_", kind="stable")
+        clean = VITALS_SCHEMA.mask_fills(VITALS_SCHEMA.validate_batch(frame)[0])
+        patients = frame["patient"].astype(str).to_numpy()
+        pushed = 0
+        with self._lock:
+            for metric in self.metrics:
+                column = clean[metric].to_numpy()
+                for i in np.flatnonzero(~np.isnan(column)):
+                    self._state(patients[i], metric).push(float(column[i]), self.alpha)
+                pushed += int(np.count_nonzero(~np.isnan(column)))
+            self._dirty = True
+        logger.info(f"Anomaly baselines warmed from {len(frame)} historical vitals ({pushed} readings, {len(self._states)} series)")
+        return pushed
+
+    def warm_start_in_background(self, load_frame):
+        """Run `warm_start(load_frame())` on a thread, then add the readings observed meanwhile and snapshot."""
+        def run():
+            started = time.perf_counter()
+            try: self.warm_start(load_frame())
+            except Exception as e: logger.error(f"Anomaly warm start failed: {e}", exc_info=True)
+            with self._lock:
+                for patient_id, values in self._held:
+                    for metric, value in values.items():
+                        if metric in self.min_scale and value is not None: self._state(patient_id, metric).push(float(value), self.alpha)
+                self.stats["observations"] += sum(len(values) for _, values in self._held)
+                self._held, self.warming, self._dirty = [], False, True
+            logger.info(f"Anomaly warm start took {time.perf_counter() - started:.2f}s")
+            if self.snapshot_path:
+                try: self.save()
+                except Exception as e: logger.error(f"Anomaly snapshot failed: {e}")
+
+        self.warming = True
+        threading.Thread(target=run, name="anomaly-warm-start", daemon=True).start()
+
+    def save(self, path=None):
+        path = path or self.snapshot_path
+        if not path: return 0
+        with self._lock:
+            keys = list(self._states)
+            summary = np.array([(s.n, s.mean, s.m2, s.ewma, s.ewvar) for s in self._states.values()], dtype=np.float64).reshape(-1, 5)
+            recent = np.full((len(keys), self.window), np.nan)
+            for i, state in enumerate(self._states.values()):
+                recent[i, :len(state.recent)] = state.recent
+            self._dirty = False
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp, patients=np.array([k[0] for k in keys], dtype=str), metrics=np.array([k[1] for k in keys], dtype=str),
+            summary=summary, recent=recent, meta=json.dumps({"window": self.window, "alpha": self.alpha, "saved_at": time.time()}),
+        )
+        os.replace(tmp, path)
+        self.stats["snapshots"] += 1
+        return len(keys)
+
+    def load(self, path=None):
+        """Restore state from a snapshot; False if there is none or it was taken with another window size."""
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path): return False
+        with np.load(path) as snapshot:
+            meta = json.loads(str(snapshot["meta"]))
+            if meta.get("window") != self.window:
+                logger.warning(f"Ignoring anomaly snapshot {path}: window {meta.get('window')} != {self.window}"); return False
+            patients, metrics, summary, recent = snapshot["patients"], snapshot["metrics"], snapshot["summary"], snapshot["recent"]
+        states = {}
+        for i in range(len(patients)):
+            state = MetricState(self.window)
+            n, state.mean, state.m2, state.ewma, state.ewvar = summary[i].tolist()
+            state.n = int(n)
+            values = recent[i][~np.isnan(recent[i])].astype(float).tolist()
+            state.recent.extend(values)
+            state.ordered = sorted(values)
+            states[(str(patients[i]), str(metrics[i]))] = state
+        with self._lock:
+            self._states = states
+            self._dirty = False
+        logger.info(f"Anomaly baselines loaded from {path}: {len(states)} series (saved {time.time() - meta.get('saved_at', time.time()):.0f}s ago)")
+        return True
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_seconds):
+            if not self._dirty or self.warming: continue
+            try: self.save()
+            except Exception as e: logger.error(f"Anomaly snapshot failed: {e}", exc_info=True)
+
+    def start(self):
+        if self._thread is None and self.snapshot_path and self.snapshot_seconds > 0:
+            self._thread = threading.Thread(target=self._snapshot_loop, name="anomaly-snapshot", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop periodic snapshots and write a final one if anything changed."""
+        self._stop.set()
+        if self.snapshot_path and self._dirty and not self.warming:
+            try: self.save()
+            except Exception as e: logger.error(f"Final anomaly snapshot failed: {e}")
+
+
+def history_frame(client=None, mirror=None):
+    """Historical Vitals as a DataFrame, from the local Parquet mirror when given, else the Ontology."""
+    if mirror is not None:
+        return mirror.table("vitals").to_pandas()
+    return pd.DataFrame([object_row(v) for v in client.ontology.objects.Vitals.iterate()])
+
+
+def create_engine(client=None, mirror=None, save=True):
+    """Engine restored from its snapshot, or warmed from Vitals history in the background when there is none.
+
+    Until the warm start finishes readings are not scored, as for a patient with no history.
+    With `save` false (e.g. a second process sharing the snapshot) the snapshot is only read.
+    """
+    engine = AnomalyEngine(snapshot_path=ANOMALY_SNAPSHOT_PATH if save else None)
+    if not engine.load(ANOMALY_SNAPSHOT_PATH) and (client is not None or mirror is not None):
+        engine.warm_start_in_background(lambda: history_frame(client, mirror))
+    engine.start()
+    return engine
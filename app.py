@@ -1,22 +1,36 @@
 import os
 import json
+import atexit
 import logging
 import hmac
 import hashlib
 from datetime import date
-from flask import Flask, request, jsonify, abort
+try: import fcntl
+except ImportError: fcntl = None  # Windows: no cross-process lock, so every process is the owner
+from flask import Flask, Response, request, jsonify, abort
+from werkzeug.exceptions import HTTPException
 from dotenv import load_dotenv
+from clients import get_openai_client, get_twilio_client
 from foundry_client import client as ontology_client
+from ingest_queue import IngestQueue, IngestWorkerPool
+from patient_directory import PatientDirectory
+from write_coalescer import WriteCoalescer, apply_action
+from dedup_store import DedupStore
+from enrichment import ENRICHMENT_MODE, NO_ENRICHMENT, classify_sentiment, enrich_note, extract_symptoms, llm_cache
+from enrichment import stats as enrichment_stats
+from metrics import PipelineMetrics
+from traffic_capture import REDACTORS, TrafficCapture
+from resilience import CircuitOpenError, STATE_CODES, breaker_states, foundry_reads, foundry_writes
+from vitals_schema import VITALS_SCHEMA
+import alert_dispatcher as alerts
+from anomaly_engine import create_engine as create_anomaly_engine
+from cohort_analytics import create_analytics as create_cohort_analytics
+from local_mirror import LocalMirror
+from change_feed import CHANGE_FEED_TOKEN, ChangeFeed, authorized as bearer_authorized, stream_params
+from webhook_signature import parse_signature_header
 
 
-try: from openai import OpenAI, OpenAIError; OPENAI_AVAILABLE = True
-except ImportError: logging.warning("OpenAI SDK not found."); OPENAI_AVAILABLE = False
-
-
-from hospital_pro_patient_facing_app_sdk import FoundryClient, ontology
 from hospital_pro_patient_facing_app_sdk.ontology.objects import Patient
-from foundry_sdk_runtime.auth import UserTokenAuth
-from foundry_sdk_runtime.types import ActionConfig, ActionMode, ReturnEditsMode
 
 
 load_dotenv()
@@ -25,31 +39,96 @@ EXPECTED_SECRET = os.getenv("ELEVENLABS_WEBHOOK_SECRET")
 FOUNDRY_HOSTNAME = os.getenv("FOUNDRY_HOSTNAME")
 FOUNDRY_TOKEN = os.getenv("FOUNDRY_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "sync").lower()
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "data/ingest_queue.sqlite3")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+PATIENT_DIRECTORY_ENABLED = os.getenv("PATIENT_DIRECTORY_ENABLED", "true").lower() == "true"
+PATIENT_DIRECTORY_REFRESH_SECONDS = float(os.getenv("PATIENT_DIRECTORY_REFRESH_SECONDS", "300"))
+PATIENT_FUZZY_THRESHOLD = float(os.getenv("PATIENT_FUZZY_THRESHOLD", "0.6"))
+FOUNDRY_WRITE_BATCH_WINDOW_MS = float(os.getenv("FOUNDRY_WRITE_BATCH_WINDOW_MS", "0"))
+FOUNDRY_WRITE_BATCH_SIZE = int(os.getenv("FOUNDRY_WRITE_BATCH_SIZE", "20"))
+FOUNDRY_WRITE_TIMEOUT_SECONDS = float(os.getenv("FOUNDRY_WRITE_TIMEOUT_SECONDS", "60"))
+PATIENT_LOOKUP_HEDGE_MS = float(os.getenv("PATIENT_LOOKUP_HEDGE_MS", "0"))
+SIGNATURE_TOLERANCE_SECONDS = 300
+WEBHOOK_DEDUP_ENABLED = os.getenv("WEBHOOK_DEDUP_ENABLED", "true").lower() == "true"
+WEBHOOK_DEDUP_WINDOW_SECONDS = float(os.getenv("WEBHOOK_DEDUP_WINDOW_SECONDS", str(SIGNATURE_TOLERANCE_SECONDS)))
+WEBHOOK_DEDUP_PATH = os.getenv("WEBHOOK_DEDUP_PATH") or None
+METRICS_PROFILE_EVERY_N = int(os.getenv("METRICS_PROFILE_EVERY_N", "0"))
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "data/profiles")
+WEBHOOK_CAPTURE_ENABLED = os.getenv("WEBHOOK_CAPTURE_ENABLED", "false").lower() == "true"
+WEBHOOK_CAPTURE_REDACTION = os.getenv("WEBHOOK_CAPTURE_REDACTION", "phi").lower()
+ANOMALY_DETECTION_ENABLED = os.getenv("ANOMALY_DETECTION_ENABLED", "true").lower() == "true"
+ANOMALY_WARM_START = os.getenv("ANOMALY_WARM_START", "ontology").lower()
+COHORT_ANALYTICS_ENABLED = os.getenv("COHORT_ANALYTICS_ENABLED", "true").lower() == "true"
+COHORT_SOURCE = os.getenv("COHORT_SOURCE", "ontology").lower()
+# /analytics/cohort is only served with a bearer token, like /changes/stream.
+COHORT_API_TOKEN = os.getenv("COHORT_API_TOKEN") or None
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "true").lower() == "true"
+# Several server processes import this module; the one holding this lock owns the stateful background
+# components (ingest workers, anomaly engine, cohort snapshot, alert dispatcher). Empty = always the owner.
+WEBHOOK_OWNER_LOCK_PATH = os.getenv("WEBHOOK_OWNER_LOCK_PATH", "data/webhook_owner.lock")
+# Server processes sharing the lock; asgi_app sets it from ASGI_WORKERS (set it yourself for `uvicorn --workers`).
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
 
 app = Flask(__name__)
+pipeline_metrics = PipelineMetrics(profile_every=METRICS_PROFILE_EVERY_N, profile_dir=METRICS_PROFILE_DIR)
 
 handler = logging.StreamHandler(); formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'); handler.setFormatter(formatter)
 app.logger.addHandler(handler); app.logger.setLevel(logging.INFO)
 
-foundry_token = os.getenv("FOUNDRY_TOKEN")
-auth = UserTokenAuth(
-        hostname="https://benshvartsman1.usw-18.palantirfoundry.com",
-        token=foundry_token
-    )
-foundry_client = FoundryClient(
-        auth=auth,
-        hostname="https://benshvartsman1.usw-18.palantirfoundry.com"
-    )
+foundry_client = ontology_client
 app.logger.info(f"Foundry client initialized successfully for hostname: {FOUNDRY_HOSTNAME}")
 
+# The debug reloader's parent (`python app.py`) only watches files; the child it starts serves and owns the lock.
+_RELOADER_PARENT = __name__ == "__main__" and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+BACKGROUND_OWNER = not _RELOADER_PARENT
+if BACKGROUND_OWNER and WEBHOOK_OWNER_LOCK_PATH and fcntl is not None:
+    if os.path.dirname(WEBHOOK_OWNER_LOCK_PATH): os.makedirs(os.path.dirname(WEBHOOK_OWNER_LOCK_PATH), exist_ok=True)
+    _owner_lock = open(WEBHOOK_OWNER_LOCK_PATH, "a")  # held open (and locked) until this process exits
+    try: fcntl.flock(_owner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError: BACKGROUND_OWNER = False
+if not BACKGROUND_OWNER and not _RELOADER_PARENT:
+    if INGEST_MODE == "queue":
+        app.logger.info(f"Another process holds {WEBHOOK_OWNER_LOCK_PATH}; this one only accepts and queues deliveries.")
+    elif WEBHOOK_WORKERS > 1:
+        # Every worker would process deliveries inline, each with its own baselines and alert queue.
+        raise RuntimeError(f"Another process holds {WEBHOOK_OWNER_LOCK_PATH}; set WEBHOOK_INGEST_MODE=queue to run {WEBHOOK_WORKERS} webhook workers.")
+    else:
+        # A single inline worker must keep its alerts and anomaly checks, so it runs them despite the other holder.
+        app.logger.warning(f"Another process holds {WEBHOOK_OWNER_LOCK_PATH}; running the background components here anyway.")
+        BACKGROUND_OWNER = True
+
+patient_directory = None
+if PATIENT_DIRECTORY_ENABLED and BACKGROUND_OWNER:
+    patient_directory = PatientDirectory(foundry_client, refresh_interval=PATIENT_DIRECTORY_REFRESH_SECONDS, fuzzy_threshold=PATIENT_FUZZY_THRESHOLD)
+    patient_directory.start()
+
+write_coalescer = None
+if FOUNDRY_WRITE_BATCH_WINDOW_MS > 0:
+    write_coalescer = WriteCoalescer(ontology_client, window=FOUNDRY_WRITE_BATCH_WINDOW_MS / 1000.0, max_batch=FOUNDRY_WRITE_BATCH_SIZE)
+    app.logger.info(f"Foundry write coalescing enabled ({FOUNDRY_WRITE_BATCH_WINDOW_MS}ms window, up to {FOUNDRY_WRITE_BATCH_SIZE} actions per batch)")
+
 openai_client = None
-if OPENAI_AVAILABLE and OPENAI_API_KEY:
-     try: openai_client = OpenAI(api_key=OPENAI_API_KEY); app.logger.info("OpenAI client initialized.")
+if OPENAI_API_KEY:
+     try: openai_client = get_openai_client(); app.logger.info("OpenAI client initialized.")
      except Exception as e: app.logger.error(f"CRITICAL: Failed to initialize OpenAI client: {e}")
 
 
 import time
 
+def delivery_keys(data, headers):
+    conversation_id = None
+    if isinstance(data, dict) and isinstance(data.get('data'), dict):
+        conversation_id = data['data'].get('conversation_id')
+    signature_v0 = None
+    header_value = headers.get('ElevenLabs-Signature')
+    if header_value:
+        try: signature_v0 = parse_signature_header(header_value)[1]
+        except Exception: pass
+    return [f"conversation:{conversation_id}" if conversation_id else None, f"signature:{signature_v0}" if signature_v0 else None]
+
+
 def verify_signature_from_raw(raw_body, headers):
     if not EXPECTED_SECRET:
         app.logger.error("CRITICAL: ELEVENLABS_WEBHOOK_SECRET is not set.")
@@ -61,19 +140,8 @@ def verify_signature_from_raw(raw_body, headers):
         app.logger.warning("Missing 'ElevenLabs-Signature' header.")
         abort(400, description="Missing signature header")
 
-    timestamp = None
-    signature_v0 = None
     try:
-        items = header_value.split(',')
-        for item in items:
-            parts = item.split('=', 1)
-            if len(parts) == 2:
-                key = parts[0].strip()
-                value = parts[1].strip()
-                if key == 't':
-                    timestamp = int(value)
-                elif key == 'v0':
-                    signature_v0 = value
+        timestamp, signature_v0 = parse_signature_header(header_value)
         app.logger.info(f"Parsed timestamp: {timestamp}, Parsed v0 signature: {signature_v0[:5] if signature_v0 else 'None'}...")
     except Exception as e:
         app.logger.error(f"Failed to parse 'ElevenLabs-Signature' header value: {header_value}. Error: {e}")
@@ -83,7 +151,7 @@ def verify_signature_from_raw(raw_body, headers):
         app.logger.error(f"Could not extract timestamp or v0 signature from header: {header_value}")
         abort(400, description="Incomplete signature header (missing t or v0)")
 
-    tolerance_seconds = 300
+    tolerance_seconds = SIGNATURE_TOLERANCE_SECONDS
     current_time = int(time.time())
     if abs(current_time - timestamp) > tolerance_seconds:
         app.logger.warning(f"Signature timestamp ({timestamp}) outside tolerance window (current: {current_time}).")
@@ -124,37 +192,29 @@ def get_ai_sentiment(text):
     if not openai_client or not text: return None
     try:
         app.logger.info("Requesting sentiment analysis from OpenAI...")
-        sentiment_resp = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a healthcare assistant. Classify the sentiment of the following patient check-in note as Positive or Negative. Respond with only one word: Positive or Negative."},
-                {"role": "user", "content": text}
-            ]
-        )
-        sentiment = sentiment_resp.choices[0].message.content.strip()
+        sentiment = classify_sentiment(openai_client, text)
         app.logger.info(f"OpenAI sentiment result: {sentiment}")
-        return sentiment if sentiment in ["Positive", "Negative"] else None
+        return sentiment
     except Exception as e: app.logger.error(f"Error during sentiment analysis: {e}"); return None
 
 def get_ai_symptoms(text):
     if not openai_client or not text: return ["none"]
     try:
         app.logger.info("Requesting symptom extraction from OpenAI...")
-        symptoms_resp = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-             messages=[ 
-                {"role": "system", "content": "You are a healthcare assistant. Extract all symptoms mentioned in the following patient check-in note. Return a JSON array of strings only. If no symptoms are mentioned, return [\"none\"]. No commentary or explanation."},
-                {"role": "user", "content": text}
-            ]
-        )
-        symptoms_str = symptoms_resp.choices[0].message.content.strip()
-        app.logger.info(f"OpenAI symptoms result (raw): {symptoms_str}")
-        try: symptoms = json.loads(symptoms_str); return symptoms if isinstance(symptoms, list) and symptoms else ["none"]
-        except json.JSONDecodeError: app.logger.warning(f"OpenAI symptoms invalid JSON: {symptoms_str}"); return ["none"]
+        symptoms = extract_symptoms(openai_client, text)
+        app.logger.info(f"OpenAI symptoms result: {symptoms}")
+        return symptoms
     except Exception as e: app.logger.error(f"Error during symptom extraction: {e}"); return ["none"]
 
+def get_ai_enrichment(text):
+    if not text: return NO_ENRICHMENT
+    app.logger.info(f"Enriching note (local lexicon first, OpenAI {ENRICHMENT_MODE} mode for low-confidence notes)...")
+    enrichment = enrich_note(openai_client, text)
+    app.logger.info(f"Enrichment result: sentiment={enrichment.sentiment}, symptoms={enrichment.symptoms}")
+    return enrichment
 
-def find_patient_by_name(name):
+
+def find_patient_by_name(name, raise_errors=False):
     # <<< Add explicit check log >>>
     from hospital_pro_patient_facing_app_sdk.ontology.objects import Patient
 
@@ -167,32 +227,62 @@ def find_patient_by_name(name):
         return None
 
     search_term = name.strip()
+
+    if patient_directory is not None and patient_directory.loaded:
+        match = patient_directory.lookup(search_term)
+        if match and match.ambiguous:
+            app.logger.warning(f"Ambiguous patient name '{search_term}', candidates: {[(c.patient_id, c.name, c.score) for c in match.candidates]}")
+            return None
+        if match:
+            app.logger.info(f"Patient directory {match.method} match for '{search_term}': Identifier='{match.patient_id}' (score {match.score})")
+            return match.patient_id
+        app.logger.info(f"No patient directory match for '{search_term}', falling back to Ontology query.")
     app.logger.info(f"Attempting search using Streamlit logic with search_term: '{search_term}'")
 
 
     try:
         PatientObjectService = foundry_client.ontology.objects.Patient
 
-        results = PatientObjectService.where(Patient.object_type.name == search_term).take(1)
+        query = lambda: PatientObjectService.where(Patient.object_type.name == search_term).take(1)
+        if PATIENT_LOOKUP_HEDGE_MS > 0: results = foundry_reads.hedged(query, hedge_after=PATIENT_LOOKUP_HEDGE_MS / 1000.0)
+        else: results = foundry_reads.call(query, idempotent=True)
 
         if len(results) == 1:
             found_patient_object = results[0]
             patient_identifier = found_patient_object.id
             found_name = getattr(found_patient_object, 'name', '[name property not found]')
             app.logger.info(f"Found unique patient matching Streamlit query logic: Name='{found_name}', Identifier='{patient_identifier}'")
+            if patient_directory is not None: patient_directory.add(found_patient_object)
             return patient_identifier
         elif len(results) == 0:
             app.logger.warning(f"No patient found matching Streamlit query logic for search_term: '{search_term}' (Searching Patient.object_type.name)")
             return None
 
+    except CircuitOpenError as e:
+        app.logger.warning(f"Patient search skipped: {e}")
+        if raise_errors: raise
+        return None
     except Exception as e:
         app.logger.error(f"Error during patient search using Streamlit logic: {e}", exc_info=True)
+        if raise_errors: raise
         return None
 
 
-def create_foundry_pro(patient_foundry_id, free_text_content, sentiment, symptoms):
+def _retryable_write_error(error):
+    # Only errors where the action certainly was not applied: the breaker refused the call or Foundry rate-limited it.
+    # Timeouts, dropped connections and 5xx may have created the object already, so retrying would duplicate it.
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return isinstance(error, CircuitOpenError) or status == 429
+
 
-    from foundry_sdk_runtime.types import ActionConfig, ActionMode, ReturnEditsMode
+def submit_ontology_action(action_name, **params):
+    # Writes are not retried: a timed-out action may still have been applied.
+    if write_coalescer is not None:
+        return foundry_writes.call(lambda: write_coalescer.submit(action_name, **params).result(timeout=FOUNDRY_WRITE_TIMEOUT_SECONDS))
+    return foundry_writes.call(lambda: apply_action(ontology_client, action_name, params))
+
+
+def create_foundry_pro(patient_foundry_id, free_text_content, sentiment, symptoms, raise_errors=False):
 
     if not ontology_client: 
          app.logger.error("Ontology client (ontology_client) unavailable for create_proentity.");
@@ -205,11 +295,10 @@ def create_foundry_pro(patient_foundry_id, free_text_content, sentiment, symptom
         return False
 
     try:
-        action_cfg = ActionConfig(mode=ActionMode.VALIDATE_AND_EXECUTE, return_edits=ReturnEditsMode.ALL)
         app.logger.info(f"Attempting to create PROEntity for patient ID: {patient_foundry_id}")
 
-        response = ontology_client.ontology.actions.create_proentity(
-            action_config=action_cfg,
+        result = submit_ontology_action(
+            "create_proentity",
             patient=patient_foundry_id,
             submitted_at=date.today().isoformat(),
             free_text=free_text_content,
@@ -217,102 +306,64 @@ def create_foundry_pro(patient_foundry_id, free_text_content, sentiment, symptom
             symptoms=symptoms,
         )
 
-        if response and hasattr(response, 'validation') and response.validation.validation_result == "VALID":
+        if result.validation_result == "VALID":
              app.logger.info(f"Successfully created PROEntity for patient ID: {patient_foundry_id}"); return True
-        elif response and hasattr(response, 'validation'):
-             app.logger.error(f"Foundry 'create_proentity' failed validation: {response.validation.validation_result}")
-             try: vd = response.validation._asdict(include_type_field=True); app.logger.error(f"Validation Details: {json.dumps(vd)}")
-             except Exception: pass
+        elif result.validation_result:
+             app.logger.error(f"Foundry 'create_proentity' failed validation: {result.validation_result}")
+             if result.details: app.logger.error(f"Validation Details: {json.dumps(result.details)}")
              return False
         else: app.logger.error("'create_proentity' call bad response structure."); return False
-    except Exception as e: app.logger.error(f"Error during create_proentity: {e}", exc_info=True); return False
+    except Exception as e:
+        app.logger.error(f"Error during create_proentity: {e}", exc_info=True)
+        if raise_errors and _retryable_write_error(e): raise
+        return False
 
 
-def create_foundry_vitals(patient_foundry_id, results):
-    from foundry_sdk_runtime.types import ActionConfig, ActionMode, ReturnEditsMode
+def create_foundry_vitals(patient_foundry_id, results, raise_errors=False):
 
     if not foundry_client:
         app.logger.error("Foundry client unavailable for create_vitals.")
         return False
 
-    hrv_obj = results.get("hrv")
-    heart_rate_obj = results.get("heart_rate")
-    sleep_hours_obj = results.get("sleep_hours")
-
-    hrv_val_extracted = hrv_obj.get("value") if isinstance(hrv_obj, dict) else hrv_obj
-    heart_rate_val_extracted = heart_rate_obj.get("value") if isinstance(heart_rate_obj, dict) else heart_rate_obj
-    sleep_hours_val_extracted = sleep_hours_obj.get("value") if isinstance(sleep_hours_obj, dict) else sleep_hours_obj
-
-    app.logger.info(f"Extracted Vitals - HRV: {hrv_val_extracted}, HR: {heart_rate_val_extracted}, Sleep: {sleep_hours_val_extracted}")
-
-
-    hrv_val = 0
-    if hrv_val_extracted is not None:
-        try:
-            hrv_val = int(float(hrv_val_extracted))
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not convert extracted HRV value '{hrv_val_extracted}' to integer. Defaulting to 0.")
-            hrv_val = 0
-
-    heart_rate_val = 0
-    if heart_rate_val_extracted is not None:
-        try:
-            heart_rate_val = int(float(heart_rate_val_extracted))
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not convert extracted HR value '{heart_rate_val_extracted}' to integer. Defaulting to 0.")
-            heart_rate_val = 0
-
-    sleep_hours_val = 0.0
-    if sleep_hours_val_extracted is not None:
-        try:
-            sleep_hours_val = float(sleep_hours_val_extracted)
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not convert extracted Sleep value '{sleep_hours_val_extracted}' to float. Defaulting to 0.0.")
-            sleep_hours_val = 0.0
+    validated = VITALS_SCHEMA.validate(results)
+    app.logger.info(f"Extracted Vitals - {validated.values}")
+    for name, reason in validated.errors.items():
+        app.logger.warning(f"Dropping extracted {VITALS_SCHEMA.labels[name]} value: {reason}")
+    params = VITALS_SCHEMA.action_params(validated.values)
 
     try:
-        if hrv_val > 0 or heart_rate_val > 0 or sleep_hours_val > 0:
-            action_cfg_v = ActionConfig(mode=ActionMode.VALIDATE_AND_EXECUTE, return_edits=ReturnEditsMode.ALL)
-            app.logger.info(f"Attempting to create Vitals for patient ID: {patient_foundry_id} with values HRV={hrv_val}, HR={heart_rate_val}, Sleep={sleep_hours_val}")
-            response_v = ontology_client.ontology.actions.create_vitals(
-                action_config=action_cfg_v, date_=date.today(), hrv=hrv_val,
-                sleep_hours=sleep_hours_val, patient=patient_foundry_id, heart_rate=heart_rate_val,
-            )
-            if response_v and hasattr(response_v, 'validation') and response_v.validation.validation_result == "VALID":
+        if VITALS_SCHEMA.has_measurement(params):
+            app.logger.info(f"Attempting to create Vitals for patient ID: {patient_foundry_id} with values {params}")
+            result_v = submit_ontology_action("create_vitals", date_=date.today(), patient=patient_foundry_id, **params)
+            if result_v.validation_result == "VALID":
                  app.logger.info(f"Successfully created Vitals for patient ID: {patient_foundry_id}"); return True
-            elif response_v and hasattr(response_v, 'validation'):
-                 app.logger.error(f"Foundry 'create_vitals' failed validation: {response_v.validation.validation_result}")
-                 try: vd = response_v.validation._asdict(include_type_field=True); app.logger.error(f"Validation Details: {json.dumps(vd)}")
-                 except Exception: pass
+            elif result_v.validation_result:
+                 app.logger.error(f"Foundry 'create_vitals' failed validation: {result_v.validation_result}")
+                 if result_v.details: app.logger.error(f"Validation Details: {json.dumps(result_v.details)}")
                  return False
             else: app.logger.error("Foundry 'create_vitals' call bad response structure."); return False
         else:
-            app.logger.info(f"Skipping Vitals creation: All vital signs were zero after extraction/conversion (HRV={hrv_val}, HR={heart_rate_val}, Sleep={sleep_hours_val}).")
+            app.logger.info(f"Skipping Vitals creation: no valid vital signs after extraction/validation ({params}).")
             return False
-    except Exception as e: app.logger.error(f"Error during create_vitals action: {e}", exc_info=True); return False
-
-
-@app.route('/webhook/elevenlabs/postcall', methods=['POST'])
-def handle_elevenlabs_webhook():
-    print(">>> HANDLE WEBHOOK CALLED <<<")
-    app.logger.info("Received request on /webhook/elevenlabs/postcall")
-    raw_body = request.get_data()
-
-    if EXPECTED_SECRET:
-        if not verify_signature_from_raw(raw_body, request.headers): return jsonify({"status": "error", "message": "Signature verification failed"}), 403
-    else: app.logger.warning("Proceeding without signature verification.")
+    except Exception as e:
+        app.logger.error(f"Error during create_vitals action: {e}", exc_info=True)
+        if raise_errors and _retryable_write_error(e): raise
+        return False
 
-    try: data = json.loads(raw_body.decode('utf-8')); app.logger.info(f"Received top-level payload structure: {list(data.keys())}")
-    except Exception as e: app.logger.error(f"JSON parsing error: {e}"); return jsonify({"status": "error", "message": "Invalid JSON"}), 400
 
+def process_postcall_data(data, raise_errors=False, delivery_id=None):
+    """Create the PRO and Vitals for a delivery. With `raise_errors`, lookup failures and Foundry writes that
+    were certainly not applied propagate so the ingest queue retries the delivery; for queued delivery
+    `delivery_id`, writes and their follow-ups (cohort, change feed, anomalies, alerts) that finished on an
+    earlier attempt are not repeated."""
     actual_conversation_data = data.get('data')
-    if not actual_conversation_data or not isinstance(actual_conversation_data, dict): app.logger.warning("Expected 'data' key missing or invalid."); return jsonify({"status": "success", "message": "Webhook invalid format."}), 200
+    if not actual_conversation_data or not isinstance(actual_conversation_data, dict): app.logger.warning("Expected 'data' key missing or invalid."); return {"status": "success", "message": "Webhook invalid format."}, 200
     app.logger.info(f"Structure within 'data' key: {list(actual_conversation_data.keys())}")
     app.logger.debug(f"Content of 'data' key: {json.dumps(actual_conversation_data, indent=2)}")
 
     analysis = actual_conversation_data.get('analysis');
     data_collection_results = analysis.get('data_collection_results') if analysis else None
-    if not data_collection_results: app.logger.info("No 'data_collection_results' found in nested data."); return jsonify({"status": "success", "message": "No data_collection_results."}), 200
+    if not data_collection_results: app.logger.info("No 'data_collection_results' found in nested data."); return {"status": "success", "message": "No data_collection_results."}, 200
 
     patient_name_string = None
     name_collection_object = data_collection_results.get("name")
@@ -330,32 +381,294 @@ def handle_elevenlabs_webhook():
     if not patient_name_string or not patient_name_string.strip():
         app.logger.error("Patient name could not be extracted or is empty after processing data_collection_results['name'].");
         app.logger.info(f"Original data for 'name' key: {name_collection_object}")
-        return jsonify({"status": "error", "message": "Patient name could not be extracted."}), 400
+        return {"status": "error", "message": "Patient name could not be extracted."}, 400
 
     app.logger.info(f"PRE-SEARCH CHECK -> Client type: {type(foundry_client)}, Patient class type: {type(Patient)}")
-    patient_id = find_patient_by_name(patient_name_string)
+    with pipeline_metrics.stage("patient_lookup"):
+        patient_id = find_patient_by_name(patient_name_string, raise_errors=raise_errors)
 
     if patient_id:
         app.logger.info(f"Proceeding with actions for patient ID: {patient_id}")
 
+        free_text_string = None
         free_text_object = data_collection_results.get("free_text")
         if isinstance(free_text_object, dict):
             free_text_string = free_text_object.get("value"); 
-            app.logger.info(f"Extracted free_text from dict ('value' field): '{free_text_string[:50]}...'")
+            app.logger.info(f"Extracted free_text from dict ('value' field): '{(free_text_string or '')[:50]}...'")
         elif isinstance(free_text_object, str):
             free_text_string = free_text_object;
             app.logger.info(f"Extracted free_text as string: '{free_text_string[:50]}...'")
         else:
             app.logger.warning(f"Unexpected data type for 'free_text' in data_collection_results: {type(free_text_object)}")
-        ai_sentiment = None; ai_symptoms = ["none"]
-        if free_text_string and openai_client: pass # AI calls
-        pro_created = create_foundry_pro(patient_id, free_text_string, ai_sentiment, ai_symptoms)
-        vitals_created = create_foundry_vitals(patient_id, data_collection_results)
-        if pro_created or vitals_created: return jsonify({"status": "success", "message": f"Webhook processed for '{patient_name_string}'. Actions attempted."}), 200
-        else: return jsonify({"status": "success", "message": f"Webhook processed for '{patient_name_string}', but no objects created."}), 200
+        with pipeline_metrics.stage("enrichment"):
+            ai_sentiment, ai_symptoms = get_ai_enrichment(free_text_string)
+        done = ingest_queue.completed_steps(delivery_id) if delivery_id is not None else set()
+        finish = lambda step: ingest_queue.complete_step(delivery_id, step) if delivery_id is not None else None
+        # Each write's follow-ups run in the attempt that made it; a step finished earlier skips both.
+        pro_created = "pro" in done
+        if not pro_created:
+            with pipeline_metrics.stage("foundry_pro"):
+                pro_created = create_foundry_pro(patient_id, free_text_string, ai_sentiment, ai_symptoms, raise_errors=raise_errors)
+            if pro_created:
+                finish("pro")
+                pipeline_metrics.inc("pro_created")
+                if cohort_analytics is not None:
+                    cohort_analytics.add_pro(patient_id, ai_sentiment, ai_symptoms)
+                if change_feed is not None:
+                    publish_change("pro", patient_id, {
+                        "submitted_at": date.today().isoformat(), "free_text": free_text_string,
+                        "sentiment": ai_sentiment if ai_sentiment == "Positive" else "Negative",
+                        "symptoms": ai_symptoms if isinstance(ai_symptoms, list) and ai_symptoms else ["none"],
+                    })
+        vitals_values = VITALS_SCHEMA.validate(data_collection_results).values
+        anomalies = []
+        vitals_created = "vitals" in done
+        if not vitals_created:
+            with pipeline_metrics.stage("foundry_vitals"):
+                vitals_created = create_foundry_vitals(patient_id, data_collection_results, raise_errors=raise_errors)
+            if vitals_created:
+                finish("vitals")
+                pipeline_metrics.inc("vitals_created")
+                if cohort_analytics is not None:
+                    cohort_analytics.add_vitals(patient_id, vitals_values)
+                if change_feed is not None:
+                    publish_change("vitals", patient_id, VITALS_SCHEMA.record(date.today(), VITALS_SCHEMA.action_params(vitals_values)))
+                if anomaly_engine is not None:
+                    with pipeline_metrics.stage("anomaly_detection"):
+                        anomalies = anomaly_engine.observe(patient_id, vitals_values)
+                    for anomaly in anomalies: app.logger.warning(f"Vitals anomaly for patient ID {patient_id}: {anomaly.describe()}")
+                    if anomalies: pipeline_metrics.inc("vitals_anomalies", len(anomalies))
+        if alert_dispatcher is not None and "alert" not in done:
+            if alert_dispatcher.check(patient_id, patient_name_string, sentiment=ai_sentiment, symptoms=ai_symptoms, vitals=vitals_values, anomalies=anomalies):
+                pipeline_metrics.inc("alerts_queued")
+            finish("alert")
+        if pro_created or vitals_created: return {"status": "success", "message": f"Webhook processed for '{patient_name_string}'. Actions attempted."}, 200
+        else: return {"status": "success", "message": f"Webhook processed for '{patient_name_string}', but no objects created."}, 200
     else:
         app.logger.warning(f"No unique patient found for name '{patient_name_string}'. No actions taken.")
-        return jsonify({"status": "success", "message": f"Could not uniquely identify patient '{patient_name_string}'."}), 200
+        pipeline_metrics.inc("patient_not_found")
+        return {"status": "success", "message": f"Could not uniquely identify patient '{patient_name_string}'."}, 200
+
+
+def publish_change(kind, patient_id, payload):
+    # Live updates are best effort: the object already exists in Foundry and a page refresh shows it.
+    try: change_feed.publish(kind, patient_id, payload); pipeline_metrics.inc("changes_published")
+    except Exception as e: app.logger.error(f"Could not publish {kind} change for patient ID {patient_id}: {e}")
+
+
+def process_queued_delivery(raw_body, delivery_id=None):
+    try: data = json.loads(raw_body.decode('utf-8'))
+    except Exception as e: app.logger.error(f"Dropping queued delivery with invalid JSON: {e}"); return
+    with pipeline_metrics.in_flight("queue_in_flight_deliveries"), pipeline_metrics.stage("queued_processing"):
+        body, status_code = process_postcall_data(data, raise_errors=True, delivery_id=delivery_id)
+    if status_code >= 500: raise RuntimeError(body.get("message", "Processing failed"))
+    app.logger.info(f"Queued delivery processed: {body.get('message')}")
+
+
+dedup_store = None
+if WEBHOOK_DEDUP_ENABLED:
+    dedup_store = DedupStore(window_seconds=WEBHOOK_DEDUP_WINDOW_SECONDS, path=WEBHOOK_DEDUP_PATH)
+
+traffic_capture = None
+if WEBHOOK_CAPTURE_ENABLED:
+    traffic_capture = TrafficCapture(redactors=REDACTORS.get(WEBHOOK_CAPTURE_REDACTION, REDACTORS["phi"]))
+    atexit.register(traffic_capture.close)
+    app.logger.info(f"Capturing verified webhook deliveries to {traffic_capture.directory} (redaction: {WEBHOOK_CAPTURE_REDACTION})")
+
+anomaly_engine = None
+if ANOMALY_DETECTION_ENABLED and BACKGROUND_OWNER:
+    anomaly_engine = create_anomaly_engine(
+        client=foundry_client if ANOMALY_WARM_START == "ontology" else None,
+        mirror=LocalMirror() if ANOMALY_WARM_START == "mirror" else None,
+    )
+    atexit.register(anomaly_engine.stop)
+
+cohort_analytics = None
+if COHORT_ANALYTICS_ENABLED and BACKGROUND_OWNER:
+    cohort_analytics = create_cohort_analytics(
+        client=foundry_client if COHORT_SOURCE == "ontology" else None,
+        mirror=LocalMirror() if COHORT_SOURCE == "mirror" else None,
+        patient_lookup=patient_directory.get if patient_directory is not None else None,
+    )
+    atexit.register(cohort_analytics.stop)
+elif COHORT_ANALYTICS_ENABLED:
+    cohort_analytics = create_cohort_analytics(save=False)  # read-only; reloads the owner's snapshot when it changes
+
+change_feed = None
+if CHANGE_FEED_ENABLED:
+    change_feed = ChangeFeed()
+    app.logger.info(f"Publishing created PROs and Vitals to the change feed at {change_feed.path or 'memory'}")
+
+alert_dispatcher = alerts.create_dispatcher(get_twilio_client, from_number=os.getenv("TWILIO_PHONE_NUMBER")) if BACKGROUND_OWNER else None
+if alert_dispatcher is not None:
+    atexit.register(alert_dispatcher.close)
+
+ingest_queue = None
+ingest_workers = None
+if INGEST_MODE == "queue":
+    ingest_queue = IngestQueue(INGEST_QUEUE_PATH, max_attempts=INGEST_MAX_ATTEMPTS)
+    if BACKGROUND_OWNER:
+        ingest_queue.recover()  # left in 'processing' by this owner's previous run
+        ingest_workers = IngestWorkerPool(ingest_queue, process_queued_delivery, workers=INGEST_WORKERS)
+        ingest_workers.start()
+        atexit.register(ingest_workers.stop)
+    app.logger.info(f"Webhook ingest mode: queue ({INGEST_QUEUE_PATH}, {INGEST_WORKERS if BACKGROUND_OWNER else 0} workers in this process)")
+
+
+@app.route('/webhook/elevenlabs/postcall', methods=['POST'])
+def handle_elevenlabs_webhook():
+    with pipeline_metrics.in_flight("in_flight_requests"), pipeline_metrics.stage("total"), pipeline_metrics.maybe_profile():
+        return _handle_elevenlabs_webhook()
+
+
+def accept_postcall(raw_body, headers):
+    """Verify, parse and de-duplicate a delivery; returns (data, delivery keys, early (body, status) reply or None)."""
+    if EXPECTED_SECRET:
+        try:
+            with pipeline_metrics.stage("signature"):
+                verified = verify_signature_from_raw(raw_body, headers)
+        except HTTPException:
+            pipeline_metrics.inc("rejected"); raise
+        if not verified: pipeline_metrics.inc("rejected"); return None, [], ({"status": "error", "message": "Signature verification failed"}, 403)
+        pipeline_metrics.inc("verified")
+    else: app.logger.warning("Proceeding without signature verification.")
+
+    with pipeline_metrics.stage("parse"):
+        try: data = json.loads(raw_body.decode('utf-8')); app.logger.info(f"Received top-level payload structure: {list(data.keys())}")
+        except Exception as e: app.logger.error(f"JSON parsing error: {e}"); pipeline_metrics.inc("invalid_json"); return None, [], ({"status": "error", "message": "Invalid JSON"}, 400)
+
+    if traffic_capture is not None: traffic_capture.record(raw_body)
+
+    keys = delivery_keys(data, headers) if dedup_store is not None else []
+    if dedup_store is not None and not dedup_store.claim(*keys):
+        app.logger.info(f"Duplicate delivery ignored: {[k for k in keys if k]}")
+        pipeline_metrics.inc("duplicate")
+        return data, keys, ({"status": "success", "message": "Duplicate delivery ignored."}, 200)
+    return data, keys, None
+
+
+def complete_postcall(raw_body, data, keys):
+    """Queue or process an accepted delivery; blocking, so async servers run it on an executor."""
+    try:
+        if ingest_queue is not None:
+            with pipeline_metrics.stage("enqueue"):
+                delivery_id = ingest_queue.enqueue(raw_body)
+            pipeline_metrics.inc("enqueued")
+            return {"status": "accepted", "delivery_id": delivery_id}, 202
+
+        return process_postcall_data(data)
+    except Exception:
+        if dedup_store is not None: dedup_store.release(*keys)
+        pipeline_metrics.inc("error")
+        raise
+
+
+def _handle_elevenlabs_webhook():
+    print(">>> HANDLE WEBHOOK CALLED <<<")
+    app.logger.info("Received request on /webhook/elevenlabs/postcall")
+    raw_body = request.get_data()
+
+    data, keys, early_reply = accept_postcall(raw_body, request.headers)
+    if early_reply: return jsonify(early_reply[0]), early_reply[1]
+
+    body, status_code = complete_postcall(raw_body, data, keys)
+    return jsonify(body), status_code
+
+
+def queue_stats():
+    if ingest_queue is None: return {"mode": INGEST_MODE}
+    return {"mode": INGEST_MODE, "workers": ingest_workers.workers if ingest_workers is not None else 0, **ingest_queue.stats()}
+
+
+@app.route('/webhook/elevenlabs/queue', methods=['GET'])
+def ingest_queue_stats():
+    return jsonify(queue_stats()), 200
+
+
+def _collect_component_stats():
+    if ingest_queue is not None:
+        stats = ingest_queue.stats()
+        for status, count in stats["depth"].items(): yield f"queue_{status}_deliveries", count, f"Ingest queue deliveries in status {status}."
+        yield "queue_oldest_pending_age_seconds", stats["oldest_pending_age_seconds"], "Age of the oldest pending delivery."
+    if dedup_store is not None:
+        yield "dedup_tracked_keys", len(dedup_store), "Delivery keys remembered for duplicate detection."
+    if llm_cache is not None:
+        for name, value in llm_cache.stats().items(): yield f"llm_cache_{name}", value, f"LLM result cache {name.replace('_', ' ')}."
+    for name, value in enrichment_stats.items(): yield f"enrichment_{name}_notes", value, f"Notes enriched ({name.replace('_', ' ')})."
+    if write_coalescer is not None:
+        for name, value in write_coalescer.stats.items(): yield f"write_coalescer_{name}", value, f"Foundry write coalescer {name.replace('_', ' ')}."
+    if traffic_capture is not None:
+        for name, value in traffic_capture.stats.items(): yield f"capture_{name}", value, f"Traffic capture {name}."
+    if anomaly_engine is not None:
+        yield "anomaly_tracked_series", len(anomaly_engine), "Patient/vital series with an anomaly baseline."
+        yield "anomaly_warming", int(anomaly_engine.warming), "1 while baselines are still being warmed from history."
+        for name, value in anomaly_engine.stats.items(): yield f"anomaly_{name}", value, f"Anomaly engine {name}."
+    if cohort_analytics is not None:
+        for name, value in cohort_analytics.stats.items(): yield f"cohort_{name}", value, f"Cohort analytics {name}."
+    if change_feed is not None:
+        yield "change_feed_open_streams", change_feed.stats["streams"], "Change-feed event streams open in this process."
+        yield "change_feed_pruned", change_feed.stats["pruned"], "Change-feed entries removed after the retention period."
+    if alert_dispatcher is not None:
+        yield "alerts_pending_patients", alert_dispatcher.pending(), "Patients with an alert waiting to be sent."
+        for name, value in alert_dispatcher.stats.items(): yield f"alerts_{name}", value, f"Clinician alert {name}."
+    for name, state in breaker_states().items():
+        yield f"circuit_{name}_state", STATE_CODES[state["state"]], f"Circuit breaker state for {name} (0 closed, 1 half-open, 2 open)."
+        yield f"circuit_{name}_rejected", state["rejected"], f"Calls to {name} rejected while the circuit was open."
+    if patient_directory is not None:
+        yield "patient_directory_size", len(patient_directory), "Patients held in the in-memory directory."
+
+pipeline_metrics.register_collector(_collect_component_stats)
+
+
+@app.route('/health/dependencies', methods=['GET'])
+def dependency_health():
+    states = breaker_states()
+    return jsonify(states), 200 if all(s["state"] != "open" for s in states.values()) else 503
+
+
+def cohort_summary(condition=None):
+    if cohort_analytics is None:
+        return None
+    if not BACKGROUND_OWNER: cohort_analytics.reload_if_changed()
+    records = lambda frame: frame.astype(object).where(frame.notna(), None).to_dict("records")
+    return {
+        "warming": cohort_analytics.warming,
+        "conditions": cohort_analytics.conditions(),
+        "sentiment_rates": records(cohort_analytics.sentiment_rates(condition)),
+        "symptom_frequencies": records(cohort_analytics.symptom_frequencies(condition)),
+        "vitals_deltas": records(cohort_analytics.vitals_deltas(condition)),
+    }
+
+
+@app.route('/analytics/cohort', methods=['GET'])
+def cohort_analytics_view():
+    if COHORT_API_TOKEN is None:
+        return jsonify({"status": "error", "message": "The cohort analytics API is disabled (set COHORT_API_TOKEN to enable it)."}), 404
+    if not bearer_authorized(request.headers, COHORT_API_TOKEN):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    summary = cohort_summary(request.args.get("condition") or None)
+    if summary is None:
+        return jsonify({"status": "error", "message": "Cohort analytics are disabled."}), 404
+    return app.response_class(json.dumps(summary, default=str), mimetype="application/json")
+
+
+@app.route('/changes/stream', methods=['GET'])
+def change_stream():
+    """Server-sent events for PROEntity and Vitals objects the webhook creates for `?patient=<id>`."""
+    if change_feed is None or CHANGE_FEED_TOKEN is None:
+        return jsonify({"status": "error", "message": "The change feed stream is disabled (set CHANGE_FEED_TOKEN to enable it)."}), 404
+    if not bearer_authorized(request.headers):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    patient_id, after = stream_params(request.args, request.headers)
+    if not patient_id:
+        return jsonify({"status": "error", "message": "Missing 'patient' parameter."}), 400
+    return Response(change_feed.stream(patient_id, after), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(pipeline_metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 if __name__ == '__main__':
     log = app.logger if app else logging
@@ -0,0 +1,129 @@
+"""Production entry point for the ElevenLabs post-call webhook.
+
+    python asgi_app.py            # or: uvicorn asgi_app:app --workers 4
+
+Serves the same /webhook/elevenlabs/postcall contract as app.py (plus /metrics and the queue
+stats route) on uvicorn with several worker processes. Blocking Foundry/OpenAI work runs on a
+bounded thread pool, and shutdown waits for in-flight requests to finish.
+
+Every process that imports app.py competes for WEBHOOK_OWNER_LOCK_PATH; only the holder (the
+supervisor when started as `python asgi_app.py`) runs the ingest workers, anomaly engine, cohort
+snapshot and alert dispatcher. The other workers verify and queue deliveries, so more than one
+worker requires WEBHOOK_INGEST_MODE=queue.
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from werkzeug.exceptions import HTTPException
+
+import app as webhook
+from change_feed import CHANGE_FEED_TOKEN, authorized as bearer_authorized, stream_params
+
+
+logger = logging.getLogger(__name__)
+
+ASGI_HOST = os.getenv("ASGI_HOST", "0.0.0.0")
+ASGI_PORT = int(os.getenv("ASGI_PORT", "5000"))
+ASGI_WORKERS = int(os.getenv("ASGI_WORKERS", "4"))
+ASGI_EXECUTOR_THREADS = int(os.getenv("ASGI_EXECUTOR_THREADS", "16"))
+ASGI_MAX_PENDING = int(os.getenv("ASGI_MAX_PENDING", str(ASGI_EXECUTOR_THREADS * 4)))
+ASGI_GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("ASGI_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_THREADS, thread_name_prefix="webhook")
+_pending_slots = asyncio.Semaphore(ASGI_MAX_PENDING)
+
+
+async def run_blocking(fn, *args):
+    async with _pending_slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    logger.info(f"Webhook ASGI worker started ({ASGI_EXECUTOR_THREADS} executor threads, ingest mode: {webhook.INGEST_MODE})")
+    yield
+    logger.info("Draining webhook executor...")
+    await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+    if webhook.ingest_workers is not None:
+        webhook.ingest_workers.stop(timeout=ASGI_GRACEFUL_SHUTDOWN_SECONDS)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post('/webhook/elevenlabs/postcall')
+async def handle_elevenlabs_webhook(request: Request):
+    metrics = webhook.pipeline_metrics
+    with metrics.in_flight("in_flight_requests"), metrics.stage("total"):
+        raw_body = await request.body()
+        try:
+            data, keys, early_reply = await run_blocking(webhook.accept_postcall, raw_body, request.headers)
+        except HTTPException as e:
+            return JSONResponse({"status": "error", "message": e.description}, status_code=e.code)
+        if early_reply:
+            return JSONResponse(early_reply[0], status_code=early_reply[1])
+
+        body, status_code = await run_blocking(webhook.complete_postcall, raw_body, data, keys)
+        return JSONResponse(body, status_code=status_code)
+
+
+@app.get('/webhook/elevenlabs/queue')
+async def ingest_queue_stats():
+    return JSONResponse(await run_blocking(webhook.queue_stats))
+
+
+@app.get('/health/dependencies')
+async def dependency_health():
+    states = webhook.breaker_states()
+    return JSONResponse(states, status_code=200 if all(s["state"] != "open" for s in states.values()) else 503)
+
+
+@app.get('/analytics/cohort')
+async def cohort_analytics_view(request: Request, condition: str = None):
+    if webhook.COHORT_API_TOKEN is None:
+        return JSONResponse({"status": "error", "message": "The cohort analytics API is disabled (set COHORT_API_TOKEN to enable it)."}, status_code=404)
+    if not bearer_authorized(request.headers, webhook.COHORT_API_TOKEN):
+        return JSONResponse({"status": "error", "message": "Unauthorized"}, status_code=401)
+    summary = webhook.cohort_summary(condition or None)
+    if summary is None:
+        return JSONResponse({"status": "error", "message": "Cohort analytics are disabled."}, status_code=404)
+    return JSONResponse(json.loads(json.dumps(summary, default=str)))
+
+
+@app.get('/changes/stream')
+async def change_stream(request: Request):
+    feed = webhook.change_feed
+    if feed is None or CHANGE_FEED_TOKEN is None:
+        return JSONResponse({"status": "error", "message": "The change feed stream is disabled (set CHANGE_FEED_TOKEN to enable it)."}, status_code=404)
+    if not bearer_authorized(request.headers):
+        return JSONResponse({"status": "error", "message": "Unauthorized"}, status_code=401)
+    patient_id, after = stream_params(request.query_params, request.headers)
+    if not patient_id:
+        return JSONResponse({"status": "error", "message": "Missing 'patient' parameter."}, status_code=400)
+    return StreamingResponse(feed.astream(patient_id, after, disconnected=request.is_disconnected), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    return PlainTextResponse(await run_blocking(webhook.pipeline_metrics.render), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == '__main__':
+    if ASGI_WORKERS > 1 and webhook.INGEST_MODE != "queue":
+        raise SystemExit("ASGI_WORKERS > 1 needs WEBHOOK_INGEST_MODE=queue: only one process runs the background components.")
+    os.environ["WEBHOOK_WORKERS"] = str(ASGI_WORKERS)  # inherited by the worker processes importing app.py
+    uvicorn.run(
+        "asgi_app:app",
+        host=ASGI_HOST,
+        port=ASGI_PORT,
+        workers=ASGI_WORKERS,
+        timeout_graceful_shutdown=ASGI_GRACEFUL_SHUTDOWN_SECONDS,
+    )
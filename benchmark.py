@@ -0,0 +1,368 @@
+"""Load test for the post-call webhook against in-process Foundry and OpenAI stand-ins.
+
+    python benchmark.py --requests 1000 --concurrency 16 --foundry-latency-ms 40 --openai-latency-ms 300
+    python benchmark.py --compare data/benchmarks/bench-1700000000.json
+
+Payloads are realistic ElevenLabs post-call transcriptions signed with the configured webhook secret.
+Stand-ins are installed through the client registry before the app is imported, so no request leaves
+the process. Results (throughput, latency percentiles, per-stage timings) are saved as JSON.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from webhook_signature import sign
+
+
+BENCHMARK_DIR = os.getenv("BENCHMARK_DIR", "data/benchmarks")
+
+SYMPTOM_VOCABULARY = ["fatigue", "headache", "nausea", "dizziness", "shortness of breath", "cough", "fever", "chest pain", "insomnia", "joint pain"]
+FIRST_NAMES = ["Alice", "Bob", "Carmen", "David", "Elena", "Farid", "Grace", "Hiro", "Isabel", "Jamal", "Kira", "Liam", "Maya", "Noah", "Olga", "Priya"]
+LAST_NAMES = ["Anderson", "Brown", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Hughes", "Ivanova", "Johnson", "Kowalski", "Lopez", "Martin", "Nguyen"]
+
+
+class Latency:
+    """Sleeps for a jittered delay and raises on a fraction of calls."""
+
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, error_rate=0.0, name="stand-in"):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.name = name
+
+    def __call__(self):
+        delay = max(0.0, random.gauss(self.mean_ms, self.jitter_ms)) if self.jitter_ms else self.mean_ms
+        if delay: time.sleep(delay / 1000.0)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError(f"Injected {self.name} error")
+
+
+# --- Foundry stand-in -------------------------------------------------------------------------
+
+class _FakeValidation:
+    def __init__(self, validation_result):
+        self.validation_result = validation_result
+
+    def _asdict(self, include_type_field=False):
+        return {"result": self.validation_result}
+
+
+class _FakePatientQuery:
+    def __init__(self, patients, clause):
+        self.patients = patients
+        self.clause = clause
+
+    def take(self, n):
+        # The SDK's clause object is opaque here; match on its value or, failing that, its repr.
+        value = getattr(self.clause, "value", None)
+        text = value if isinstance(value, str) else repr(self.clause)
+        return [p for p in self.patients if p.name == text or (value is None and p.name in text)][:n]
+
+
+class _FakePatientSet:
+    def __init__(self, patients, latency):
+        self.patients = patients
+        self.latency = latency
+
+    def iterate(self):
+        self.latency()
+        return iter(self.patients)
+
+    def where(self, clause):
+        self.latency()
+        return _FakePatientQuery(self.patients, clause)
+
+
+class _FakeActions:
+    """Any attribute is an action that validates after the configured latency."""
+
+    def __init__(self, latency, calls):
+        self._latency = latency
+        self._calls = calls
+
+    def __getattr__(self, action_name):
+        if action_name.startswith("_"):
+            raise AttributeError(action_name)
+
+        def action(**params):
+            self._latency()
+            self._calls[action_name] = self._calls.get(action_name, 0) + len(params.get("requests", [None]))
+            return SimpleNamespace(validation=_FakeValidation("VALID"))
+        return action
+
+
+class FakeFoundryClient:
+    """The slice of FoundryClient used by the webhook: Patient reads, empty Vitals/PRO histories, plus actions and batch actions."""
+
+    def __init__(self, patients, latency):
+        self.calls = {}
+        self.ontology = SimpleNamespace(
+            objects=SimpleNamespace(Patient=_FakePatientSet(patients, latency), Vitals=SimpleNamespace(iterate=lambda: iter(())),
+                                    Proentity=SimpleNamespace(iterate=lambda: iter(()))),
+            actions=_FakeActions(latency, self.calls),
+            batch_actions=_FakeActions(latency, self.calls),
+        )
+
+
+# --- OpenAI stand-in --------------------------------------------------------------------------
+
+class _FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model, messages, response_format=None, **kwargs):
+        from enrichment import SENTIMENT_PROMPT
+
+        self.latency()
+        system, text = messages[0]["content"], messages[-1]["content"].lower()
+        symptoms = [s for s in SYMPTOM_VOCABULARY if s in text] or ["none"]
+        sentiment = "Negative" if symptoms != ["none"] else "Positive"
+        if response_format is not None:
+            content = json.dumps({"sentiment": sentiment, "symptoms": symptoms})
+        elif system == SENTIMENT_PROMPT:
+            content = sentiment
+        else:
+            content = json.dumps(symptoms)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeOpenAIClient:
+    def __init__(self, latency):
+        self.chat = SimpleNamespace(completions=_FakeCompletions(latency))
+
+    def with_options(self, **kwargs):
+        return self
+
+
+# --- Payloads ---------------------------------------------------------------------------------
+
+def make_patients(n, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < min(n, len(FIRST_NAMES) * len(LAST_NAMES)):
+        names.add(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}")
+    return [SimpleNamespace(id=f"PT{i:05d}", name=name) for i, name in enumerate(sorted(names))]
+
+
+def make_payload(patient_name, transcript_turns=30, rng=random):
+    symptoms = rng.sample(SYMPTOM_VOCABULARY, rng.randint(0, 3))
+    free_text = f"I have been feeling {'unwell, mostly ' + ', '.join(symptoms) if symptoms else 'pretty good this week'}. Call ref {uuid.uuid4().hex[:8]}."
+    transcript = []
+    for turn in range(transcript_turns):
+        role = "agent" if turn % 2 == 0 else "user"
+        words = " ".join(rng.choice(["how", "are", "you", "feeling", "today", "sleep", "heart", "rate", "okay", "tired", "better", "the", "and"]) for _ in range(rng.randint(8, 30)))
+        transcript.append({"role": role, "message": words.capitalize() + ".", "time_in_call_secs": turn * 7})
+
+    def collected(key, value):
+        return {"data_collection_id": key, "value": value, "json_schema": {"type": "string"}, "rationale": f"The user stated their {key}."}
+
+    return {
+        "type": "post_call_transcription",
+        "event_timestamp": int(time.time()),
+        "data": {
+            "agent_id": "agent_benchmark",
+            "conversation_id": f"conv_{uuid.uuid4().hex}",
+            "status": "done",
+            "transcript": transcript,
+            "metadata": {"start_time_unix_secs": int(time.time()) - 300, "call_duration_secs": 300, "cost": 1200},
+            "analysis": {
+                "call_successful": "success",
+                "transcript_summary": "Routine check-in call with the patient.",
+                "data_collection_results": {
+                    "name": collected("name", patient_name),
+                    "free_text": collected("free_text", free_text),
+                    "hrv": collected("hrv", rng.randint(20, 90)),
+                    "heart_rate": collected("heart_rate", rng.randint(50, 110)),
+                    "sleep_hours": collected("sleep_hours", round(rng.uniform(3, 10), 1)),
+                },
+            },
+        },
+    }
+
+
+# --- Runner -----------------------------------------------------------------------------------
+
+def _percentile(sorted_values, q):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _stage_breakdown(before, after, buckets):
+    stages = {}
+    for name, h in after["stages"].items():
+        prev = before["stages"].get(name, {"count": 0, "sum": 0.0, "counts": [0] * len(h["counts"])})
+        count = h["count"] - prev["count"]
+        if not count: continue
+        counts = [a - b for a, b in zip(h["counts"], prev["counts"])]
+        bounds = list(buckets) + [float("inf")]
+
+        def quantile(q):
+            running = 0
+            for bound, c in zip(bounds, counts):
+                running += c
+                if running >= q * count: return bound * 1000.0
+            return None
+
+        stages[name] = {"count": count, "mean_ms": round((h["sum"] - prev["sum"]) / count * 1000.0, 3), "p50_ms_le": quantile(0.5), "p99_ms_le": quantile(0.99)}
+    return stages
+
+
+def install_stand_ins(patients, foundry_latency, openai_latency):
+    """Register the stand-ins and the environment the app reads at import time; returns the Foundry stand-in."""
+    import clients
+
+    os.environ.setdefault("ELEVENLABS_WEBHOOK_SECRET", "benchmark-secret")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("LLM_CACHE_PATH", "")
+    os.environ.setdefault("WEBHOOK_DEDUP_PATH", "")
+    os.environ.setdefault("ALERT_TRANSPORT", "fake")
+    os.environ.setdefault("ALERT_RECIPIENTS", "+15550100000")
+    os.environ.setdefault("ALERT_RATE_PER_SECOND", "0")
+    os.environ.setdefault("ANOMALY_SNAPSHOT_PATH", "")
+    os.environ.setdefault("COHORT_DIR", "")
+    os.environ.setdefault("CHANGE_FEED_PATH", "")
+    os.environ.setdefault("WEBHOOK_OWNER_LOCK_PATH", "")
+    foundry = FakeFoundryClient(patients, foundry_latency)
+    clients.override("foundry", foundry)
+    clients.override("openai", FakeOpenAIClient(openai_latency))
+    return foundry
+
+
+def run_benchmark(requests=500, concurrency=8, warmup=20, patients=200, transcript_turns=30, unknown_patient_rate=0.0,
+                  foundry_latency=None, openai_latency=None, seed=0, log_level="WARNING"):
+    rng = random.Random(seed)
+    patient_list = make_patients(patients, seed)
+    foundry = install_stand_ins(patient_list, foundry_latency or Latency(name="Foundry"), openai_latency or Latency(name="OpenAI"))
+    import app as webhook
+
+    webhook.app.logger.setLevel(log_level)
+    if webhook.patient_directory is not None and not webhook.patient_directory.loaded:
+        webhook.patient_directory.refresh()
+    secret = os.environ["ELEVENLABS_WEBHOOK_SECRET"]
+    bodies = []
+    for _ in range(warmup + requests):
+        name = "Unknown Caller" if rng.random() < unknown_patient_rate else rng.choice(patient_list).name
+        bodies.append(json.dumps(make_payload(name, transcript_turns, rng)).encode("utf-8"))
+
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(raw_body, record=True):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = webhook.app.test_client()
+        started = time.perf_counter()
+        try: status = client.post("/webhook/elevenlabs/postcall", data=raw_body, content_type="application/json",
+                                  headers={"ElevenLabs-Signature": sign(raw_body, secret)}).status_code
+        except Exception: status = "exception"
+        elapsed = time.perf_counter() - started
+        if record:
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda b: send(b, record=False), bodies[:warmup]))
+        before = webhook.pipeline_metrics.snapshot()
+        started = time.perf_counter()
+        list(pool.map(send, bodies[warmup:]))
+        wall = time.perf_counter() - started
+    after = webhook.pipeline_metrics.snapshot()
+
+    if webhook.ingest_queue is not None:
+        print("Queue mode: latencies cover acceptance only; waiting for workers to drain...", file=sys.stderr)
+        while True:
+            depth = webhook.ingest_queue.stats()["depth"]
+            if not depth["pending"] + depth["processing"]: break
+            time.sleep(0.2)
+        after = webhook.pipeline_metrics.snapshot()
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000.0, 3) if ordered else None,
+            **{f"p{int(q * 100)}": round(_percentile(ordered, q) * 1000.0, 3) if ordered else None for q in (0.5, 0.9, 0.95, 0.99)},
+            "max": round(ordered[-1] * 1000.0, 3) if ordered else None,
+        },
+        "status_counts": statuses,
+        "stages": _stage_breakdown(before, after, webhook.pipeline_metrics.buckets),
+        "outcomes": {k: v - before["outcomes"].get(k, 0) for k, v in after["outcomes"].items() if v - before["outcomes"].get(k, 0)},
+        "foundry_calls": dict(foundry.calls),
+        "payload_bytes_avg": round(sum(len(b) for b in bodies[warmup:]) / max(1, requests)),
+    }
+
+
+def _git_revision():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception: return None
+
+
+def save_result(result, directory=BENCHMARK_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"bench-{int(time.time())}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def compare(current, previous):
+    rows = [("throughput_rps", current["throughput_rps"], previous.get("throughput_rps"))]
+    rows += [(f"latency {k} ms", v, previous.get("latency_ms", {}).get(k)) for k, v in current["latency_ms"].items()]
+    rows += [(f"stage {k} mean ms", v["mean_ms"], previous.get("stages", {}).get(k, {}).get("mean_ms")) for k, v in sorted(current["stages"].items())]
+    for label, now, before in rows:
+        change = f"{(now - before) / before * 100:+.1f}%" if now is not None and before else "n/a"
+        print(f"  {label:<32} {now!s:>10} vs {before!s:>10}  {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the post-call webhook with local Foundry/OpenAI stand-ins.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--transcript-turns", type=int, default=30, help="Transcript length; controls payload size")
+    parser.add_argument("--unknown-patient-rate", type=float, default=0.0)
+    parser.add_argument("--foundry-latency-ms", type=float, default=30.0)
+    parser.add_argument("--foundry-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--foundry-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=250.0)
+    parser.add_argument("--openai-jitter-ms", type=float, default=75.0)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING", help="App log level during the run (INFO logging is part of the cost)")
+    parser.add_argument("--label", help="Free-form note stored with the result")
+    parser.add_argument("--compare", help="Previous result JSON to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        requests=args.requests, concurrency=args.concurrency, warmup=args.warmup, patients=args.patients,
+        transcript_turns=args.transcript_turns, unknown_patient_rate=args.unknown_patient_rate, seed=args.seed, log_level=args.log_level,
+        foundry_latency=Latency(args.foundry_latency_ms, args.foundry_jitter_ms, args.foundry_error_rate, name="Foundry"),
+        openai_latency=Latency(args.openai_latency_ms, args.openai_jitter_ms, args.openai_error_rate, name="OpenAI"),
+    )
+    result = {"label": args.label, "revision": _git_revision(), "timestamp": time.time(), "config": vars(args), **result}
+    print(json.dumps({k: result[k] for k in ("throughput_rps", "latency_ms", "status_counts", "outcomes")}, indent=2))
+    for stage, s in sorted(result["stages"].items()):
+        print(f"  {stage:<20} n={s['count']:<6} mean={s['mean_ms']:.1f}ms p50<={s['p50_ms_le']}ms p99<={s['p99_ms_le']}ms")
+    if not args.no_save:
+        print(f"Saved {save_result(result)}")
+    if args.compare:
+        with open(args.compare) as f:
+            print(f"Compared with {args.compare}:")
+            compare(result, json.load(f))
@@ -0,0 +1,256 @@
+"""Resumable, rate-limited bulk import of historical PROs and vitals from CSV or JSONL.
+
+    python list_and_submit.py import history.csv --kind pro --concurrency 8 --rate 20
+
+Rows are submitted from a thread pool; a checkpoint file records finished lines so an interrupted
+run picks up where it stopped, and rejected rows are appended to `<checkpoint>.errors.jsonl`.
+"""
+import csv
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+from local_mirror import require_full_sync
+from vitals_schema import COMBINED_BLOOD_PRESSURE_KEYS, VITALS_SCHEMA
+from resilience import RateLimiter
+from write_coalescer import WriteCoalescer, apply_action, rejected
+
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Tracks the highest line below which every row is finished, plus finished rows above it."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.next_line = 0
+        self.done_above = set()
+        self.counts = {"ok": 0, "failed": 0}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("source") == self.source:
+                self.next_line = state["next_line"]
+                self.done_above = set(state.get("done_above", []))
+                self.counts = state.get("counts", self.counts)
+                logger.info(f"Resuming {source} from line {self.next_line} ({len(self.done_above)} later rows already done)")
+
+    def is_done(self, line_no):
+        return line_no < self.next_line or line_no in self.done_above
+
+    def mark(self, line_no, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.done_above.add(line_no)
+            while self.next_line in self.done_above:
+                self.done_above.remove(self.next_line)
+                self.next_line += 1
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {"source": self.source, "next_line": self.next_line, "done_above": sorted(self.done_above), "counts": self.counts}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+
+def read_rows(path, fmt=None):
+    """Yield (line_no, row dict) from a CSV or JSONL file without loading it into memory."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(f)):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f):
+                if line.strip():
+                    yield line_no, json.loads(line)
+
+
+def _parse_symptoms(value):
+    if isinstance(value, list): return value or ["none"]
+    if not value: return ["none"]
+    try:
+        parsed = json.loads(value)
+        if isinstance(parsed, list): return parsed or ["none"]
+    except (TypeError, json.JSONDecodeError):
+        pass
+    return [s.strip() for s in str(value).split(";") if s.strip()] or ["none"]
+
+
+def _as_date(value):
+    if not value: return date.today()
+    if isinstance(value, date): return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def pro_params(row, patient_id, enrich=None):
+    free_text = row.get("free_text") or ""
+    sentiment = row.get("sentiment") or None
+    symptoms = _parse_symptoms(row.get("symptoms"))
+    if enrich and free_text and (sentiment is None or symptoms == ["none"]):
+        enriched = enrich(free_text)
+        sentiment = sentiment or enriched.sentiment
+        if symptoms == ["none"]: symptoms = enriched.symptoms
+    return {
+        "patient": patient_id,
+        "submitted_at": _as_date(row.get("submitted_at")).isoformat(),
+        "free_text": free_text,
+        "sentiment": sentiment if sentiment == "Positive" else "Negative",
+        "symptoms": symptoms,
+    }
+
+
+def vitals_params(row, patient_id):
+    validated = VITALS_SCHEMA.validate(row)
+    if validated.errors:
+        raise ValueError("; ".join(f"{name}: {reason}" for name, reason in validated.errors.items()))
+    return {
+        "patient": patient_id,
+        "date_": _as_date(row.get("date") or row.get("date_")),
+        **VITALS_SCHEMA.action_params(validated.values),
+    }
+
+
+def validate_vitals_file(path, fmt=None, chunk_size=10000, errors_path=None):
+    """Range-check every vital in a vitals file without submitting anything.
+
+    Rows are checked `chunk_size` at a time through the schema's vectorized validator; rejected
+    readings are written to `errors_path` (line, vital, raw value) when given.
+    """
+    invalid_counts = dict.fromkeys(VITALS_SCHEMA.by_name, 0)
+    rows_checked = rows_invalid = 0
+    errors = open(errors_path, "w") if errors_path else None
+    try:
+        chunk = []
+        for item in itertools.chain(read_rows(path, fmt), [None]):
+            if item is not None:
+                chunk.append(item)
+                if len(chunk) < chunk_size: continue
+            if not chunk: break
+            line_nos = [line_no for line_no, _ in chunk]
+            frame = pd.DataFrame([row for _, row in chunk], index=line_nos)
+            _, invalid = VITALS_SCHEMA.validate_batch(frame)
+            rows_checked += len(frame)
+            rows_invalid += int(invalid.any(axis=1).sum())
+            for name, count in invalid.sum().items(): invalid_counts[name] += int(count)
+            if errors is not None:
+                for r, c in zip(*invalid.to_numpy().nonzero()):
+                    name = invalid.columns[c]
+                    keys = VITALS_SCHEMA.by_name[name].source_keys + COMBINED_BLOOD_PRESSURE_KEYS
+                    key = next((k for k in keys if k in frame.columns), None)
+                    raw = frame.iat[r, frame.columns.get_loc(key)] if key else None
+                    errors.write(json.dumps({"line": line_nos[r], "vital": name, "value": None if raw is None else str(raw)}) + "\n")
+            chunk = []
+    finally:
+        if errors is not None: errors.close()
+    print(f"[vitals] checked {rows_checked} rows: {rows_invalid} with rejected readings {({k: v for k, v in invalid_counts.items() if v})}", flush=True)
+    return {"rows": rows_checked, "invalid_rows": rows_invalid, "invalid": invalid_counts}
+
+
+ACTIONS = {"pro": ("create_proentity", pro_params), "vitals": ("create_vitals", vitals_params)}
+MIRROR_TYPES = {"pro": "pros", "vitals": "vitals"}
+
+
+class PatientResolver:
+    """Maps a row's patient_id / patient_name to a Patient primary key, one lookup per distinct name."""
+
+    def __init__(self, client):
+        self.client = client
+        self._directory = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, row):
+        if row.get("patient_id"):
+            return row["patient_id"]
+        name = row.get("patient_name") or row.get("name")
+        if not name:
+            return None
+        with self._lock:
+            if name not in self._cache:
+                if self._directory is None:
+                    from patient_directory import PatientDirectory
+                    self._directory = PatientDirectory(self.client)
+                    self._directory.refresh()
+                match = self._directory.lookup(name)
+                self._cache[name] = match.patient_id if match and match.method == "exact" and not match.ambiguous else None
+            return self._cache[name]
+
+
+def run_import(client, path, kind, fmt=None, concurrency=8, rate=0.0, enrich=None, checkpoint_path=None,
+               batch_size=1, report_every=2.0, errors_path=None):
+    action_name, build_params = ACTIONS[kind]
+    checkpoint = Checkpoint(checkpoint_path, path)
+    resolver = PatientResolver(client)
+    limiter = RateLimiter(rate)
+    coalescer = WriteCoalescer(client, window=0.05, max_batch=batch_size) if batch_size > 1 else None
+    errors_path = errors_path or (checkpoint_path + ".errors.jsonl" if checkpoint_path else None)
+    errors_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    retry_later = []
+
+    def record_error(line_no, reason):
+        logger.warning(f"Line {line_no}: {reason}")
+        if errors_path:
+            with errors_lock, open(errors_path, "a") as f:
+                f.write(json.dumps({"line": line_no, "error": str(reason)}) + "\n")
+
+    def submit(line_no, row):
+        try:
+            patient_id = resolver.resolve(row)
+            if not patient_id:
+                record_error(line_no, "patient could not be resolved"); checkpoint.mark(line_no, "failed"); return
+            params = build_params(row, patient_id, enrich) if kind == "pro" else build_params(row, patient_id)
+            limiter.acquire()
+            result = coalescer.submit(action_name, **params).result() if coalescer else apply_action(client, action_name, params)
+            if result.validation_result == "VALID":
+                checkpoint.mark(line_no, "ok")
+            else:
+                record_error(line_no, f"validation {result.validation_result}: {result.details}"); checkpoint.mark(line_no, "failed")
+        except Exception as e:
+            # Bad rows and 4xx rejections fail the same way every time; anything else (429, timeouts, dropped
+            # connections, 5xx) is left unmarked so the next run over the checkpoint retries the row.
+            if isinstance(e, ValueError) or rejected(e):
+                record_error(line_no, e); checkpoint.mark(line_no, "failed")
+            else:
+                record_error(line_no, f"{e} (will be retried on the next run)"); retry_later.append(line_no)
+        finally:
+            in_flight.release()
+
+    started = last_report = time.monotonic()
+    processed_at_start = sum(checkpoint.counts.values())
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-import") as pool:
+        for line_no, row in read_rows(path, fmt):
+            if checkpoint.is_done(line_no):
+                continue
+            in_flight.acquire()
+            pool.submit(submit, line_no, row)
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                last_report = now
+                checkpoint.save()
+                done = sum(checkpoint.counts.values()) - processed_at_start
+                print(f"[{kind}] line {checkpoint.next_line}: {checkpoint.counts['ok']} ok, {checkpoint.counts['failed']} failed, {done / (now - started):.1f} rows/s", flush=True)
+    checkpoint.save()
+    elapsed = time.monotonic() - started
+    done = sum(checkpoint.counts.values()) - processed_at_start
+    print(f"[{kind}] finished: {checkpoint.counts['ok']} ok, {checkpoint.counts['failed']} failed, {done} rows in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} rows/s)", flush=True)
+    if retry_later:
+        print(f"[{kind}] {len(retry_later)} rows hit transient errors and were not checkpointed; run the import again to retry them", flush=True)
+    # Historical rows are dated before the mirror's watermark, so an incremental sync would never see them.
+    if checkpoint.counts["ok"]: require_full_sync(MIRROR_TYPES[kind])
+    return {**checkpoint.counts, "retry": len(retry_later)}
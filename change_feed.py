@@ -0,0 +1,230 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from resilience import backoff_delays
+
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_PATH = os.getenv("CHANGE_FEED_PATH", "data/change_feed.sqlite3")
+CHANGE_FEED_RETENTION_SECONDS = float(os.getenv("CHANGE_FEED_RETENTION_SECONDS", "86400"))
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "0.5"))
+CHANGE_FEED_KEEPALIVE_SECONDS = float(os.getenv("CHANGE_FEED_KEEPALIVE_SECONDS", "15"))
+# Bearer token for /changes/stream; the stream carries patient notes, so it is not served without one.
+CHANGE_FEED_TOKEN = os.getenv("CHANGE_FEED_TOKEN") or None
+# Base URL of the webhook app for subscribers on another host; empty = read the shared log file directly.
+CHANGE_FEED_URL = os.getenv("CHANGE_FEED_URL", "").rstrip("/")
+
+PRUNE_EVERY = 1000
+
+
+class ChangeFeed:
+    """Append-only SQLite (WAL) log of objects created by the webhook, read per patient by sequence number.
+
+    Several processes (ASGI workers, ingest workers) can publish to the same file; readers in this
+    process are woken immediately and readers elsewhere see new rows on their next poll. With an
+    empty `path` the log lives in memory and is only visible to this process.
+    """
+
+    def __init__(self, path=CHANGE_FEED_PATH, retention_seconds=CHANGE_FEED_RETENTION_SECONDS, poll_seconds=CHANGE_FEED_POLL_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.poll_seconds = poll_seconds
+        self.stats = {"published": 0, "pruned": 0, "streams": 0}
+        self._lock = threading.Lock()
+        self._published = threading.Condition()
+        if path and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", timeout=30, isolation_level=None, check_same_thread=False)
+        if path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # Losing the last entries in a power cut only costs a live update; the objects are in Foundry.
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=30000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " patient TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " payload TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_changes_patient ON changes (patient, seq)")
+
+    def publish(self, kind, patient_id, payload):
+        """Record a created object ("pro" or "vitals") for a patient; returns its sequence number."""
+        with self._lock:
+            seq = self._db.execute(
+                "INSERT INTO changes (patient, kind, created_at, payload) VALUES (?, ?, ?, ?)",
+                (str(patient_id), kind, time.time(), json.dumps(payload, default=str)),
+            ).lastrowid
+            self.stats["published"] += 1
+            if self.stats["published"] % PRUNE_EVERY == 0:
+                self.stats["pruned"] += self._db.execute("DELETE FROM changes WHERE created_at < ?", (time.time() - self.retention_seconds,)).rowcount
+        with self._published:
+            self._published.notify_all()
+        return seq
+
+    def since(self, patient_id, after=0, limit=500):
+        """Changes for a patient with a sequence number above `after`, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, kind, created_at, payload FROM changes WHERE patient = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (str(patient_id), int(after), limit),
+            ).fetchall()
+        return [{"seq": seq, "kind": kind, "patient": str(patient_id), "created_at": created_at, "data": json.loads(payload)}
+                for seq, kind, created_at, payload in rows]
+
+    def wait(self, patient_id, after=0, timeout=CHANGE_FEED_KEEPALIVE_SECONDS):
+        """Block until the patient has changes after `after` or `timeout` passes; returns them (possibly none)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            changes = self.since(patient_id, after)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            with self._published:
+                self._published.wait(min(self.poll_seconds, remaining))
+
+    def stream(self, patient_id, after=0, keepalive=CHANGE_FEED_KEEPALIVE_SECONDS):
+        """Server-sent events for a patient's changes after `after`, with a comment line every `keepalive` seconds."""
+        self.stats["streams"] += 1
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                changes = self.wait(patient_id, after, keepalive)
+                for change in changes:
+                    yield sse_event(change)
+                    after = change["seq"]
+                if not changes:
+                    yield ": keepalive\n\n"
+        finally:
+            self.stats["streams"] -= 1
+
+    async def astream(self, patient_id, after=0, keepalive=CHANGE_FEED_KEEPALIVE_SECONDS, disconnected=None):
+        """`stream` for asyncio servers: polls every `poll_seconds` without holding a thread; stops once `disconnected()` is true."""
+        self.stats["streams"] += 1
+        try:
+            yield "retry: 2000\n\n"
+            quiet_since = time.monotonic()
+            while disconnected is None or not await disconnected():
+                changes = self.since(patient_id, after)
+                for change in changes:
+                    yield sse_event(change)
+                    after = change["seq"]
+                if changes:
+                    quiet_since = time.monotonic()
+                elif time.monotonic() - quiet_since >= keepalive:
+                    yield ": keepalive\n\n"
+                    quiet_since = time.monotonic()
+                await asyncio.sleep(self.poll_seconds)
+        finally:
+            self.stats["streams"] -= 1
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def sse_event(change):
+    return f"id: {change['seq']}\nevent: {change['kind']}\ndata: {json.dumps(change, default=str)}\n\n"
+
+
+def stream_params(args, headers):
+    """(patient_id, after) for a stream request; a reconnecting EventSource resumes from Last-Event-ID."""
+    after = headers.get("Last-Event-ID") or args.get("after") or 0
+    try: after = int(after)
+    except (TypeError, ValueError): after = 0
+    return args.get("patient"), after
+
+
+def authorized(headers, token=CHANGE_FEED_TOKEN):
+    return token is not None and hmac.compare_digest(headers.get("Authorization") or "", f"Bearer {token}")
+
+
+def read_sse(url, after=0, token=CHANGE_FEED_TOKEN, timeout=None):
+    """Changes from a remote /changes/stream, resuming after `after`; yields None for each keepalive."""
+    headers = {"Accept": "text/event-stream", "Last-Event-ID": str(after)}
+    if token: headers["Authorization"] = f"Bearer {token}"
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as resp:
+        data = []
+        for line in resp:
+            line = line.decode("utf-8").rstrip("\r\n")
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif line.startswith(":"):
+                yield None
+            elif not line and data:
+                yield json.loads("\n".join(data))
+                data = []
+
+
+class ChangeSubscriber:
+    """Follows the change feed for the patients being viewed and hands each new change to `on_change`.
+
+    One daemon thread per watched patient reads either a ChangeFeed on the shared file or a remote
+    /changes/stream endpoint. A patient that has not been watched for `idle_seconds` is dropped;
+    its cursor is kept so watching it again resumes where it stopped.
+    """
+
+    def __init__(self, on_change, feed=None, url=CHANGE_FEED_URL, idle_seconds=60.0):
+        self.on_change = on_change
+        self.feed = feed
+        self.url = url
+        self.idle_seconds = idle_seconds
+        self.versions = {}
+        self._cursors = {}
+        self._watched = {}  # patient_id -> monotonic time of the last watch()
+        self._lock = threading.Lock()
+        if url and not CHANGE_FEED_TOKEN:
+            logger.warning(f"CHANGE_FEED_URL is set but CHANGE_FEED_TOKEN is not; {url}/changes/stream will refuse the subscription.")
+
+    def watch(self, patient_id):
+        """Keep following a patient; returns a counter that increases whenever one of its changes is applied."""
+        patient_id = str(patient_id)
+        with self._lock:
+            started = patient_id not in self._watched
+            self._watched[patient_id] = time.monotonic()
+            if started:
+                threading.Thread(target=self._follow, args=(patient_id,), name=f"change-feed-{patient_id}", daemon=True).start()
+            return self.versions.get(patient_id, 0)
+
+    def _idle(self, patient_id):
+        with self._lock:
+            if time.monotonic() - self._watched[patient_id] < self.idle_seconds: return False
+            del self._watched[patient_id]
+            return True
+
+    def _apply(self, change):
+        try: self.on_change(change)
+        except Exception as e: logger.error(f"Could not apply change {change.get('seq')}: {e}", exc_info=True)
+        with self._lock:
+            self._cursors[change["patient"]] = change["seq"]
+            self.versions[change["patient"]] = self.versions.get(change["patient"], 0) + 1
+
+    def _follow(self, patient_id):
+        failures = 0
+        while not self._idle(patient_id):
+            after = self._cursors.get(patient_id, 0)
+            try:
+                if not self.url:
+                    for change in self.feed.wait(patient_id, after, timeout=CHANGE_FEED_KEEPALIVE_SECONDS): self._apply(change)
+                    continue
+                url = f"{self.url}/changes/stream?" + urllib.parse.urlencode({"patient": patient_id})
+                # The server sends a keepalive every CHANGE_FEED_KEEPALIVE_SECONDS, so a silent socket is a dead one.
+                for change in read_sse(url, after, timeout=CHANGE_FEED_KEEPALIVE_SECONDS * 2):
+                    failures = 0
+                    if change is not None: self._apply(change)
+                    if self._idle(patient_id): return
+            except Exception as e:
+                failures += 1
+                delay = list(backoff_delays(failures + 1, base=1.0, cap=30.0))[-1]
+                logger.warning(f"Change feed for patient {patient_id} interrupted ({e}); reconnecting in {delay:.1f}s")
+                time.sleep(delay)
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+logger = logging.getLogger(__name__)
+
+FOUNDRY_HOSTNAME = os.getenv("FOUNDRY_HOSTNAME") or os.getenv("FOUNDRY_HOST")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_clients = {}
+_factories = {}
+
+
+def register(name, factory):
+    _factories[name] = factory
+
+
+def get(name):
+    """Return the process-wide client `name`, creating it on first use."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        if name not in _clients:
+            _clients[name] = _factories[name]()
+        return _clients[name]
+
+
+def override(name, client):
+    """Install a ready-made client (e.g. an in-process stand-in) in place of the configured one."""
+    with _lock:
+        _clients[name] = client
+
+
+def reset(name=None):
+    with _lock:
+        if name is None: _clients.clear()
+        else: _clients.pop(name, None)
+
+
+def _create_foundry_client():
+    from hospital_pro_patient_facing_app_sdk import FoundryClient
+    from foundry_sdk_runtime.auth import UserTokenAuth
+
+    foundry_token = os.getenv("FOUNDRY_TOKEN")
+    if not foundry_token:
+        raise RuntimeError("FOUNDRY_TOKEN not set; please add it to your .env or environment variables")
+    if not FOUNDRY_HOSTNAME:
+        raise RuntimeError("FOUNDRY_HOSTNAME not set; please add it to your .env or environment variables")
+
+    auth = UserTokenAuth(hostname=FOUNDRY_HOSTNAME, token=foundry_token)
+    try: from foundry_sdk_runtime import Config
+    except ImportError: Config = None
+    if Config is not None:
+        try: return FoundryClient(auth=auth, hostname=FOUNDRY_HOSTNAME, config=Config(timeout=HTTP_TIMEOUT_SECONDS))
+        except TypeError as e: logger.warning(f"Foundry SDK does not accept a client config ({e}); using SDK defaults.")
+    return FoundryClient(auth=auth, hostname=FOUNDRY_HOSTNAME)
+
+
+def _create_openai_client():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        import httpx
+        from openai import OpenAI
+    except ImportError:
+        logger.warning("OpenAI SDK not found.")
+        return None
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    )
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=OPENAI_MAX_RETRIES)
+
+
+def _create_twilio_client():
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if not account_sid or not auth_token:
+        return None
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client as TwilioClient
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=HTTP_TIMEOUT_SECONDS)
+    http_client.session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+    return TwilioClient(account_sid, auth_token, http_client=http_client)
+
+
+register("foundry", _create_foundry_client)
+register("openai", _create_openai_client)
+register("twilio", _create_twilio_client)
+
+
+def get_foundry_client():
+    return get("foundry")
+
+
+def get_openai_client():
+    return get("openai")
+
+
+def get_twilio_client():
+    return get("twilio")
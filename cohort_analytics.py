@@ -0,0 +1,367 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from local_mirror import OBJECT_TYPES, object_row
+from vitals_schema import VITALS_SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+COHORT_DIR = os.getenv("COHORT_DIR", "data/cohort")
+COHORT_SNAPSHOT_SECONDS = float(os.getenv("COHORT_SNAPSHOT_SECONDS", "60"))
+COHORT_REBUILD_SECONDS = float(os.getenv("COHORT_REBUILD_SECONDS", "3600"))
+# Patient properties the cohort is cut by; adjust to the Patient object type's API names.
+COHORT_CONDITION_FIELD = os.getenv("COHORT_CONDITION_FIELD", "condition")
+COHORT_TREATMENT_FIELD = os.getenv("COHORT_TREATMENT_FIELD", "treatment")
+COHORT_TREATMENT_START_FIELD = os.getenv("COHORT_TREATMENT_START_FIELD", "treatment_start_date")
+COHORT_CONSENT_FIELD = os.getenv("COHORT_CONSENT_FIELD", "data_donation")
+
+CONSENT_VALUES = {"true", "yes", "y", "1", "consented", "granted"}
+UNKNOWN = "Unknown"
+
+
+def _consented(value):
+    return value is True or str(value).strip().lower() in CONSENT_VALUES
+
+
+def _as_date(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)): return None
+    if isinstance(value, datetime): return value.date()
+    if isinstance(value, date): return value
+    try: return date.fromisoformat(str(value)[:10])
+    except ValueError: return None
+
+
+def _symptom_list(value):
+    if isinstance(value, str):
+        try: value = json.loads(value)
+        except json.JSONDecodeError: value = value.split(";")
+    if value is None or isinstance(value, float): return []
+    return [s for s in (str(v).strip().lower() for v in value) if s and s != "none"]
+
+
+def _label(value):
+    return UNKNOWN if value is None or (isinstance(value, float) and np.isnan(value)) or not str(value).strip() else str(value)
+
+
+def patient_info(row):
+    """(condition, treatment, treatment start) for a consenting patient's row, else None."""
+    if not _consented(row.get(COHORT_CONSENT_FIELD)):
+        return None
+    return _label(row.get(COHORT_CONDITION_FIELD)), _label(row.get(COHORT_TREATMENT_FIELD)), _as_date(row.get(COHORT_TREATMENT_START_FIELD))
+
+
+class CohortAnalytics:
+    """Materialized cohort aggregates over consenting patients' PROs and vitals.
+
+    Aggregates are additive counters, so a new PRO or vitals reading updates them in O(1):
+      pro:      (condition, treatment) -> [PROs, positive PROs]
+      symptoms: (condition, treatment, symptom) -> PROs mentioning it
+      vitals:   (patient, vital) -> [sum, n before treatment start, sum, n from treatment start on]
+    `rebuild` recomputes them from full tables with vectorized group-bys; the views turn them into
+    DataFrames once per change. A process with `snapshot_dir` owns the Parquet snapshot that other
+    processes `load` (and re-load when it changes).
+    """
+
+    def __init__(self, patient_lookup=None, snapshot_dir=COHORT_DIR, snapshot_seconds=COHORT_SNAPSHOT_SECONDS):
+        self.patient_lookup = patient_lookup
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_seconds = snapshot_seconds
+        self.stats = {"pros": 0, "vitals": 0, "skipped": 0, "rebuilds": 0, "snapshots": 0}
+        self._lock = threading.Lock()
+        self._patients = {}
+        self._pro = collections.defaultdict(lambda: [0, 0])
+        self._symptoms = collections.Counter()
+        self._vitals = collections.defaultdict(lambda: [0.0, 0, 0.0, 0])
+        self._views = {}
+        self.version = 0
+        self._saved_version = 0
+        self.loaded_mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.warming = False
+
+    # --- incremental updates -------------------------------------------------------------------
+
+    def _info(self, patient_id, patient=None):
+        if patient_id in self._patients:
+            return self._patients[patient_id]
+        if patient is None and self.patient_lookup is not None:
+            patient = self.patient_lookup(patient_id)
+        if patient is None:
+            return None
+        info = self._patients[patient_id] = patient_info(object_row(patient) if not isinstance(patient, dict) else patient)
+        return info
+
+    def add_pro(self, patient_id, sentiment, symptoms, patient=None):
+        """Count a stored PRO (sentiment as written to the Ontology: anything but Positive is Negative)."""
+        with self._lock:
+            info = self._info(patient_id, patient)
+            if info is None:
+                self.stats["skipped"] += 1; return False
+            condition, treatment, _ = info
+            counts = self._pro[(condition, treatment)]
+            counts[0] += 1
+            counts[1] += sentiment == "Positive"
+            for symptom in set(_symptom_list(symptoms)):
+                self._symptoms[(condition, treatment, symptom)] += 1
+            self.stats["pros"] += 1
+            self.version += 1
+        return True
+
+    def add_vitals(self, patient_id, values, day=None, patient=None):
+        """Add validated vitals ({vital: value}) taken on `day` (default today) to the patient's before/after sums."""
+        day = day or date.today()
+        with self._lock:
+            info = self._info(patient_id, patient)
+            if info is None or info[2] is None:
+                self.stats["skipped"] += 1; return False
+            offset = 2 if day >= info[2] else 0
+            for metric, value in values.items():
+                if value is None: continue
+                sums = self._vitals[(patient_id, metric)]
+                sums[offset] += float(value)
+                sums[offset + 1] += 1
+            self.stats["vitals"] += 1
+            self.version += 1
+        return True
+
+    # --- full recompute ------------------------------------------------------------------------
+
+    def rebuild(self, patients, pros, vitals):
+        """Recompute every aggregate from Patient, PROEntity and Vitals frames (object_row columns)."""
+        started = time.perf_counter()
+        info = {}
+        for row in patients.to_dict("records") if not patients.empty else []:
+            pk = row.get("id") or row.get("_pk")
+            info[str(pk)] = patient_info(row)
+        if not patients.empty and COHORT_CONSENT_FIELD not in patients.columns:
+            logger.warning(f"Patient objects have no '{COHORT_CONSENT_FIELD}' property; no patients are included in cohort analytics")
+        cohort = pd.DataFrame(
+            [(pid, *i) for pid, i in info.items() if i is not None],
+            columns=["patient", "condition", "treatment", "start"],
+        )
+
+        pro_counts, symptom_counts = {}, collections.Counter()
+        if not pros.empty and not cohort.empty:
+            p = pros.assign(patient=pros["patient"].astype(str)).merge(cohort, on="patient", how="inner")
+            p["positive"] = p["sentiment"].eq("Positive")
+            grouped = p.groupby(["condition", "treatment"]).agg(pros=("positive", "size"), positive=("positive", "sum"))
+            pro_counts = {key: [int(r.pros), int(r.positive)] for key, r in zip(grouped.index, grouped.itertuples())}
+            exploded = p[["condition", "treatment"]].assign(symptom=p["symptoms"].map(lambda s: sorted(set(_symptom_list(s))))).explode("symptom").dropna(subset=["symptom"])
+            symptom_counts.update(exploded.groupby(["condition", "treatment", "symptom"]).size().to_dict())
+
+        vitals_sums = {}
+        with_start = cohort.dropna(subset=["start"])
+        if not vitals.empty and not with_start.empty:
+            v = vitals.assign(patient=vitals["patient"].astype(str)).merge(with_start[["patient", "start"]], on="patient", how="inner")
+            clean = VITALS_SCHEMA.mask_fills(VITALS_SCHEMA.validate_batch(v)[0])
+            clean["patient"] = v["patient"].to_numpy()
+            clean["after"] = pd.to_datetime(v["date_"]).to_numpy() >= pd.to_datetime(v["start"]).to_numpy()
+            long = clean.melt(id_vars=["patient", "after"], var_name="metric").dropna(subset=["value"])
+            sums = long.groupby(["patient", "metric", "after"])["value"].agg(["sum", "count"]).unstack("after", fill_value=0)
+            for (patient, metric), r in zip(sums.index, sums.to_numpy()):
+                # columns: (sum, False), (sum, True), (count, False), (count, True), possibly missing one side
+                row = dict(zip(sums.columns, r))
+                vitals_sums[(patient, metric)] = [float(row.get(("sum", False), 0.0)), int(row.get(("count", False), 0)),
+                                                  float(row.get(("sum", True), 0.0)), int(row.get(("count", True), 0))]
+
+        with self._lock:
+            self._patients = info
+            self._pro = collections.defaultdict(lambda: [0, 0], pro_counts)
+            self._symptoms = symptom_counts
+            self._vitals = collections.defaultdict(lambda: [0.0, 0, 0.0, 0], vitals_sums)
+            self.stats["rebuilds"] += 1
+            self.version += 1
+        logger.info(f"Cohort aggregates rebuilt from {len(patients)} patients ({len(cohort)} consenting), {len(pros)} PROs "
+                    f"and {len(vitals)} vitals in {time.perf_counter() - started:.2f}s")
+
+    # --- views ---------------------------------------------------------------------------------
+
+    def _view(self, name, build):
+        cached = self._views.get(name)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        with self._lock:
+            version = self.version
+            frame = build()
+        self._views[name] = (version, frame)
+        return frame
+
+    @staticmethod
+    def _for_condition(frame, condition):
+        return frame if condition is None or frame.empty else frame[frame["condition"] == condition].reset_index(drop=True)
+
+    def conditions(self):
+        return sorted({c for c, _ in self.sentiment_rates()[["condition", "treatment"]].itertuples(index=False)})
+
+    def sentiment_rates(self, condition=None):
+        """PROs and share of Positive sentiment per condition and treatment."""
+        def build():
+            frame = pd.DataFrame([(c, t, n, pos) for (c, t), (n, pos) in self._pro.items()], columns=["condition", "treatment", "pros", "positive"])
+            frame["positive_rate"] = (frame["positive"] / frame["pros"].where(frame["pros"] > 0)).round(3)
+            return frame.sort_values(["condition", "pros"], ascending=[True, False], ignore_index=True)
+        return self._for_condition(self._view("sentiment", build), condition)
+
+    def symptom_frequencies(self, condition=None, top=10):
+        """Most reported symptoms per condition and treatment, as a count and a share of that group's PROs."""
+        def build():
+            frame = pd.DataFrame([(c, t, s, n) for (c, t, s), n in self._symptoms.items()], columns=["condition", "treatment", "symptom", "count"])
+            totals = pd.Series({key: counts[0] for key, counts in self._pro.items()}, dtype=float)
+            if not frame.empty:
+                frame["share"] = (frame["count"] / totals.reindex(pd.MultiIndex.from_frame(frame[["condition", "treatment"]])).to_numpy()).round(3)
+            else:
+                frame["share"] = pd.Series(dtype=float)
+            return frame.sort_values(["condition", "treatment", "count"], ascending=[True, True, False], ignore_index=True)
+        frame = self._for_condition(self._view("symptoms", build), condition)
+        return frame.groupby(["condition", "treatment"], sort=False).head(top).reset_index(drop=True) if top and not frame.empty else frame
+
+    def vitals_deltas(self, condition=None):
+        """Mean per-patient change in each vital from before to after treatment start, per condition and treatment."""
+        def build():
+            columns = ["condition", "treatment", "metric", "patients", "before_mean", "after_mean", "delta_mean", "delta_std"]
+            rows = [(p, m, *s) for (p, m), s in self._vitals.items() if s[1] and s[3]]
+            if not rows:
+                return pd.DataFrame(columns=columns)
+            frame = pd.DataFrame(rows, columns=["patient", "metric", "before_sum", "before_n", "after_sum", "after_n"])
+            info = {pid: i for pid, i in self._patients.items() if i is not None}
+            frame["condition"] = frame["patient"].map(lambda pid: info.get(pid, (UNKNOWN,))[0])
+            frame["treatment"] = frame["patient"].map(lambda pid: info.get(pid, (UNKNOWN, UNKNOWN))[1])
+            frame["before"] = frame["before_sum"] / frame["before_n"]
+            frame["after"] = frame["after_sum"] / frame["after_n"]
+            frame["delta"] = frame["after"] - frame["before"]
+            grouped = frame.groupby(["condition", "treatment", "metric"]).agg(
+                patients=("delta", "size"), before_mean=("before", "mean"), after_mean=("after", "mean"),
+                delta_mean=("delta", "mean"), delta_std=("delta", "std"),
+            ).round(2).reset_index()
+            grouped["metric"] = grouped["metric"].map(lambda m: VITALS_SCHEMA.labels.get(m, m))
+            return grouped[columns]
+        return self._for_condition(self._view("vitals", build), condition)
+
+    # --- persistence ---------------------------------------------------------------------------
+
+    def save(self, directory=None):
+        directory = directory or self.snapshot_dir
+        if not directory: return False
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            version = self.version
+            frames = {
+                "patients": pd.DataFrame([(pid, *(i or (None, None, None)), i is not None) for pid, i in self._patients.items()],
+                                         columns=["patient", "condition", "treatment", "start", "consented"]),
+                "pro": pd.DataFrame([(c, t, n, pos) for (c, t), (n, pos) in self._pro.items()], columns=["condition", "treatment", "pros", "positive"]),
+                "symptoms": pd.DataFrame([(*k, n) for k, n in self._symptoms.items()], columns=["condition", "treatment", "symptom", "count"]),
+                "vitals": pd.DataFrame([(*k, *s) for k, s in self._vitals.items()], columns=["patient", "metric", "before_sum", "before_n", "after_sum", "after_n"]),
+            }
+        for name, frame in frames.items():
+            tmp = os.path.join(directory, f"{name}.parquet.tmp")
+            frame.to_parquet(tmp, index=False)
+            os.replace(tmp, os.path.join(directory, f"{name}.parquet"))
+        # Written last: readers reload when this file changes.
+        with open(os.path.join(directory, "meta.json.tmp"), "w") as f:
+            json.dump({"saved_at": time.time(), "version": version}, f)
+        os.replace(os.path.join(directory, "meta.json.tmp"), os.path.join(directory, "meta.json"))
+        self._saved_version = version
+        self.stats["snapshots"] += 1
+        return True
+
+    def _snapshot_mtime(self, directory):
+        if not directory: return None
+        try: return os.path.getmtime(os.path.join(directory, "meta.json"))
+        except OSError: return None
+
+    def load(self, directory=None):
+        directory = COHORT_DIR if directory is None else directory
+        mtime = self._snapshot_mtime(directory)
+        if mtime is None: return False
+        frames = {name: pd.read_parquet(os.path.join(directory, f"{name}.parquet")) for name in ("patients", "pro", "symptoms", "vitals")}
+        patients = {
+            str(r.patient): ((r.condition, r.treatment, _as_date(r.start)) if r.consented else None)
+            for r in frames["patients"].itertuples(index=False)
+        }
+        pro = {(r.condition, r.treatment): [int(r.pros), int(r.positive)] for r in frames["pro"].itertuples(index=False)}
+        symptoms = collections.Counter({(r.condition, r.treatment, r.symptom): int(r.count) for r in frames["symptoms"].itertuples(index=False)})
+        vitals = {(r.patient, r.metric): [r.before_sum, int(r.before_n), r.after_sum, int(r.after_n)] for r in frames["vitals"].itertuples(index=False)}
+        with self._lock:
+            self._patients = patients
+            self._pro = collections.defaultdict(lambda: [0, 0], pro)
+            self._symptoms = symptoms
+            self._vitals = collections.defaultdict(lambda: [0.0, 0, 0.0, 0], vitals)
+            self.version += 1
+            self._saved_version = self.version
+        self.loaded_mtime = mtime
+        return True
+
+    def reload_if_changed(self, directory=None):
+        """For processes reading another's snapshot: load it again if it was rewritten since the last load."""
+        directory = COHORT_DIR if directory is None else directory
+        mtime = self._snapshot_mtime(directory)
+        return mtime is not None and mtime != self.loaded_mtime and self.load(directory)
+
+    # --- background maintenance ----------------------------------------------------------------
+
+    def _maintenance_loop(self, rebuild_source):
+        last_rebuild = time.monotonic()
+        while not self._stop.wait(self.snapshot_seconds):
+            try:
+                if rebuild_source is not None and COHORT_REBUILD_SECONDS > 0 and time.monotonic() - last_rebuild >= COHORT_REBUILD_SECONDS:
+                    self.rebuild(*rebuild_source()); last_rebuild = time.monotonic()
+                if self.version != self._saved_version and not self.warming: self.save()
+            except Exception as e:
+                logger.error(f"Cohort analytics maintenance failed: {e}", exc_info=True)
+
+    def rebuild_in_background(self, rebuild_source):
+        """First `rebuild(*rebuild_source())` on a thread; the views stay empty until it finishes."""
+        def run():
+            try:
+                self.rebuild(*rebuild_source())
+            except Exception as e:
+                logger.error(f"Cohort analytics rebuild failed: {e}", exc_info=True)
+            self.warming = False
+            if self.snapshot_dir:
+                try: self.save()
+                except Exception as e: logger.error(f"Cohort snapshot failed: {e}")
+
+        self.warming = True
+        threading.Thread(target=run, name="cohort-warm-start", daemon=True).start()
+
+    def start(self, rebuild_source=None):
+        """Snapshot every `snapshot_seconds` when changed, and rebuild from `rebuild_source()` every COHORT_REBUILD_SECONDS."""
+        if self._thread is None and self.snapshot_dir and self.snapshot_seconds > 0:
+            self._thread = threading.Thread(target=self._maintenance_loop, args=(rebuild_source,), name="cohort-analytics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.snapshot_dir and self.version != self._saved_version and not self.warming:
+            try: self.save()
+            except Exception as e: logger.error(f"Final cohort snapshot failed: {e}")
+
+
+def source_frames(client=None, mirror=None):
+    """(patients, pros, vitals) DataFrames from the local Parquet mirror when given, else the Ontology."""
+    if mirror is not None:
+        return tuple(mirror.table(name).to_pandas() for name in ("patients", "pros", "vitals"))
+    objects = client.ontology.objects
+    return tuple(pd.DataFrame([object_row(o) for o in getattr(objects, OBJECT_TYPES[name][0]).iterate()]) for name in ("patients", "pros", "vitals"))
+
+
+def create_analytics(client=None, mirror=None, patient_lookup=None, save=True):
+    """Aggregates restored from the snapshot, or rebuilt from `mirror`/`client` in the background when there is none.
+
+    With `save` false the snapshot is only read (see `reload_if_changed`) and nothing is rebuilt periodically.
+    """
+    analytics = CohortAnalytics(patient_lookup=patient_lookup, snapshot_dir=COHORT_DIR if save else None)
+    rebuild_source = (lambda: source_frames(client, mirror)) if client is not None or mirror is not None else None
+    if not analytics.load(COHORT_DIR) and rebuild_source is not None:
+        analytics.rebuild_in_background(rebuild_source)
+    if save: analytics.start(rebuild_source)
+    return analytics
@@ -0,0 +1,110 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class DedupStore:
+    """Remembers delivery keys for `window_seconds` in fixed-width time buckets.
+
+    Whole buckets expire at once, so memory is bounded by the delivery rate over the window.
+    With `path` set, keys are also checked against and written to SQLite, which makes duplicate
+    detection work across worker processes and restarts.
+    """
+
+    def __init__(self, window_seconds=300, bucket_seconds=30, path=None):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._buckets = OrderedDict()
+        self._conn = None
+        self.duplicates = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS deliveries_seen (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+            cutoff = time.time() - window_seconds
+            self._conn.execute("DELETE FROM deliveries_seen WHERE seen_at < ?", (cutoff,))
+            for key, seen_at in self._conn.execute("SELECT key, seen_at FROM deliveries_seen ORDER BY seen_at"):
+                self._add(key, seen_at)
+            logger.info(f"Loaded {len(self._keys)} recent delivery keys from {path}")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _bucket(self, ts):
+        return int(ts // self.bucket_seconds)
+
+    def _add(self, key, ts):
+        bucket = self._bucket(ts)
+        self._keys[key] = bucket
+        self._buckets.setdefault(bucket, set()).add(key)
+
+    def _expire(self, now):
+        oldest_live = self._bucket(now - self.window_seconds)
+        expired = False
+        while self._buckets:
+            bucket = next(iter(self._buckets))
+            if bucket >= oldest_live:
+                break
+            for key in self._buckets.pop(bucket):
+                if self._keys.get(key) == bucket:
+                    del self._keys[key]
+            expired = True
+        if expired and self._conn is not None:
+            self._conn.execute("DELETE FROM deliveries_seen WHERE seen_at < ?", (now - self.window_seconds,))
+
+    def claim(self, *keys):
+        """Record `keys` and return True, or return False if any of them was seen within the window."""
+        keys = [k for k in keys if k]
+        if not keys:
+            return True
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if any(k in self._keys for k in keys) or not self._claim_persisted(keys, now):
+                self.duplicates += 1
+                return False
+            for k in keys:
+                self._add(k, now)
+        return True
+
+    def _claim_persisted(self, keys, now):
+        # The SQLite file is shared by every worker process, so the check-and-insert happens there too.
+        if self._conn is None:
+            return True
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(keys))
+            seen = self._conn.execute(
+                f"SELECT 1 FROM deliveries_seen WHERE key IN ({placeholders}) AND seen_at >= ? LIMIT 1",
+                (*keys, now - self.window_seconds),
+            ).fetchone()
+            if seen is None:
+                self._conn.executemany("INSERT OR REPLACE INTO deliveries_seen (key, seen_at) VALUES (?, ?)", [(k, now) for k in keys])
+            self._conn.execute("COMMIT")
+            return seen is None
+        except Exception as e:
+            logger.warning(f"Failed to check persisted delivery keys: {e}")
+            try: self._conn.execute("ROLLBACK")
+            except Exception: pass
+            return True
+
+    def release(self, *keys):
+        """Forget keys whose processing failed so a redelivery is accepted."""
+        with self._lock:
+            for k in keys:
+                bucket = self._keys.pop(k, None)
+                if bucket is not None:
+                    self._buckets.get(bucket, set()).discard(k)
+            if self._conn is not None:
+                try: self._conn.executemany("DELETE FROM deliveries_seen WHERE key = ?", [(k,) for k in keys if k])
+                except Exception as e: logger.warning(f"Failed to remove delivery keys: {e}")
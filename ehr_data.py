@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from datetime import date
+from types import SimpleNamespace
+
+from hospital_pro_patient_facing_app_sdk.ontology.objects import Proentity, Vitals
+
+from vitals_schema import VITALS_SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+
+PRO_SUMMARY_FIELDS = {
+    'submitted_at': ['submitted_at', 'submittedAt'],
+    'sentiment': ['sentiment'],
+    'symptoms': ['symptoms'],
+    'free_text': ['free_text', 'freeText'],
+}
+_PRO_HIDDEN_FIELDS = {'rid', 'primary_key', 'id', 'patient'} | {n for names in PRO_SUMMARY_FIELDS.values() for n in names}
+_detail_fields_by_type = {}
+
+
+def pro_field(pro_entity, field):
+    for name in PRO_SUMMARY_FIELDS[field]:
+        value = getattr(pro_entity, name, None)
+        if value is not None:
+            return value
+    return None
+
+
+def pro_detail_fields(pro_entity):
+    """Names of the extra properties shown for a PRO, computed once per object type."""
+    fields = _detail_fields_by_type.get(type(pro_entity))
+    if fields is None:
+        fields = [name for name in vars(pro_entity) if not name.startswith('_') and name not in _PRO_HIDDEN_FIELDS]
+        _detail_fields_by_type[type(pro_entity)] = fields
+    return fields
+
+
+def vitals_record(v):
+    return VITALS_SCHEMA.object_record(v)
+
+
+class EHRDataStore:
+    """Per-patient TTL cache over the Vitals and PROEntity reads behind the EHR Hub page.
+
+    Submissions made through the app update (vitals) or invalidate (PROs) the affected entry,
+    and objects the webhook creates arrive through `apply_change`, so the page reflects them
+    without refetching everything.
+    """
+
+    def __init__(self, client, ttl_seconds=300.0, mirror=None):
+        self.client = client
+        self.mirror = mirror
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _get(self, kind, patient_id, load, window=None):
+        key = (kind, patient_id, window)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+        fetched_at = time.time()
+        value = load()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value, fetched_at)
+        return value
+
+    def get_vitals(self, patient_id, start=None, end=None):
+        """Vitals records for a patient, optionally limited to `start` <= date_ <= `end` in the Ontology query."""
+        def load():
+            if self.mirror is not None:
+                return self.mirror.vitals_records(patient_id, start, end)
+            object_set = self.client.ontology.objects.Vitals.where(Vitals.object_type.patient == patient_id)
+            if start is not None: object_set = object_set.where(Vitals.object_type.date_ >= start)
+            if end is not None: object_set = object_set.where(Vitals.object_type.date_ <= end)
+            return [vitals_record(v) for v in object_set.iterate()]
+        return self._get("vitals", patient_id, load, window=(start, end))
+
+    def get_pros(self, patient):
+        return self._get("pros", patient.id, lambda: list(patient.proentities.iterate()))
+
+    def get_pro_page(self, patient, page_size=20, page_token=None):
+        """One page of the patient's PROs, newest first; returns (pros, next_page_token)."""
+        def load():
+            page = patient.proentities.order_by(Proentity.object_type.submitted_at.desc()).page(page_size=page_size, page_token=page_token)
+            return list(page.data), page.next_page_token
+        return self._get("pros", patient.id, load, window=(page_token, page_size))
+
+    def record_vitals(self, patient_id, record, created_at=None):
+        """Add a vitals record to the patient's cached windows; with `created_at`, only to those fetched before it."""
+        with self._lock:
+            for key, (cached_at, records, fetched_at) in list(self._entries.items()):
+                kind, pid, (start, end) = key[0], key[1], key[2] or (None, None)
+                if kind != "vitals" or pid != patient_id or (created_at is not None and fetched_at >= created_at): continue
+                if (start is None or record['date'] >= start) and (end is None or record['date'] <= end):
+                    self._entries[key] = (cached_at, records + [record], fetched_at)
+
+    def record_pro(self, patient_id, pro, created_at=None):
+        """Add a PRO to the patient's cached list and first page (newest first), like record_vitals."""
+        with self._lock:
+            for key, (cached_at, value, fetched_at) in list(self._entries.items()):
+                if key[0] != "pros" or key[1] != patient_id or (created_at is not None and fetched_at >= created_at): continue
+                if key[2] is None:
+                    self._entries[key] = (cached_at, value + [pro], fetched_at)
+                elif key[2][0] is None:
+                    self._entries[key] = (cached_at, ([pro] + value[0], value[1]), fetched_at)
+
+    def apply_change(self, change):
+        """Apply a change-feed entry (see change_feed.py) for a PROEntity or Vitals object the webhook created."""
+        data = change["data"]
+        if change["kind"] == "vitals":
+            self.record_vitals(change["patient"], {**data, 'date': date.fromisoformat(str(data['date']))}, change["created_at"])
+        elif change["kind"] == "pro":
+            self.record_pro(change["patient"], SimpleNamespace(**data), change["created_at"])
+
+    def invalidate(self, patient_id, kind=None):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == patient_id and (kind is None or k[0] == kind)]:
+                del self._entries[key]
+                self.stats["invalidations"] += 1
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, NamedTuple, Optional
+
+from llm_cache import LLMCache, cache_key
+from local_enrichment import analyze_note
+from resilience import openai_calls
+
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_MODEL = os.getenv("OPENAI_ENRICHMENT_MODEL", "gpt-3.5-turbo")
+ENRICHMENT_MODE = os.getenv("OPENAI_ENRICHMENT_MODE", "single").lower()
+ENRICHMENT_DEADLINE_SECONDS = float(os.getenv("OPENAI_ENRICHMENT_DEADLINE_SECONDS", "8"))
+LOCAL_ENRICHMENT_ENABLED = os.getenv("LOCAL_ENRICHMENT_ENABLED", "true").lower() == "true"
+LOCAL_ENRICHMENT_MIN_CONFIDENCE = float(os.getenv("LOCAL_ENRICHMENT_MIN_CONFIDENCE", "0.75"))
+
+SENTIMENT_PROMPT = "You are a healthcare assistant. Classify the sentiment of the following patient check-in note as Positive or Negative. Respond with only one word: Positive or Negative."
+SYMPTOMS_PROMPT = "You are a healthcare assistant. Extract all symptoms mentioned in the following patient check-in note. Return a JSON array of strings only. If no symptoms are mentioned, return [\"none\"]. No commentary or explanation."
+ENRICHMENT_PROMPT = (
+    "You are a healthcare assistant. For the following patient check-in note, classify the overall sentiment as "
+    "Positive or Negative and extract all symptoms mentioned. Respond with a JSON object only, in the form "
+    "{\"sentiment\": \"Positive\" or \"Negative\", \"symptoms\": [\"...\"]}. If no symptoms are mentioned, use [\"none\"]."
+)
+
+llm_cache = None
+if os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true":
+    llm_cache = LLMCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+        path=os.getenv("LLM_CACHE_PATH") or None,
+        max_disk_entries=int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "200000")),
+    )
+
+stats = {"local": 0, "escalated_sentiment": 0, "escalated_symptoms": 0, "escalated_both": 0}
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("OPENAI_ENRICHMENT_THREADS", "8")), thread_name_prefix="enrichment")
+
+
+class Enrichment(NamedTuple):
+    sentiment: Optional[str]
+    symptoms: List[str]
+
+
+NO_ENRICHMENT = Enrichment(None, ["none"])
+
+
+def parse_sentiment(value):
+    value = value.strip() if isinstance(value, str) else value
+    return value if value in ["Positive", "Negative"] else None
+
+
+def parse_symptoms(value):
+    if isinstance(value, str):
+        try: value = json.loads(value)
+        except json.JSONDecodeError: logger.warning(f"OpenAI symptoms invalid JSON: {value}"); return ["none"]
+    if isinstance(value, list) and value and all(isinstance(s, str) for s in value): return value
+    return ["none"]
+
+
+def _complete(client, system_prompt, text, timeout, **kwargs):
+    resp = openai_calls.call(lambda: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=ENRICHMENT_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text}
+        ],
+        **kwargs
+    ))
+    return resp.choices[0].message.content.strip()
+
+
+def _cached(kind, prompt, text, compute, cacheable=lambda value: True):
+    if llm_cache is None: return compute()
+    return llm_cache.get_or_compute(kind, text, prompt, ENRICHMENT_MODEL, compute, cacheable)
+
+
+def classify_sentiment(client, text, timeout=ENRICHMENT_DEADLINE_SECONDS):
+    return _cached("sentiment", SENTIMENT_PROMPT, text,
+                   lambda: parse_sentiment(_complete(client, SENTIMENT_PROMPT, text, timeout)),
+                   cacheable=lambda sentiment: sentiment is not None)
+
+
+def _parsed_symptoms(content):
+    """parse_symptoms for a reply that is a JSON list; None otherwise, so the ["none"] fallback is not cached."""
+    try: value = json.loads(content)
+    except json.JSONDecodeError: logger.warning(f"OpenAI symptoms invalid JSON: {content}"); return None
+    return parse_symptoms(value) if isinstance(value, list) else None
+
+
+def extract_symptoms(client, text, timeout=ENRICHMENT_DEADLINE_SECONDS):
+    symptoms = _cached("symptoms", SYMPTOMS_PROMPT, text,
+                       lambda: _parsed_symptoms(_complete(client, SYMPTOMS_PROMPT, text, timeout)),
+                       cacheable=lambda symptoms: symptoms is not None)
+    return symptoms or ["none"]
+
+
+def _enrich_single_call(client, text, timeout):
+    content = _complete(client, ENRICHMENT_PROMPT, text, timeout, response_format={"type": "json_object"})
+    try: parsed = json.loads(content)
+    except json.JSONDecodeError: logger.warning(f"OpenAI enrichment invalid JSON: {content}"); return NO_ENRICHMENT
+    if not isinstance(parsed, dict): return NO_ENRICHMENT
+    enrichment = Enrichment(parse_sentiment(parsed.get("sentiment")), parse_symptoms(parsed.get("symptoms")))
+    if llm_cache is not None and enrichment.sentiment is not None and isinstance(parsed.get("symptoms"), list):
+        llm_cache.set(cache_key("enrichment", text, ENRICHMENT_PROMPT, ENRICHMENT_MODEL), enrichment._asdict())
+    return enrichment
+
+
+def _within_deadline(what, fn, *args, deadline):
+    future = _executor.submit(fn, *args)
+    try: return future.result(timeout=deadline)
+    except FutureTimeoutError: logger.warning(f"{what} exceeded {deadline}s deadline.")
+    except Exception as e: logger.error(f"Error during {what.lower()}: {e}")
+    return None
+
+
+def enrich_note(client, text, mode=None, deadline=None):
+    """Sentiment and symptoms for a note, answered locally when the lexicon is confident.
+
+    Only the low-confidence half is sent to OpenAI (within `deadline` seconds); if that fails or no
+    client is configured, the local answer is used.
+    """
+    if not text or not text.strip(): return NO_ENRICHMENT
+    deadline = deadline or ENRICHMENT_DEADLINE_SECONDS
+    if not LOCAL_ENRICHMENT_ENABLED:
+        return _enrich_remote(client, text, mode, deadline) if client else NO_ENRICHMENT
+
+    local = analyze_note(text)
+    sentiment_ok = local.sentiment is not None and local.sentiment_confidence >= LOCAL_ENRICHMENT_MIN_CONFIDENCE
+    symptoms_ok = local.symptoms_confidence >= LOCAL_ENRICHMENT_MIN_CONFIDENCE
+    if (sentiment_ok and symptoms_ok) or not client:
+        stats["local"] += 1
+        return Enrichment(local.sentiment, local.symptoms)
+
+    if sentiment_ok:
+        stats["escalated_symptoms"] += 1
+        symptoms = _within_deadline("Symptom extraction", extract_symptoms, client, text, deadline, deadline=deadline)
+        return Enrichment(local.sentiment, symptoms if symptoms is not None else local.symptoms)
+    if symptoms_ok:
+        stats["escalated_sentiment"] += 1
+        sentiment = _within_deadline("Sentiment analysis", classify_sentiment, client, text, deadline, deadline=deadline)
+        return Enrichment(sentiment or local.sentiment, local.symptoms)
+
+    stats["escalated_both"] += 1
+    remote = _enrich_remote(client, text, mode, deadline)
+    return remote if remote.sentiment is not None else Enrichment(local.sentiment, local.symptoms)
+
+
+def _enrich_remote(client, text, mode, deadline):
+    mode = mode or ENRICHMENT_MODE
+
+    if mode == "concurrent":
+        started = time.monotonic()
+        sentiment_future = _executor.submit(classify_sentiment, client, text, deadline)
+        symptoms_future = _executor.submit(extract_symptoms, client, text, deadline)
+        sentiment, symptoms = None, ["none"]
+        try: sentiment = sentiment_future.result(timeout=deadline)
+        except FutureTimeoutError: logger.warning(f"Sentiment analysis exceeded {deadline}s deadline.")
+        except Exception as e: logger.error(f"Error during sentiment analysis: {e}")
+        try: symptoms = symptoms_future.result(timeout=max(0.0, deadline - (time.monotonic() - started)))
+        except FutureTimeoutError: logger.warning(f"Symptom extraction exceeded {deadline}s deadline.")
+        except Exception as e: logger.error(f"Error during symptom extraction: {e}")
+        return Enrichment(sentiment, symptoms)
+
+    if llm_cache is not None:
+        cached = llm_cache.get(cache_key("enrichment", text, ENRICHMENT_PROMPT, ENRICHMENT_MODEL))
+        if cached is not None: return Enrichment(cached["sentiment"], cached["symptoms"])
+
+    future = _executor.submit(_enrich_single_call, client, text, deadline)
+    try: return future.result(timeout=deadline)
+    except FutureTimeoutError: logger.warning(f"Note enrichment exceeded {deadline}s deadline."); return NO_ENRICHMENT
+    except Exception as e: logger.error(f"Error during note enrichment: {e}"); return NO_ENRICHMENT
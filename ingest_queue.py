@@ -0,0 +1,236 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_DEAD = "dead"
+
+
+class IngestQueue:
+    """Durable SQLite (WAL) queue of raw webhook deliveries."""
+
+    def __init__(self, path, max_attempts=5, base_backoff=2.0, max_backoff=300.0, stale_after=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._counters_lock = threading.Lock()
+        self._counters = {"enqueued": 0, "completed": 0, "retried": 0, "dead_lettered": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " body BLOB NOT NULL,"
+            " received_at REAL NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL,"
+            " locked_at REAL,"
+            " last_error TEXT,"
+            " completed_steps TEXT NOT NULL DEFAULT '')"
+        )
+        if "completed_steps" not in [row[1] for row in conn.execute("PRAGMA table_info(deliveries)")]:
+            conn.execute("ALTER TABLE deliveries ADD COLUMN completed_steps TEXT NOT NULL DEFAULT ''")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_ready ON deliveries (status, available_at)")
+        conn.commit()
+
+    def recover(self):
+        """Return every 'processing' delivery to pending; only for the one process that runs the workers, at startup.
+
+        Processes that only enqueue must not call it: it would hand the workers' in-flight deliveries out again.
+        """
+        recovered = self._conn().execute(
+            "UPDATE deliveries SET status = ?, locked_at = NULL WHERE status = ?",
+            (STATUS_PENDING, STATUS_PROCESSING),
+        ).rowcount
+        if recovered:
+            logger.warning(f"Recovered {recovered} in-flight deliveries from a previous run.")
+        return recovered
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._counters_lock:
+            self._counters[name] += n
+
+    def enqueue(self, body):
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO deliveries (body, received_at, status, attempts, available_at) VALUES (?, ?, ?, 0, ?)",
+            (sqlite3.Binary(body), now, STATUS_PENDING, now),
+        )
+        self._count("enqueued")
+        with self._wakeup:
+            self._wakeup.notify()
+        return cur.lastrowid
+
+    def wait_for_work(self, timeout):
+        with self._wakeup:
+            self._wakeup.wait(timeout)
+
+    def claim(self):
+        """Atomically take the oldest ready delivery; returns (id, body, attempts) or None."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE deliveries SET status = ?, locked_at = NULL WHERE status = ? AND locked_at < ?",
+                (STATUS_PENDING, STATUS_PROCESSING, now - self.stale_after),
+            )
+            row = conn.execute(
+                "SELECT id, body, attempts FROM deliveries WHERE status = ? AND available_at <= ? ORDER BY id LIMIT 1",
+                (STATUS_PENDING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE deliveries SET status = ?, locked_at = ? WHERE id = ?",
+                    (STATUS_PROCESSING, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], bytes(row[1]), row[2]
+
+    def complete(self, delivery_id):
+        self._conn().execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+        self._count("completed")
+
+    def completed_steps(self, delivery_id):
+        """Steps of a delivery that succeeded on an earlier attempt, so a retry does not repeat them."""
+        row = self._conn().execute("SELECT completed_steps FROM deliveries WHERE id = ?", (delivery_id,)).fetchone()
+        return set(row[0].split(",")) - {""} if row else set()
+
+    def complete_step(self, delivery_id, step):
+        self._conn().execute(
+            "UPDATE deliveries SET completed_steps = completed_steps || ? WHERE id = ?", ("," + step, delivery_id),
+        )
+
+    def fail(self, delivery_id, error):
+        conn = self._conn()
+        row = conn.execute("SELECT attempts FROM deliveries WHERE id = ?", (delivery_id,)).fetchone()
+        if row is None:
+            return
+        attempts = row[0] + 1
+        if attempts >= self.max_attempts:
+            conn.execute(
+                "UPDATE deliveries SET status = ?, attempts = ?, locked_at = NULL, last_error = ? WHERE id = ?",
+                (STATUS_DEAD, attempts, str(error)[:2000], delivery_id),
+            )
+            self._count("dead_lettered")
+            logger.error(f"Delivery {delivery_id} dead-lettered after {attempts} attempts: {error}")
+            return
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (attempts - 1)))
+        delay = delay * (0.5 + random.random() / 2)
+        conn.execute(
+            "UPDATE deliveries SET status = ?, attempts = ?, available_at = ?, locked_at = NULL, last_error = ? WHERE id = ?",
+            (STATUS_PENDING, attempts, time.time() + delay, str(error)[:2000], delivery_id),
+        )
+        self._count("retried")
+        logger.warning(f"Delivery {delivery_id} failed (attempt {attempts}/{self.max_attempts}), retrying in {delay:.1f}s: {error}")
+
+    def requeue_dead(self):
+        now = time.time()
+        count = self._conn().execute(
+            "UPDATE deliveries SET status = ?, attempts = 0, available_at = ? WHERE status = ?",
+            (STATUS_PENDING, now, STATUS_DEAD),
+        ).rowcount
+        if count:
+            with self._wakeup:
+                self._wakeup.notify_all()
+        return count
+
+    def stats(self):
+        conn = self._conn()
+        depth = {STATUS_PENDING: 0, STATUS_PROCESSING: 0, STATUS_DEAD: 0}
+        for status, count in conn.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status"):
+            depth[status] = count
+        oldest = conn.execute(
+            "SELECT MIN(received_at) FROM deliveries WHERE status = ?", (STATUS_PENDING,)
+        ).fetchone()[0]
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {
+            "depth": depth,
+            "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "counters": counters,
+        }
+
+
+class IngestWorkerPool:
+    """Background threads that drain an IngestQueue through `handler(body, delivery_id)`.
+
+    The handler raising an exception marks the delivery for retry (and eventually dead-letter).
+    Handlers with several side effects record each with `queue.complete_step` and skip the ones
+    in `queue.completed_steps` on a retry.
+    """
+
+    def __init__(self, queue, handler, workers=4, poll_interval=1.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Started {self.workers} ingest workers on {self.queue.path}")
+
+    def stop(self, timeout=30.0):
+        self._stop.set()
+        with self.queue._wakeup:
+            self.queue._wakeup.notify_all()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Failed to claim delivery from ingest queue: {e}", exc_info=True)
+                self._stop.wait(self.poll_interval)
+                continue
+            if item is None:
+                self.queue.wait_for_work(self.poll_interval)
+                continue
+            delivery_id, body, attempts = item
+            try:
+                self.handler(body, delivery_id)
+            except Exception as e:
+                self.queue.fail(delivery_id, e)
+            else:
+                self.queue.complete(delivery_id)
@@ -1,3 +1,6 @@
+import argparse
+import logging
+import os
 from datetime import date
 from pprint import pprint
 
@@ -31,9 +34,110 @@ def submit_demo_pro(patient_id: str):
         print("Edits response:", response.edits)
 
 
+def bulk_import(args):
+    from bulk_import import run_import, validate_vitals_file
+
+    if args.validate_only:
+        if args.kind != "vitals": print("--validate-only only applies to --kind vitals"); return
+        validate_vitals_file(args.path, fmt=args.format, errors_path=f"{args.path}.invalid.jsonl")
+        return
+
+    enrich = None
+    if args.enrich:
+        from clients import get_openai_client
+        from enrichment import enrich_note
+        openai_client = get_openai_client()
+        enrich = lambda text: enrich_note(openai_client, text)
+    run_import(
+        client, args.path, args.kind, fmt=args.format, concurrency=args.concurrency, rate=args.rate,
+        enrich=enrich, checkpoint_path=args.checkpoint or f"{args.path}.checkpoint.json", batch_size=args.batch_size,
+    )
+
+
+def export(args):
+    from ontology_export import export_objects
+
+    where = dict(item.split("=", 1) for item in args.where or [])
+    export_objects(
+        client, args.type, args.path, fmt=args.format, page_size=args.page_size, fields=args.fields,
+        where=where, since=args.since, until=args.until,
+    )
+
+
+def reenrich(args):
+    from clients import get_openai_client
+    from reenrich import run_reenrich
+
+    run_reenrich(
+        client, get_openai_client(), select=args.select, action=args.action, object_param=args.object_param,
+        checkpoint_path=args.checkpoint, page_size=args.page_size, pack=args.pack, concurrency=args.concurrency,
+        requests_per_minute=args.rpm, tokens_per_minute=args.tpm, local_first=args.local_first, batch_size=args.batch_size,
+        since=args.since, limit=args.limit, dry_run=args.dry_run,
+    )
+
+
 if __name__ == "__main__":
-    print("=== Patients ===")
-    list_patients()
+    parser = argparse.ArgumentParser(description="Patient ontology utilities.")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("list", help="Print every patient")
+    demo_parser = sub.add_parser("demo", help="Submit a demo PRO")
+    demo_parser.add_argument("patient_id", nargs="?", default="PT001")
+
+    import_parser = sub.add_parser("import", help="Bulk-load historical PROs or vitals from CSV/JSONL")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--kind", choices=["pro", "vitals"], required=True)
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    import_parser.add_argument("--concurrency", type=int, default=8)
+    import_parser.add_argument("--rate", type=float, default=20.0, help="Max actions per second (0 = unlimited)")
+    import_parser.add_argument("--batch-size", type=int, default=1, help="Group up to N rows per batch action")
+    import_parser.add_argument("--enrich", action="store_true", help="Fill missing PRO sentiment/symptoms via OpenAI")
+    import_parser.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint.json)")
+    import_parser.add_argument("--validate-only", action="store_true", help="Range-check a vitals file against the vitals schema and exit (rejections go to <path>.invalid.jsonl)")
+
+    export_parser = sub.add_parser("export", help="Stream Patient, Vitals or PROEntity objects to a file")
+    export_parser.add_argument("type", choices=["patients", "vitals", "pros"])
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=["jsonl", "csv", "parquet"], help="Defaults to the file extension")
+    export_parser.add_argument("--page-size", type=int, default=500)
+    export_parser.add_argument("--fields", nargs="+", help="Only export these properties")
+    export_parser.add_argument("--where", nargs="+", metavar="PROP=VALUE", help="Equality filters, e.g. patient=PT001")
+    export_parser.add_argument("--since", help="Earliest date (vitals date_ / PRO submitted_at), YYYY-MM-DD")
+    export_parser.add_argument("--until", help="Latest date, YYYY-MM-DD")
+
+    reenrich_parser = sub.add_parser("reenrich", help="Re-run sentiment/symptom enrichment over existing PROs")
+    reenrich_parser.add_argument("--select", choices=["stub", "all"], default="stub",
+                                 help="stub: PROs with no symptoms and the default sentiment; all: every PRO not done for the current prompt")
+    reenrich_parser.add_argument("--action", default=os.getenv("REENRICH_ACTION", "edit_proentity"), help="Ontology action that updates a PRO")
+    reenrich_parser.add_argument("--object-param", default=os.getenv("REENRICH_OBJECT_PARAM", "proentity"), help="Action parameter naming the PRO")
+    reenrich_parser.add_argument("--checkpoint", default=os.getenv("REENRICH_CHECKPOINT_PATH", "data/reenrich.sqlite3"))
+    reenrich_parser.add_argument("--page-size", type=int, default=500)
+    reenrich_parser.add_argument("--pack", type=int, default=8, help="Notes per OpenAI request")
+    reenrich_parser.add_argument("--concurrency", type=int, default=4)
+    reenrich_parser.add_argument("--rpm", type=int, default=int(os.getenv("REENRICH_REQUESTS_PER_MINUTE", "300")), help="OpenAI requests per minute (0 = unlimited)")
+    reenrich_parser.add_argument("--tpm", type=int, default=int(os.getenv("REENRICH_TOKENS_PER_MINUTE", "90000")), help="OpenAI tokens per minute (0 = unlimited)")
+    reenrich_parser.add_argument("--batch-size", type=int, default=1, help="Group up to N write-backs per batch action")
+    reenrich_parser.add_argument("--local-first", action="store_true",
+                                 help="Answer notes the local lexicon is confident about without OpenAI (the default sends every note)")
+    reenrich_parser.add_argument("--since", help="Only PROs submitted on or after this date, YYYY-MM-DD")
+    reenrich_parser.add_argument("--limit", type=int)
+    reenrich_parser.add_argument("--dry-run", action="store_true", help="Log results without writing or checkpointing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    if args.command == "list":
+        list_patients()
+    elif args.command == "demo":
+        submit_demo_pro(args.patient_id)
+    elif args.command == "import":
+        bulk_import(args)
+    elif args.command == "export":
+        export(args)
+    elif args.command == "reenrich":
+        reenrich(args)
+    else:
+        print("=== Patients ===")
+        list_patients()
 
-    print("\n=== Submit PRO for PT001 ===")
-    submit_demo_pro("PT001")
\ No newline at end of file
+        print("\n=== Submit PRO for PT001 ===")
+        submit_demo_pro("PT001")
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = "1"
+
+_MISSING = object()
+
+
+def normalize_note(text):
+    text = " ".join(str(text).casefold().split())
+    return re.sub(r"[\s.!]+$", "", text)
+
+
+def cache_key(kind, text, prompt, model):
+    """Content address of a model result; any change to the prompt or model yields a new key."""
+    material = "\x00".join([CACHE_FORMAT_VERSION, kind, model, prompt, normalize_note(text)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Two-tier (in-process LRU + optional SQLite file) cache with TTL and size-based eviction."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=7 * 24 * 3600, path=None, max_disk_entries=200000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_writes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "stores": 0}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn().execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+        if self.path:
+            try:
+                row = self._conn().execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._conn().execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[1], value)
+                    self._count("disk_hits")
+                    return value
+                if row is not None:
+                    self._conn().execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._count("expired")
+            except Exception as e:
+                logger.warning(f"LLM disk cache read failed: {e}")
+
+        self._count("misses")
+        return default
+
+    def _remember(self, key, expires_at, value):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self._remember(key, expires_at, value)
+        self._count("stores")
+        if not self.path:
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._disk_writes += 1
+            if self._disk_writes % 500 == 0:
+                self._prune_disk(now)
+        except Exception as e:
+            logger.warning(f"LLM disk cache write failed: {e}")
+
+    def _prune_disk(self, now):
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_disk_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+            )
+        self._count("expired", expired)
+        self._count("evictions", max(0, overflow))
+
+    def get_or_compute(self, kind, text, prompt, model, compute, cacheable=lambda value: True):
+        key = cache_key(kind, text, prompt, model)
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = compute()
+        if cacheable(value):
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, memory_entries=len(self._memory))
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
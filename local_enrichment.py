@@ -0,0 +1,160 @@
+import math
+import re
+from typing import List, NamedTuple, Optional
+
+
+# canonical symptom -> phrases that report it (lowercase; matched on word boundaries, longest first)
+SYMPTOM_TERMS = {
+    "fatigue": ["fatigue", "fatigued", "tired", "exhausted", "exhaustion", "worn out", "no energy", "low energy", "lethargic", "lethargy"],
+    "headache": ["headache", "headaches", "migraine", "migraines", "head hurts", "head is pounding", "head pain"],
+    "nausea": ["nausea", "nauseous", "nauseated", "queasy", "sick to my stomach", "feel sick", "feeling sick"],
+    "vomiting": ["vomiting", "vomited", "throwing up", "threw up", "vomit"],
+    "dizziness": ["dizzy", "dizziness", "lightheaded", "light headed", "light-headed", "vertigo", "room spinning"],
+    "shortness of breath": ["shortness of breath", "short of breath", "breathless", "out of breath", "can't breathe", "cannot breathe", "trouble breathing", "difficulty breathing", "winded"],
+    "chest pain": ["chest pain", "chest pains", "chest tightness", "tight chest", "chest hurts", "pressure in my chest", "chest pressure"],
+    "palpitations": ["palpitations", "heart racing", "racing heart", "heart pounding", "pounding heart", "heart fluttering", "skipped beats", "irregular heartbeat"],
+    "cough": ["cough", "coughing", "coughed"],
+    "fever": ["fever", "feverish", "high temperature", "chills", "running hot"],
+    "sore throat": ["sore throat", "throat hurts", "scratchy throat"],
+    "congestion": ["congestion", "congested", "stuffy nose", "blocked nose", "runny nose"],
+    "insomnia": ["insomnia", "can't sleep", "cannot sleep", "couldn't sleep", "trouble sleeping", "poor sleep", "not sleeping", "sleepless", "waking up at night"],
+    "anxiety": ["anxiety", "anxious", "nervous", "panic", "panic attack", "worried", "on edge"],
+    "depression": ["depression", "depressed", "hopeless", "feeling down", "feeling low"],
+    "back pain": ["back pain", "back hurts", "backache", "lower back pain", "sore back"],
+    "joint pain": ["joint pain", "joints hurt", "aching joints", "arthritis pain", "knee pain", "hip pain", "stiff joints"],
+    "muscle pain": ["muscle pain", "muscle aches", "body aches", "sore muscles", "muscles hurt", "myalgia", "aching all over"],
+    "abdominal pain": ["abdominal pain", "stomach pain", "stomach ache", "stomachache", "belly pain", "tummy ache", "cramps", "cramping"],
+    "diarrhea": ["diarrhea", "diarrhoea", "loose stools", "runny stools"],
+    "constipation": ["constipation", "constipated"],
+    "loss of appetite": ["loss of appetite", "no appetite", "not hungry", "poor appetite", "not eating"],
+    "swelling": ["swelling", "swollen", "swollen ankles", "swollen legs", "edema", "oedema", "puffy"],
+    "rash": ["rash", "hives", "itchy skin", "itching", "itchy"],
+    "numbness": ["numbness", "numb", "tingling", "pins and needles"],
+    "weakness": ["weakness", "weak", "feeling weak"],
+    "confusion": ["confusion", "confused", "disoriented", "brain fog", "foggy"],
+    "blurred vision": ["blurred vision", "blurry vision", "vision is blurry", "trouble seeing"],
+    "fainting": ["fainting", "fainted", "passed out", "blacked out", "syncope"],
+    "bleeding": ["bleeding", "blood in", "bloody", "coughing up blood", "nosebleed", "nose bleed"],
+    "seizure": ["seizure", "seizures", "convulsion", "convulsions", "fitting"],
+    "suicidal thoughts": ["suicidal", "suicide", "kill myself", "end my life", "self harm", "self-harm", "hurt myself"],
+    "weight gain": ["weight gain", "gained weight", "putting on weight"],
+    "weight loss": ["weight loss", "lost weight", "losing weight"],
+    "frequent urination": ["frequent urination", "peeing a lot", "urinating a lot", "going to the bathroom a lot"],
+    "pain": ["pain", "painful", "hurts", "hurting", "aching", "ache", "sore"],
+}
+
+# Words that mark something physical is wrong; one outside every matched symptom lowers symptom confidence.
+SYMPTOM_CUES = ["ache", "aches", "burning", "bloated", "bloating", "discharge", "lump", "spasm", "spasms", "stiff", "stiffness",
+                "throbbing", "twitching", "wheezing", "shaking", "tremor", "sweating", "sweats", "infection", "injury", "injured",
+                "fell", "fall", "bruise", "bruising", "cramp", "limping", "shivering", "dehydrated", "ringing", "discomfort"]
+
+# Phrases that explicitly report nothing is wrong; without one (or a negated symptom) "none" is not trusted.
+ALL_CLEAR_PHRASES = ["no symptoms", "no complaints", "no issues", "no problems", "no pain", "symptom free", "symptom-free", "nothing to report"]
+
+# weighted sentiment lexicon: unigrams and bigrams
+SENTIMENT_LEXICON = {
+    "great": 2.5, "good": 2.0, "well": 1.5, "better": 2.0, "fine": 1.5, "excellent": 3.0, "amazing": 3.0, "wonderful": 3.0,
+    "happy": 2.5, "energetic": 2.5, "rested": 2.0, "improving": 2.5, "improved": 2.5, "stable": 1.5, "comfortable": 2.0,
+    "strong": 1.5, "okay": 1.0, "ok": 1.0, "alright": 1.0, "relieved": 2.0, "calm": 1.5, "positive": 2.0, "normal": 1.5,
+    "feeling good": 3.0, "feeling great": 3.5, "feeling better": 3.5, "much better": 3.0, "no complaints": 3.0,
+    "slept well": 3.0, "sleeping well": 3.0, "doing well": 3.0, "pretty good": 2.5, "back to normal": 3.0, "no pain": 3.0,
+    "no symptoms": 3.0, "no issues": 3.0, "no problems": 3.0,
+    "bad": -2.0, "worse": -2.5, "worst": -3.0, "terrible": -3.0, "awful": -3.0, "horrible": -3.0, "poor": -2.0,
+    "sick": -2.5, "ill": -2.0, "unwell": -2.5, "struggling": -2.5, "miserable": -3.0, "sad": -2.0, "scared": -2.0,
+    "worried": -2.0, "upset": -2.0, "frustrated": -2.0, "concerned": -1.5, "difficult": -1.5, "hard": -1.0,
+    "severe": -2.5, "unbearable": -3.0, "getting worse": -3.5, "not good": -3.0, "not great": -2.5, "not well": -3.0,
+    "not better": -3.0, "not improving": -3.0, "not sleeping": -2.5, "rough day": -2.5, "rough week": -2.5,
+}
+
+NEGATIONS = {"no", "not", "never", "without", "denies", "deny", "denied", "don't", "dont", "didn't", "didnt", "haven't",
+             "havent", "hasn't", "hasnt", "isn't", "isnt", "wasn't", "wasnt", "nor", "free", "none", "zero"}
+NEGATION_WINDOW = 5
+LONG_NOTE_WORDS = 120
+
+_WORD_RE = re.compile(r"[a-z']+")
+_BOUNDARY_RE = re.compile(r"[.,;!?]|\band\b|\bbut\b|\bhowever\b|\bthough\b")
+
+
+def _phrase_regex(phrases):
+    alternation = "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+    return re.compile(rf"(?<![\w'])(?:{alternation})(?![\w'])")
+
+
+_SYMPTOM_BY_PHRASE = {phrase: canonical for canonical, phrases in SYMPTOM_TERMS.items() for phrase in phrases}
+_SYMPTOM_RE = _phrase_regex(_SYMPTOM_BY_PHRASE)
+_SENTIMENT_RE = _phrase_regex(SENTIMENT_LEXICON)
+_CUE_RE = _phrase_regex(SYMPTOM_CUES)
+_ALL_CLEAR_RE = _phrase_regex(ALL_CLEAR_PHRASES)
+
+
+class LocalAnalysis(NamedTuple):
+    sentiment: Optional[str]
+    symptoms: List[str]
+    sentiment_confidence: float
+    symptoms_confidence: float
+
+
+def _negated(text, start):
+    """True if a negation word appears in the last few words of the clause before `start`."""
+    clause = _BOUNDARY_RE.split(text[max(0, start - 60):start])[-1]
+    return any(word in NEGATIONS for word in _WORD_RE.findall(clause)[-NEGATION_WINDOW:])
+
+
+def _unexplained_clause(text, spans):
+    """True if some clause with words in it overlaps none of the matched `spans`."""
+    start = 0
+    for boundary in [*_BOUNDARY_RE.finditer(text), None]:
+        end = boundary.start() if boundary else len(text)
+        if _WORD_RE.search(text, start, end) and not any(s < end and e > start for s, e in spans): return True
+        if boundary: start = boundary.end()
+    return False
+
+
+def analyze_note(text):
+    """Lexicon sentiment and vocabulary symptom match for a note, each with a 0-1 confidence.
+
+    Both scans are single compiled-regex passes over the lowercased note, so short notes take
+    well under a millisecond.
+    """
+    if not text or not text.strip():
+        return LocalAnalysis(None, ["none"], 0.0, 0.0)
+    lowered = text.lower()
+
+    all_clear = [(m.start(), m.end()) for m in _ALL_CLEAR_RE.finditer(lowered)]
+    symptoms, covered, denied = [], [], bool(all_clear)
+    for m in _SYMPTOM_RE.finditer(lowered):
+        covered.append((m.start(), m.end()))
+        canonical = _SYMPTOM_BY_PHRASE[m.group(0)]
+        if _negated(lowered, m.start()): denied = True
+        elif canonical not in symptoms: symptoms.append(canonical)
+    if len(symptoms) > 1 and "pain" in symptoms and any(s.endswith("pain") and s != "pain" for s in symptoms):
+        symptoms.remove("pain")
+    uncovered_cue = any(not any(s <= c.start() < e for s, e in covered) for c in _CUE_RE.finditer(lowered))
+
+    positive = negative = 0.0
+    sentiment_spans, flipped = [], False
+    for m in _SENTIMENT_RE.finditer(lowered):
+        sentiment_spans.append((m.start(), m.end()))
+        weight = SENTIMENT_LEXICON[m.group(0)]
+        # "no pain"-style phrases already carry their negation; anything else after a negator is flipped.
+        if not any(word in NEGATIONS for word in _WORD_RE.findall(m.group(0))) and _negated(lowered, m.start()):
+            weight, flipped = -weight * 0.75, True
+        if weight > 0: positive += weight
+        else: negative -= weight
+    negative += 1.0 * len(symptoms)
+    evidence = positive + negative
+    score = positive - negative
+
+    sentiment = ("Positive" if score > 0 else "Negative") if evidence else None
+    sentiment_confidence = (abs(score) / evidence) * (1.0 - math.exp(-evidence / 1.5)) if evidence else 0.0
+    # A flipped match ("not feeling great") is the lexicon's weakest reading; let the model confirm it.
+    if flipped: sentiment_confidence = min(sentiment_confidence, 0.6)
+    # "none" is only trusted when the note says so in a clause and every other clause is explained by the
+    # lexicon; a clause matching nothing may describe a symptom the vocabulary does not know ("lips turned blue").
+    if denied and not symptoms and _unexplained_clause(lowered, covered + all_clear + sentiment_spans): uncovered_cue = True
+    symptoms_confidence = 0.5 if uncovered_cue else (0.95 if symptoms else (0.85 if denied else 0.3))
+
+    if len(_WORD_RE.findall(lowered)) > LONG_NOTE_WORDS:
+        sentiment_confidence = min(sentiment_confidence, 0.7)
+        symptoms_confidence = min(symptoms_confidence, 0.7)
+    return LocalAnalysis(sentiment, symptoms or ["none"], round(sentiment_confidence, 3), symptoms_confidence)
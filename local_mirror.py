@@ -0,0 +1,204 @@
+"""Incremental local Parquet mirror of Patient, Vitals and PROEntity objects.
+
+    python local_mirror.py sync [--full] [--types vitals pros]
+
+Each object type is stored as a directory of Parquet part files plus a high-watermark on its date
+property, so a sync only fetches rows at or after the last seen date. Reads return Arrow tables.
+
+The object types have no creation or modification timestamp, so the watermark is the business date:
+a row written later with an older date (a backfill, an edit to an old PRO) is missed by an incremental
+sync. Writers that produce such rows call `require_full_sync` so the next sync of that type is full.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+
+from vitals_schema import VITALS_SCHEMA
+
+try: import pyarrow as pa; import pyarrow.compute as pc; import pyarrow.parquet as pq; PYARROW_AVAILABLE = True
+except ImportError: PYARROW_AVAILABLE = False
+
+try: import duckdb; DUCKDB_AVAILABLE = True
+except ImportError: DUCKDB_AVAILABLE = False
+
+
+logger = logging.getLogger(__name__)
+
+MIRROR_DIR = os.getenv("MIRROR_DIR", "data/mirror")
+MIRROR_MAX_PARTS = int(os.getenv("MIRROR_MAX_PARTS", "32"))
+
+# name -> (ontology object API name, watermark property or None for a full refresh each sync)
+OBJECT_TYPES = {
+    "patients": ("Patient", None),
+    "vitals": ("Vitals", "date_"),
+    "pros": ("Proentity", "submitted_at"),
+}
+
+PK_COLUMN = "_pk"
+
+
+def object_row(obj):
+    row = {k: v for k, v in vars(obj).items() if not k.startswith('_') and k not in ['rid']}
+    pk = getattr(obj, 'primary_key', None) or getattr(obj, 'id', None) or getattr(obj, 'rid', None)
+    row[PK_COLUMN] = str(pk)
+    return row
+
+
+def require_full_sync(name, root=MIRROR_DIR):
+    """Drop the watermark of object type `name` so its next sync re-downloads everything; False if there is no mirror."""
+    path = os.path.join(root, "state.json")
+    if not os.path.exists(path): return False
+    with open(path) as f:
+        state = json.load(f)
+    if not state.get(name, {}).pop("watermark", None): return True
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+    logger.info(f"Mirror {name} marked for a full sync")
+    return True
+
+
+def _encode_watermark(value):
+    if isinstance(value, datetime): return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date): return {"type": "date", "value": value.isoformat()}
+    return {"type": "str", "value": str(value)}
+
+
+def _decode_watermark(state):
+    if not state: return None
+    if state["type"] == "datetime": return datetime.fromisoformat(state["value"])
+    if state["type"] == "date": return date.fromisoformat(state["value"])
+    return state["value"]
+
+
+class LocalMirror:
+    def __init__(self, root=MIRROR_DIR, client=None, max_parts=MIRROR_MAX_PARTS):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("pyarrow is required for the local mirror; install it with `pip install pyarrow`")
+        self.root = root
+        self.client = client
+        self.max_parts = max_parts
+        os.makedirs(root, exist_ok=True)
+        self._state_path = os.path.join(root, "state.json")
+        self.state = {}
+        if os.path.exists(self._state_path):
+            with open(self._state_path) as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self._state_path)
+
+    def _dir(self, name):
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _parts(self, name):
+        path = self._dir(name)
+        return sorted(os.path.join(path, p) for p in os.listdir(path) if p.endswith(".parquet"))
+
+    def sync(self, names=None, full=False):
+        """Fetch new rows for each object type; returns {name: rows fetched}."""
+        if self.client is None:
+            from clients import get_foundry_client
+            self.client = get_foundry_client()
+        from hospital_pro_patient_facing_app_sdk.ontology import objects as object_types
+
+        fetched = {}
+        for name in names or OBJECT_TYPES:
+            api_name, watermark_prop = OBJECT_TYPES[name]
+            started = time.perf_counter()
+            type_state = self.state.setdefault(name, {})
+            watermark = None if full or not watermark_prop else _decode_watermark(type_state.get("watermark"))
+
+            object_set = getattr(self.client.ontology.objects, api_name)
+            if watermark is not None:
+                prop = getattr(getattr(object_types, api_name).object_type, watermark_prop)
+                object_set = object_set.where(prop >= watermark)
+
+            rows = []
+            new_watermark = watermark
+            for obj in object_set.iterate():
+                rows.append(object_row(obj))
+                value = getattr(obj, watermark_prop, None) if watermark_prop else None
+                if value is not None and (new_watermark is None or value > new_watermark):
+                    new_watermark = value
+
+            if watermark is None:
+                for part in self._parts(name): os.remove(part)
+            if rows:
+                self._write(name, pa.Table.from_pylist(rows))
+            if new_watermark is not None:
+                type_state["watermark"] = _encode_watermark(new_watermark)
+            type_state["last_sync"] = time.time()
+            type_state["last_sync_rows"] = len(rows)
+            self._save_state()
+            fetched[name] = len(rows)
+            logger.info(f"Mirrored {len(rows)} {name} rows in {time.perf_counter() - started:.2f}s (watermark {new_watermark})")
+        return fetched
+
+    def _write(self, name, table):
+        # Rows at the watermark are fetched again next sync; drop older copies of re-fetched keys.
+        new_keys = table.column(PK_COLUMN)
+        for part in self._parts(name):
+            keys = pq.read_table(part, columns=[PK_COLUMN]).column(PK_COLUMN)
+            if pc.any(pc.is_in(keys, value_set=new_keys)).as_py():
+                kept = pq.read_table(part).filter(pc.invert(pc.is_in(pc.field(PK_COLUMN), value_set=new_keys)))
+                if kept.num_rows: pq.write_table(kept, part)
+                else: os.remove(part)
+        pq.write_table(table, os.path.join(self._dir(name), f"part-{time.time_ns()}.parquet"))
+        if len(self._parts(name)) > self.max_parts:
+            self.compact(name)
+
+    def compact(self, name):
+        parts = self._parts(name)
+        if len(parts) < 2: return
+        merged = self.table(name)
+        pq.write_table(merged, os.path.join(self._dir(name), f"part-{time.time_ns()}.parquet"))
+        for part in parts: os.remove(part)
+
+    def table(self, name, columns=None, filter=None):
+        """Arrow table of a mirrored object type; `filter` is a pyarrow.compute expression."""
+        tables = [pq.read_table(part, columns=columns, filters=filter) for part in self._parts(name)]
+        if not tables:
+            return pa.table({})
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    def vitals_records(self, patient_id, start=None, end=None):
+        expr = pc.field("patient") == patient_id
+        if start is not None: expr = expr & (pc.field("date_") >= start)
+        if end is not None: expr = expr & (pc.field("date_") <= end)
+        # Parts synced before a vital was added to the ontology lack its column, so select after reading.
+        table = self.table("vitals", filter=expr)
+        columns = [c for c in ["date_", *VITALS_SCHEMA.by_name] if c in table.column_names]
+        return [VITALS_SCHEMA.record(r.pop("date_"), r) for r in table.select(columns).to_pylist()]
+
+    def duckdb(self):
+        """DuckDB connection with `patients`, `vitals` and `pros` views over the Parquet parts."""
+        if not DUCKDB_AVAILABLE:
+            raise RuntimeError("duckdb is not installed; use LocalMirror.table() for Arrow access")
+        conn = duckdb.connect()
+        for name in OBJECT_TYPES:
+            if self._parts(name):
+                conn.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{self._dir(name)}/*.parquet', union_by_name=true)")
+        return conn
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Mirror Ontology objects into local Parquet files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_parser = sub.add_parser("sync")
+    sync_parser.add_argument("--full", action="store_true", help="Ignore watermarks and re-download everything")
+    sync_parser.add_argument("--types", nargs="+", choices=list(OBJECT_TYPES), help="Object types to sync")
+    sync_parser.add_argument("--dir", default=MIRROR_DIR)
+    args = parser.parse_args()
+
+    print(LocalMirror(args.dir).sync(args.types, full=args.full))
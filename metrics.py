@@ -0,0 +1,154 @@
+import bisect
+import cProfile
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class PipelineMetrics:
+    """Stage timing histograms, outcome counters and in-flight gauges rendered in Prometheus text format."""
+
+    def __init__(self, prefix="webhook", buckets=DEFAULT_BUCKETS, profile_every=0, profile_dir="profiles"):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.profile_every = profile_every
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._collectors = []
+        self._requests = 0
+        self._profile_lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = _Histogram(len(self.buckets) + 1)
+            hist.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist.sum += seconds
+            hist.count += 1
+
+    def inc(self, outcome, n=1):
+        with self._lock:
+            self._counters[outcome] = self._counters.get(outcome, 0) + n
+
+    def gauge_add(self, name, n):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    @contextmanager
+    def in_flight(self, name):
+        self.gauge_add(name, 1)
+        try:
+            yield
+        finally:
+            self.gauge_add(name, -1)
+
+    @contextmanager
+    def maybe_profile(self):
+        """Capture a cProfile of every `profile_every`-th request (0 disables)."""
+        with self._lock:
+            self._requests += 1
+            request_number = self._requests
+        if not self.profile_every or request_number % self.profile_every or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{self.prefix}-{int(time.time())}-{request_number}.prof")
+            profiler.dump_stats(path)
+            logger.info(f"Saved request profile to {path}")
+        finally:
+            self._profile_lock.release()
+
+    def register_collector(self, collector):
+        """`collector()` returns (name, value, help) tuples rendered as extra gauges."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {name: {"count": h.count, "sum": h.sum, "counts": list(h.counts)} for name, h in self._histograms.items()},
+                "outcomes": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+
+    def quantile(self, stage, q):
+        """Approximate quantile from histogram buckets (upper bound of the bucket holding it)."""
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None or not hist.count:
+                return None
+            target = q * hist.count
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), hist.counts):
+                running += count
+                if running >= target:
+                    return bound
+        return None
+
+    def render(self):
+        p = self.prefix
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {p}_stage_duration_seconds Time spent in each webhook pipeline stage.",
+            f"# TYPE {p}_stage_duration_seconds histogram",
+        ]
+        for stage, h in sorted(snap["stages"].items()):
+            running = 0
+            for bound, count in zip(self.buckets, h["counts"]):
+                running += count
+                lines.append(f"{p}_stage_duration_seconds_bucket{_labels(stage=stage, le=bound)} {running}")
+            lines.append(f"{p}_stage_duration_seconds_bucket{_labels(stage=stage, le='+Inf')} {h['count']}")
+            lines.append(f"{p}_stage_duration_seconds_sum{_labels(stage=stage)} {h['sum']:.6f}")
+            lines.append(f"{p}_stage_duration_seconds_count{_labels(stage=stage)} {h['count']}")
+
+        lines += [f"# HELP {p}_outcomes_total Webhook processing outcomes.", f"# TYPE {p}_outcomes_total counter"]
+        for outcome, value in sorted(snap["outcomes"].items()):
+            lines.append(f"{p}_outcomes_total{_labels(outcome=outcome)} {value}")
+
+        for name, value in sorted(snap["gauges"].items()):
+            lines += [f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+
+        for collector in self._collectors:
+            try: extra = list(collector())
+            except Exception as e: logger.warning(f"Metrics collector failed: {e}"); continue
+            for name, value, help_text in extra:
+                lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,185 @@
+"""Streaming export of Patient, Vitals and PROEntity objects to JSONL, CSV or Parquet.
+
+    python list_and_submit.py export vitals vitals.parquet --page-size 1000 --fields patient date_ hrv
+
+Objects are fetched one page at a time and each page is written before the next is requested, so
+memory use depends on the page size rather than on the number of objects.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+
+from local_mirror import OBJECT_TYPES, PK_COLUMN, object_row
+
+try: import pyarrow as pa; import pyarrow.parquet as pq; PYARROW_AVAILABLE = True
+except ImportError: PYARROW_AVAILABLE = False
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)): return value.isoformat()
+    return str(value)
+
+
+class _JsonlWriter:
+    def __init__(self, path):
+        self.f = open(path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(row, default=_json_default) + "\n")
+
+    def close(self):
+        self.f.close()
+
+
+class _CsvWriter:
+    """Columns are added as they first appear; a page with new columns rewrites the file so far under the wider header."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.writer = None
+        self.fieldnames = []
+
+    def write(self, rows):
+        known = set(self.fieldnames)
+        new = [k for k in dict.fromkeys(k for row in rows for k in row) if k not in known]
+        if new or self.writer is None:
+            self._widen(new)
+        for row in rows:
+            self.writer.writerow({k: json.dumps(v) if isinstance(v, (list, dict)) else v for k, v in row.items()})
+
+    def _widen(self, new):
+        self.fieldnames += new
+        old = None
+        if self.f is not None:
+            self.f.close()
+            old = self.path + ".tmp"
+            os.replace(self.path, old)
+        self.f = open(self.path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.f, fieldnames=self.fieldnames)
+        self.writer.writeheader()
+        if old is not None:
+            with open(old, newline="", encoding="utf-8") as f:
+                self.writer.writerows(csv.DictReader(f))
+            os.remove(old)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def _as_text(value):
+    return json.dumps(value, default=_json_default) if isinstance(value, (list, dict)) else _json_default(value)
+
+
+class _ParquetWriter:
+    """Each page is written as a row group. A column's type is inferred from the first page that has it, and
+    all-null columns are stored as strings; a page with new columns rewrites the file so far with them added."""
+
+    def __init__(self, path):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("pyarrow is required for Parquet export; install it with `pip install pyarrow`")
+        self.path = path
+        self.writer = None
+
+    def write(self, rows):
+        known = set(self.writer.schema.names) if self.writer is not None else set()
+        new = [k for k in dict.fromkeys(k for row in rows for k in row) if k not in known]
+        if new or self.writer is None:
+            inferred = pa.Table.from_pylist([{k: row.get(k) for k in new} for row in rows]).schema
+            self._widen([pa.field(f.name, pa.string() if pa.types.is_null(f.type) else f.type) for f in inferred])
+        schema = self.writer.schema
+        text = [f.name for f in schema if pa.types.is_string(f.type)]
+        rows = [{**row, **{k: _as_text(row[k]) for k in text if row.get(k) is not None and not isinstance(row[k], str)}} for row in rows]
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+    def _widen(self, fields):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, pa.schema(fields)); return
+        schema = pa.schema(list(self.writer.schema) + fields)
+        self.writer.close()
+        old = self.path + ".tmp"
+        os.replace(self.path, old)
+        self.writer = pq.ParquetWriter(self.path, schema)
+        for batch in pq.ParquetFile(old).iter_batches():
+            table = pa.Table.from_batches([batch])
+            for field in fields:
+                table = table.append_column(field, pa.nulls(len(table), field.type))
+            self.writer.write_table(table)
+        os.remove(old)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {"jsonl": _JsonlWriter, "csv": _CsvWriter, "parquet": _ParquetWriter}
+
+
+def _filter_value(prop_name, value):
+    if prop_name in ("date_", "submitted_at"):
+        try: return date.fromisoformat(value)
+        except ValueError: return value
+    return value
+
+
+def object_pages(client, name, page_size=500, where=None, since=None, until=None):
+    """Yield lists of objects of type `name`, one server page at a time.
+
+    `where` maps property names to required values; `since`/`until` bound the type's date property.
+    """
+    from hospital_pro_patient_facing_app_sdk.ontology import objects as object_types
+
+    api_name, date_prop = OBJECT_TYPES[name]
+    object_type = getattr(object_types, api_name).object_type
+    object_set = getattr(client.ontology.objects, api_name)
+    for prop_name, value in (where or {}).items():
+        object_set = object_set.where(getattr(object_type, prop_name) == _filter_value(prop_name, value))
+    if (since or until) and not date_prop:
+        raise ValueError(f"{name} has no date property to filter on")
+    if since: object_set = object_set.where(getattr(object_type, date_prop) >= _filter_value(date_prop, since))
+    if until: object_set = object_set.where(getattr(object_type, date_prop) <= _filter_value(date_prop, until))
+
+    page_token = None
+    while True:
+        page = object_set.page(page_size=page_size, page_token=page_token)
+        if page.data:
+            yield page.data
+        page_token = page.next_page_token
+        if not page_token:
+            return
+
+
+def export_objects(client, name, path, fmt=None, page_size=500, fields=None, where=None, since=None, until=None,
+                   report_every=2.0):
+    """Stream objects of type `name` to `path`; returns the number of rows written."""
+    fmt = fmt or next((f for f in FORMATS if path.lower().endswith("." + f)), "jsonl")
+    writer = WRITERS[fmt](path)
+    started = last_report = time.monotonic()
+    written = 0
+    try:
+        for objects in object_pages(client, name, page_size, where, since, until):
+            rows = [object_row(obj) for obj in objects]
+            for row in rows: row.pop(PK_COLUMN, None)  # the mirror's own key column, not an object property
+            if fields:
+                rows = [{f: row.get(f) for f in fields} for row in rows]
+            writer.write(rows)
+            written += len(rows)
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                last_report = now
+                print(f"[{name}] {written} rows, {written / (now - started):.1f} rows/s", flush=True)
+    finally:
+        writer.close()
+    elapsed = time.monotonic() - started
+    print(f"[{name}] exported {written} rows to {path} in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f} rows/s)", flush=True)
+    return written
@@ -0,0 +1,203 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import List, NamedTuple, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    if not name:
+        return ""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9 ]+", " ", text.lower())
+    return " ".join(text.split())
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+_SOUNDEX_CODES = {c: d for d, letters in {
+    "1": "bfpv", "2": "cgjkqsxz", "3": "dt", "4": "l", "5": "mn", "6": "r",
+}.items() for c in letters}
+
+
+def soundex(token):
+    token = "".join(c for c in token if c.isalpha())
+    if not token:
+        return ""
+    code = token[0].upper()
+    last = _SOUNDEX_CODES.get(token[0], "")
+    for c in token[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != last:
+            code += digit
+        if c not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def phonetic_key(normalized):
+    return " ".join(soundex(t) for t in normalized.split())
+
+
+class Candidate(NamedTuple):
+    patient_id: str
+    name: str
+    score: float
+
+
+class PatientMatch(NamedTuple):
+    patient_id: Optional[str]
+    patient: object
+    method: str
+    score: float
+    ambiguous: bool
+    candidates: List[Candidate]
+
+
+class PatientDirectory:
+    """In-memory Patient index: exact hash lookups plus trigram/phonetic near-miss matching."""
+
+    def __init__(self, client, refresh_interval=300.0, fuzzy_threshold=0.6, ambiguity_margin=0.05):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.fuzzy_threshold = fuzzy_threshold
+        self.ambiguity_margin = ambiguity_margin
+        self._lock = threading.Lock()
+        self._patients = {}
+        self._names = {}
+        self._exact = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        self._phonetic = defaultdict(set)
+        self._stop = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.last_refresh = None
+
+    def __len__(self):
+        return len(self._patients)
+
+    def _index(self, patient_id, normalized):
+        self._names[patient_id] = normalized
+        self._exact[normalized].add(patient_id)
+        for gram in trigrams(normalized):
+            self._trigrams[gram].add(patient_id)
+        self._phonetic[phonetic_key(normalized)].add(patient_id)
+
+    def _unindex(self, patient_id):
+        normalized = self._names.pop(patient_id, None)
+        if normalized is None:
+            return
+        for index, key in [(self._exact, normalized), (self._phonetic, phonetic_key(normalized))]:
+            index[key].discard(patient_id)
+            if not index[key]:
+                del index[key]
+        for gram in trigrams(normalized):
+            self._trigrams[gram].discard(patient_id)
+            if not self._trigrams[gram]:
+                del self._trigrams[gram]
+
+    def refresh(self):
+        """Re-read all patients and apply only the differences to the indexes."""
+        started = time.perf_counter()
+        fetched = {}
+        for patient in self.client.ontology.objects.Patient.iterate():
+            fetched[patient.id] = patient
+        added = changed = 0
+        with self._lock:
+            for patient_id in set(self._patients) - set(fetched):
+                self._unindex(patient_id)
+                del self._patients[patient_id]
+            for patient_id, patient in fetched.items():
+                normalized = normalize_name(getattr(patient, "name", None))
+                previous = self._names.get(patient_id)
+                if previous is None:
+                    self._index(patient_id, normalized); added += 1
+                elif previous != normalized:
+                    self._unindex(patient_id); self._index(patient_id, normalized); changed += 1
+                self._patients[patient_id] = patient
+            self.loaded = True
+            self.last_refresh = time.time()
+        logger.info(f"Patient directory refreshed: {len(fetched)} patients ({added} added, {changed} renamed) in {time.perf_counter() - started:.2f}s")
+
+    def _refresh_loop(self):
+        delay = self.refresh_interval if self.loaded else 0.0
+        while not self._stop.wait(delay):
+            try: self.refresh()
+            except Exception as e: logger.error(f"Patient directory refresh failed: {e}", exc_info=True)
+            delay = self.refresh_interval
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="patient-directory", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, patient_id):
+        return self._patients.get(patient_id)
+
+    def add(self, patient):
+        with self._lock:
+            self._unindex(patient.id)
+            self._index(patient.id, normalize_name(getattr(patient, "name", None)))
+            self._patients[patient.id] = patient
+
+    def lookup(self, name):
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        with self._lock:
+            return self._lookup(normalized)
+
+    def _tokens_agree(self, normalized, other):
+        """Every word of the query is close to some word of the name, so a shared surname cannot carry
+        a different first name (Rupert Smith vs Robert Smith) over the threshold."""
+        other_grams = [trigrams(t) for t in other.split()]
+        for token in normalized.split():
+            grams = trigrams(token)
+            if not any(2.0 * len(grams & g) / (len(grams) + len(g)) >= self.fuzzy_threshold for g in other_grams):
+                return False
+        return True
+
+    def _lookup(self, normalized):
+        exact_ids = self._exact.get(normalized)
+        if exact_ids:
+            ids = sorted(exact_ids)
+            candidates = [Candidate(i, getattr(self._patients.get(i), "name", ""), 1.0) for i in ids]
+            patient_id = ids[0] if len(ids) == 1 else None
+            return PatientMatch(patient_id, self._patients.get(patient_id), "exact", 1.0, len(ids) > 1, candidates)
+
+        query_grams = trigrams(normalized)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for patient_id in self._trigrams.get(gram, ()):
+                shared[patient_id] += 1
+        phonetic_ids = self._phonetic.get(phonetic_key(normalized), set())
+
+        # A Soundex collision (Robert/Rupert) only makes a patient a candidate; the trigram score must pass on its own.
+        scored = []
+        for patient_id in set(shared) | phonetic_ids:
+            other = self._names.get(patient_id)
+            if other is None:
+                continue
+            score = 2.0 * shared.get(patient_id, 0) / (len(query_grams) + len(trigrams(other)))
+            scored.append(Candidate(patient_id, getattr(self._patients.get(patient_id), "name", ""), round(min(score, 0.99), 3)))
+        scored = [c for c in scored if c.score >= self.fuzzy_threshold and self._tokens_agree(normalized, self._names[c.patient_id])]
+        if not scored:
+            return None
+        scored.sort(key=lambda c: c.score, reverse=True)
+        best = scored[0]
+        ambiguous = len(scored) > 1 and best.score - scored[1].score < self.ambiguity_margin
+        method = "phonetic" if best.patient_id in phonetic_ids else "fuzzy"
+        patient_id = None if ambiguous else best.patient_id
+        return PatientMatch(patient_id, self._patients.get(patient_id), method, best.score, ambiguous, scored[:5])
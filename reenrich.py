@@ -0,0 +1,215 @@
+"""Batch re-enrichment of PROEntities written without real sentiment/symptoms.
+
+    python list_and_submit.py reenrich --action edit_proentity --rpm 300 --tpm 90000 --pack 8
+
+PROs are paged from the Ontology and selected client-side and packed several to a chat request
+under a per-minute request and token budget; with --local-first, notes the local lexicon is
+confident about are answered without the model. Results are written back through an Ontology action. A SQLite checkpoint records
+each PRO done under the current prompt/model version, so a re-run only picks up what is left,
+and changing the prompt makes every PRO eligible again.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from enrichment import ENRICHMENT_MODEL, ENRICHMENT_PROMPT, LOCAL_ENRICHMENT_MIN_CONFIDENCE, parse_sentiment, parse_symptoms
+from local_enrichment import analyze_note
+from local_mirror import require_full_sync
+from ontology_export import object_pages
+from write_coalescer import WriteCoalescer, apply_action
+
+
+logger = logging.getLogger(__name__)
+
+REENRICH_CHECKPOINT_PATH = os.getenv("REENRICH_CHECKPOINT_PATH", "data/reenrich.sqlite3")
+REENRICH_ACTION = os.getenv("REENRICH_ACTION", "edit_proentity")
+REENRICH_OBJECT_PARAM = os.getenv("REENRICH_OBJECT_PARAM", "proentity")
+
+PACKED_PROMPT = (
+    "You are a healthcare assistant. You will receive several patient check-in notes, each with an id. For every "
+    "note, classify the overall sentiment as Positive or Negative and extract all symptoms mentioned. Respond with a "
+    "JSON object only, in the form {\"results\": [{\"id\": \"...\", \"sentiment\": \"Positive\" or \"Negative\", "
+    "\"symptoms\": [\"...\"]}]}, with one entry per note. If a note mentions no symptoms, use [\"none\"]."
+)
+PROMPT_VERSION = hashlib.sha256(f"{ENRICHMENT_MODEL}\n{ENRICHMENT_PROMPT}\n{PACKED_PROMPT}".encode("utf-8")).hexdigest()[:12]
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def is_stub(row):
+    """PROs written while the AI step was stubbed: no symptoms and the forced default sentiment."""
+    symptoms = row.get("symptoms")
+    return (not symptoms or list(symptoms) == ["none"]) and row.get("sentiment") in (None, "", "Negative")
+
+
+SELECTORS = {"stub": is_stub, "all": lambda row: True}
+
+
+class MinuteBudget:
+    """Blocks until a request of `tokens` fits in the last 60s of requests and tokens."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+
+    def _usage(self, now):
+        while self._events and now - self._events[0][0] >= 60.0:
+            self._events.popleft()
+        return len(self._events), sum(tokens for _, tokens in self._events)
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                requests, used = self._usage(now)
+                fits_rpm = not self.rpm or requests < self.rpm
+                # A single oversized request is still allowed through once the window is empty.
+                fits_tpm = not self.tpm or used + tokens <= self.tpm or not self._events
+                if fits_rpm and fits_tpm:
+                    self._events.append((now, tokens))
+                    return
+                wait = 60.0 - (now - self._events[0][0]) if self._events else 0.1
+            time.sleep(min(max(wait, 0.05), 5.0))
+
+    def correct(self, estimated, actual):
+        """Replace the most recent matching estimate with the token count the API reported."""
+        with self._lock:
+            for i in range(len(self._events) - 1, -1, -1):
+                if self._events[i][1] == estimated:
+                    self._events[i] = (self._events[i][0], actual); return
+
+
+class ReenrichCheckpoint:
+    def __init__(self, path=REENRICH_CHECKPOINT_PATH):
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS reenriched (pk TEXT NOT NULL, version TEXT NOT NULL, sentiment TEXT, symptoms TEXT, source TEXT, done_at REAL, PRIMARY KEY (pk, version))")
+        self._lock = threading.Lock()
+
+    def done(self, pk, version=PROMPT_VERSION):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM reenriched WHERE pk = ? AND version = ?", (pk, version)).fetchone() is not None
+
+    def mark(self, pk, enrichment, source, version=PROMPT_VERSION):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO reenriched VALUES (?, ?, ?, ?, ?, ?)",
+                               (pk, version, enrichment[0], json.dumps(enrichment[1]), source, time.time()))
+
+
+def _packed_request(client, notes, timeout):
+    """notes: [(pk, text)]; returns ({pk: (sentiment, symptoms)}, tokens used or None)."""
+    body = "\n\n".join(f"id: {pk}\nnote: {text}" for pk, text in notes)
+    resp = client.with_options(timeout=timeout, max_retries=2).chat.completions.create(
+        model=ENRICHMENT_MODEL,
+        messages=[{"role": "system", "content": PACKED_PROMPT}, {"role": "user", "content": body}],
+        response_format={"type": "json_object"},
+    )
+    usage = getattr(resp, "usage", None)
+    try: parsed = json.loads(resp.choices[0].message.content)
+    except json.JSONDecodeError: logger.warning("Packed enrichment returned invalid JSON"); return {}, getattr(usage, "total_tokens", None)
+    results = {}
+    for item in parsed.get("results", []) if isinstance(parsed, dict) else []:
+        if not isinstance(item, dict): continue
+        sentiment = parse_sentiment(item.get("sentiment"))
+        if sentiment is not None:
+            results[str(item.get("id"))] = (sentiment, parse_symptoms(item.get("symptoms")))
+    return results, getattr(usage, "total_tokens", None)
+
+
+def run_reenrich(client, openai_client, select="stub", action=REENRICH_ACTION, object_param=REENRICH_OBJECT_PARAM,
+                 checkpoint_path=REENRICH_CHECKPOINT_PATH, page_size=500, pack=8, concurrency=4, requests_per_minute=0,
+                 tokens_per_minute=0, local_first=False, batch_size=1, since=None, limit=None, dry_run=False,
+                 timeout=60.0, report_every=5.0):
+    selector = SELECTORS[select]
+    checkpoint = ReenrichCheckpoint(checkpoint_path)
+    budget = MinuteBudget(requests_per_minute, tokens_per_minute)
+    coalescer = WriteCoalescer(client, window=0.05, max_batch=batch_size) if batch_size > 1 and not dry_run else None
+    counts = collections.Counter()
+    counts_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    started = last_report = time.monotonic()
+
+    def count(name, n=1):
+        with counts_lock: counts[name] += n
+
+    def write_back(pk, enrichment, source):
+        sentiment, symptoms = enrichment
+        if dry_run:
+            logger.info(f"[dry run] {pk}: {sentiment} {symptoms} ({source})"); count(source); return
+        params = {object_param: pk, "sentiment": sentiment if sentiment == "Positive" else "Negative", "symptoms": symptoms or ["none"]}
+        result = coalescer.submit(action, **params).result() if coalescer else apply_action(client, action, params)
+        if result.validation_result != "VALID":
+            logger.error(f"{action} rejected for {pk}: {result.validation_result} {result.details}"); count("write_failed"); return
+        checkpoint.mark(pk, enrichment, source)
+        count(source)
+
+    def enrich_pack(notes):
+        try:
+            estimated = estimate_tokens(PACKED_PROMPT) + sum(estimate_tokens(t) for _, t in notes) + 40 * len(notes)
+            budget.acquire(estimated)
+            results, used = _packed_request(openai_client, notes, timeout)
+            if used: budget.correct(estimated, used)
+            count("requests"); count("tokens", used or estimated)
+        except Exception as e:
+            logger.error(f"Packed enrichment of {len(notes)} notes failed: {e}"); count("llm_failed", len(notes)); return
+        finally:
+            in_flight.release()
+        for pk, text in notes:
+            if pk not in results: count("unanswered"); continue
+            try: write_back(pk, results[pk], "llm")
+            except Exception as e: logger.error(f"Write-back failed for {pk}: {e}"); count("write_failed")
+
+    def write_local(pk, enrichment):
+        try: write_back(pk, enrichment, "local")
+        except Exception as e: logger.error(f"Write-back failed for {pk}: {e}"); count("write_failed")
+        finally: in_flight.release()
+
+    def flush(pending, pool):
+        in_flight.acquire()
+        pool.submit(enrich_pack, list(pending))
+        pending.clear()
+
+    pending, pending_tokens, max_pack_tokens = [], 0, (tokens_per_minute // 2 if tokens_per_minute else 8000)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reenrich") as pool:
+        seen = 0
+        for objects in object_pages(client, "pros", page_size, since=since):
+            for obj in objects:
+                pk = str(getattr(obj, "primary_key", None) or getattr(obj, "id", None) or getattr(obj, "rid", None))
+                row = {k: v for k, v in vars(obj).items() if not k.startswith("_")}
+                text = row.get("free_text") or row.get("freeText")
+                if not text or not text.strip() or not selector(row) or checkpoint.done(pk):
+                    continue
+                if limit and seen >= limit: break
+                seen += 1
+                local = analyze_note(text) if local_first else None
+                if local and local.sentiment is not None and min(local.sentiment_confidence, local.symptoms_confidence) >= LOCAL_ENRICHMENT_MIN_CONFIDENCE:
+                    in_flight.acquire()
+                    pool.submit(write_local, pk, (local.sentiment, local.symptoms))
+                    continue
+                if openai_client is None:
+                    count("skipped_no_llm"); continue
+                pending.append((pk, text)); pending_tokens += estimate_tokens(text)
+                if len(pending) >= pack or pending_tokens >= max_pack_tokens:
+                    flush(pending, pool); pending_tokens = 0
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                last_report = now
+                print(f"[reenrich] {seen} selected, {dict(counts)}, {seen / (now - started):.1f} PROs/s", flush=True)
+            if limit and seen >= limit: break
+        if pending: flush(pending, pool)
+    elapsed = time.monotonic() - started
+    print(f"[reenrich] finished in {elapsed:.1f}s: {dict(counts)} (prompt version {PROMPT_VERSION})", flush=True)
+    # Edited PROs keep their submitted_at, which is behind the mirror's watermark.
+    if not dry_run and (counts["local"] or counts["llm"]): require_full_sync("pros")
+    return dict(counts)
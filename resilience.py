@@ -0,0 +1,215 @@
+import collections
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RESILIENCE_THREADS", "32")), thread_name_prefix="upstream")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the dependency while its breaker is open."""
+
+
+class UpstreamTimeout(TimeoutError):
+    pass
+
+
+class CircuitBreaker:
+    """Trips when, over the last `window` calls (at least `min_calls`), the share of failed or slow
+    calls reaches `failure_rate`. After `reset_timeout` seconds one trial call is let through
+    (half-open); it closes the breaker on success and re-opens it on failure.
+    """
+
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=None, window=50, min_calls=20, reset_timeout=30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = collections.deque(maxlen=window)
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record(self, ok, seconds):
+        slow = self.slow_call_seconds is not None and seconds >= self.slow_call_seconds
+        with self._lock:
+            self.stats["calls"] += 1
+            if not ok: self.stats["failures"] += 1
+            if slow: self.stats["slow_calls"] += 1
+            bad = not ok or slow
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+                if bad: self._open()
+                else: self.state = CLOSED; self._outcomes.clear(); logger.info(f"Circuit '{self.name}' closed")
+                return
+            self._outcomes.append(bad)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.stats["opened"] += 1
+        logger.warning(f"Circuit '{self.name}' opened; failing fast for {self.reset_timeout}s")
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, **self.stats}
+
+
+def backoff_delays(attempts, base=0.1, cap=2.0):
+    """Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2**n)] before retry n+1."""
+    for n in range(attempts - 1):
+        yield random.uniform(0, min(cap, base * 2 ** n))
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Dependency:
+    """One upstream (e.g. Foundry reads) with a timeout, a circuit breaker, optional retries and hedging.
+
+    Timeouts free the caller; the abandoned call finishes on the shared upstream pool.
+    """
+
+    def __init__(self, name, timeout=None, retries=0, backoff_base=0.1, backoff_cap=2.0, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker(name)
+
+    def _attempt(self, fn, timeout):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        started = time.monotonic()
+        try:
+            if timeout:
+                try: result = _executor.submit(fn).result(timeout=timeout)
+                except FutureTimeoutError: raise UpstreamTimeout(f"{self.name} call exceeded {timeout}s")
+            else:
+                result = fn()
+        except Exception:
+            self.breaker.record(False, time.monotonic() - started)
+            raise
+        self.breaker.record(True, time.monotonic() - started)
+        return result
+
+    def call(self, fn, idempotent=False, timeout=None):
+        """Run `fn()`; idempotent calls are retried with jittered backoff (never once the breaker is open)."""
+        timeout = timeout or self.timeout
+        delays = backoff_delays(self.retries + 1, self.backoff_base, self.backoff_cap) if idempotent else iter(())
+        while True:
+            try:
+                return self._attempt(fn, timeout)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                delay = next(delays, None)
+                if delay is None: raise
+                logger.info(f"{self.name} call failed ({e}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def hedged(self, fn, hedge_after, timeout=None):
+        """Idempotent read that starts a second copy if the first has not answered after `hedge_after` seconds."""
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        primary = _executor.submit(self._attempt, fn, None)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        futures = [primary]
+        try: futures.append(_executor.submit(self._attempt, fn, None))
+        except Exception: pass
+        errors = []
+        while futures:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                raise UpstreamTimeout(f"{self.name} hedged call exceeded {timeout}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                errors.append(future.exception())
+            futures = list(pending)
+        raise errors[-1]
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _from_env(name, prefix, timeout, retries=0, slow_call_seconds=None):
+    return Dependency(
+        name,
+        timeout=_env_float(f"{prefix}_TIMEOUT_SECONDS", timeout),
+        retries=int(os.getenv(f"{prefix}_RETRIES", str(retries))),
+        breaker=CircuitBreaker(
+            name,
+            failure_rate=_env_float(f"{prefix}_BREAKER_FAILURE_RATE", 0.5),
+            slow_call_seconds=_env_float(f"{prefix}_BREAKER_SLOW_CALL_SECONDS", slow_call_seconds),
+            window=int(os.getenv(f"{prefix}_BREAKER_WINDOW", "50")),
+            min_calls=int(os.getenv(f"{prefix}_BREAKER_MIN_CALLS", "20")),
+            reset_timeout=_env_float(f"{prefix}_BREAKER_RESET_SECONDS", 30.0),
+        ),
+    )
+
+
+foundry_reads = _from_env("foundry_reads", "FOUNDRY_READ", timeout=5.0, retries=2, slow_call_seconds=2.0)
+foundry_writes = _from_env("foundry_writes", "FOUNDRY_WRITE", timeout=60.0, slow_call_seconds=5.0)
+openai_calls = _from_env("openai", "OPENAI", timeout=None, slow_call_seconds=5.0)
+
+DEPENDENCIES = {d.name: d for d in (foundry_reads, foundry_writes, openai_calls)}
+
+
+def breaker_states():
+    return {name: dep.breaker.snapshot() for name, dep in DEPENDENCIES.items()}
@@ -1,15 +1,20 @@
 import streamlit as st
 import os
-from hospital_pro_patient_facing_app_sdk import FoundryClient
-from hospital_pro_patient_facing_app_sdk.ontology.objects import Patient, Proentity, Vitals
-from foundry_sdk_runtime.auth import UserTokenAuth
+from hospital_pro_patient_facing_app_sdk.ontology.objects import Patient
 from foundry_sdk_runtime.types import ActionConfig, ActionMode, ReturnEditsMode
-from datetime import date
+from datetime import date, timedelta
 from dotenv import load_dotenv
-from foundry_client import client as ontology_client
-from openai import OpenAI
-from twilio.rest import Client as TwilioClient
-import json
+import clients
+from patient_directory import PatientDirectory
+from ehr_data import EHRDataStore, pro_detail_fields, pro_field
+from vitals_trend import trend_frame
+from vitals_schema import VITALS_SCHEMA
+import alert_dispatcher as alerts
+from anomaly_engine import create_engine as create_anomaly_engine
+from cohort_analytics import create_analytics as create_cohort_analytics
+from local_mirror import LocalMirror
+from change_feed import CHANGE_FEED_URL, ChangeFeed, ChangeSubscriber
+from enrichment import enrich_note
 import pandas as pd
 import streamlit.components.v1 as components
 
@@ -19,13 +24,200 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     st.error("OPENAI_API_KEY environment variable not set. Please set it and restart.")
     st.stop()
-client_ai = OpenAI(api_key=openai_api_key)
 
-twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+
+@st.cache_resource
+def get_foundry_client():
+    return clients.get_foundry_client()
+
+
+@st.cache_resource
+def get_openai_client():
+    return clients.get_openai_client()
+
+
+@st.cache_resource
+def get_twilio_client():
+    return clients.get_twilio_client()
+
+
+client_ai = get_openai_client()
+
 twilio_phone_number = os.getenv("TWILIO_PHONE_NUMBER")
 
-twilio_client = TwilioClient(twilio_account_sid, twilio_auth_token)
+
+@st.cache_resource
+def get_alert_dispatcher():
+    return alerts.create_dispatcher(get_twilio_client, from_number=twilio_phone_number)
+
+
+alert_dispatcher = get_alert_dispatcher()
+
+
+@st.cache_resource
+def get_anomaly_engine():
+    if os.getenv("ANOMALY_DETECTION_ENABLED", "true").lower() != "true":
+        return None
+    # The webhook owns the snapshot file; this process only reads it and keeps its own updates in memory.
+    mirror = LocalMirror() if os.getenv("EHR_READ_FROM_MIRROR", "false").lower() == "true" else None
+    return create_anomaly_engine(client=None if mirror else get_foundry_client(), mirror=mirror, save=False)
+
+
+@st.cache_resource
+def get_cohort_analytics():
+    if os.getenv("COHORT_ANALYTICS_ENABLED", "true").lower() != "true":
+        return None
+    # The webhook owns the cohort snapshot; this process re-reads it when it changes. Objects submitted here
+    # reach the aggregates through the owner's next rebuild from the Ontology or mirror, not a local increment
+    # (which the next reload would overwrite anyway).
+    mirror = LocalMirror() if os.getenv("EHR_READ_FROM_MIRROR", "false").lower() == "true" else None
+    return create_cohort_analytics(client=None if mirror else get_foundry_client(), mirror=mirror, save=False)
+
+VITALS_DEFAULT_WINDOW_DAYS = int(os.getenv("VITALS_DEFAULT_WINDOW_DAYS", "90"))
+VITALS_CHART_MAX_POINTS = int(os.getenv("VITALS_CHART_MAX_POINTS", "500"))
+
+
+@st.cache_resource
+def get_ehr_data():
+    mirror = LocalMirror() if os.getenv("EHR_READ_FROM_MIRROR", "false").lower() == "true" else None
+    return EHRDataStore(get_foundry_client(), ttl_seconds=float(os.getenv("EHR_CACHE_TTL_SECONDS", "300")), mirror=mirror)
+
+
+@st.cache_resource
+def get_patient_directory():
+    directory = PatientDirectory(get_foundry_client(), refresh_interval=float(os.getenv("PATIENT_DIRECTORY_REFRESH_SECONDS", "300")))
+    directory.refresh()
+    directory.start()
+    return directory
+
+
+@st.cache_resource
+def get_change_subscriber():
+    if os.getenv("CHANGE_FEED_ENABLED", "true").lower() != "true":
+        return None
+    # One subscriber per process: each change the webhook publishes is applied to the shared EHR cache once,
+    # read from the webhook's log file, or from its /changes/stream endpoint when CHANGE_FEED_URL is set.
+    return ChangeSubscriber(get_ehr_data().apply_change, feed=None if CHANGE_FEED_URL else ChangeFeed())
+
+
+change_subscriber = get_change_subscriber()
+# The vitals chart and PRO list rerun on their own at this interval to show changes already applied to the cache.
+LIVE_REFRESH_SECONDS = float(os.getenv("CHANGE_FEED_REFRESH_SECONDS", "2")) if change_subscriber is not None else None
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def vitals_trend_section(patient_found):
+    ehr_data = get_ehr_data()
+    if change_subscriber is not None: change_subscriber.watch(patient_found.id)
+    st.subheader("Patient Vitals Trend")
+    try:
+        trend_col1, trend_col2 = st.columns(2)
+        with trend_col1:
+            date_range = st.date_input("Date range:", value=(date.today() - timedelta(days=VITALS_DEFAULT_WINDOW_DAYS), date.today()))
+        with trend_col2:
+            bucket = st.selectbox("Aggregate by:", ["Daily", "Weekly", "Monthly"])
+        start, end = (date_range[0], date_range[1]) if isinstance(date_range, (list, tuple)) and len(date_range) == 2 else (None, None)
+        records = ehr_data.get_vitals(patient_found.id, start, end)
+        if records:
+            st.line_chart(trend_frame(records, bucket, VITALS_CHART_MAX_POINTS))
+        else:
+            st.info("No vitals found for this patient.")
+    except Exception as e:
+        st.error(f"Error loading vitals: {e}")
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def pro_feed_section(patient_found):
+    ehr_data = get_ehr_data()
+    if change_subscriber is not None: change_subscriber.watch(patient_found.id)
+    st.subheader("Linked Patient Reported Outcomes")
+    try:
+        view_col, size_col = st.columns(2)
+        with view_col:
+            pro_view = st.radio("View:", ["Cards", "Compact table"], horizontal=True)
+        with size_col:
+            pro_page_size = st.selectbox("Per page:", [10, 20, 50], index=1)
+
+        pro_state_key = f"pro_page_tokens_{patient_found.id}_{pro_page_size}"
+        if pro_state_key not in st.session_state:
+            st.session_state[pro_state_key] = [None]
+        page_tokens = st.session_state[pro_state_key]
+        linked_pro_entities, next_page_token = ehr_data.get_pro_page(patient_found, pro_page_size, page_tokens[-1])
+
+        if linked_pro_entities:
+            if pro_view == "Compact table":
+                table_rows = [{
+                    'Submitted': pro_field(pro_entity, 'submitted_at'),
+                    'Sentiment': pro_field(pro_entity, 'sentiment'),
+                    'Symptoms': ", ".join(pro_field(pro_entity, 'symptoms') or []),
+                    'Notes': (pro_field(pro_entity, 'free_text') or "")[:80],
+                } for pro_entity in linked_pro_entities]
+                selection = st.dataframe(pd.DataFrame(table_rows), hide_index=True, on_select="rerun", selection_mode="single-row")
+                selected_rows = selection.selection.rows if selection else []
+                if selected_rows:
+                    pro_entity = linked_pro_entities[selected_rows[0]]
+                    with st.expander("PRO details", expanded=True):
+                        if pro_field(pro_entity, 'free_text'):
+                            st.markdown(f"> {pro_field(pro_entity, 'free_text')}")
+                        for linked_prop_name in pro_detail_fields(pro_entity):
+                            linked_prop_value = getattr(pro_entity, linked_prop_name, None)
+                            st.markdown(f"**{linked_prop_name.replace('_', ' ').title()}:** " + (f"`{linked_prop_value}`" if linked_prop_value is not None else "_Not set_"))
+            else:
+                for pro_entity in linked_pro_entities:
+                    with st.container(border=True):
+                        submitted_at = pro_field(pro_entity, 'submitted_at')
+                        sentiment = pro_field(pro_entity, 'sentiment')
+                        symptoms = pro_field(pro_entity, 'symptoms') or []
+                        free_text = pro_field(pro_entity, 'free_text')
+
+                        if submitted_at:
+                            st.markdown(f"**Submitted:** {submitted_at}")
+
+                        if sentiment:
+                            st.markdown(f"**Sentiment:** {sentiment}")
+
+                        if symptoms:
+                            symptom_str = ", ".join(symptoms)
+                            st.markdown(f"**Symptoms:** {symptom_str}")
+                        else:
+                            st.markdown("**Symptoms:** _None reported_")
+
+                        if free_text:
+                            st.markdown("**Notes:**")
+                            st.markdown(f"> {free_text}")
+
+                        detail_fields = pro_detail_fields(pro_entity)
+                        if detail_fields:
+                            linked_col1, linked_col2 = st.columns(2)
+                            for linked_count, linked_prop_name in enumerate(detail_fields):
+                                linked_prop_value = getattr(pro_entity, linked_prop_name, None)
+                                linked_display_value = f"`{linked_prop_value}`" if linked_prop_value is not None else "_Not set_"
+                                with (linked_col1 if linked_count % 2 == 0 else linked_col2):
+                                    st.markdown(f"**{linked_prop_name.replace('_', ' ').title()}:** {linked_display_value}")
+                        else:
+                             st.markdown("_No other details available._")
+
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                if st.button("Newer", disabled=len(page_tokens) == 1):
+                    page_tokens.pop(); st.rerun(scope="fragment")
+            with page_col:
+                st.caption(f"Page {len(page_tokens)}")
+            with next_col:
+                if st.button("Older", disabled=not next_page_token):
+                    page_tokens.append(next_page_token); st.rerun(scope="fragment")
+
+        else:
+            st.info("No linked PRO Entities found for this patient.")
+
+    except AttributeError as attr_error:
+         if 'proentities' in str(attr_error):
+             st.warning("Could not find the 'proentities' link. Please verify the link API name in the Ontology.")
+         else:
+             st.warning(f"An attribute error occurred: {attr_error}")
+    except Exception as link_error:
+        st.error(f"An error occurred while fetching or displaying linked PRO Entities: {link_error}")
+
 
 st.title("Patient EHR Hub")
 
@@ -47,24 +239,32 @@ if not foundry_token:
     st.stop()
 
 try:
-    auth = UserTokenAuth(
-        hostname="https://benshvartsman1.usw-18.palantirfoundry.com",
-        token=foundry_token
-    )
-
-    client = FoundryClient(
-        auth=auth,
-        hostname="https://benshvartsman1.usw-18.palantirfoundry.com"
-    )
+    client = get_foundry_client()
+    ontology_client = client
 
     PatientObjectService = client.ontology.objects.Patient
+    patient_directory = get_patient_directory()
+    ehr_data = get_ehr_data()
     if search_button and search_term:
-        results = PatientObjectService.where(Patient.object_type.name == search_term).take(1)
-        st.session_state['patient_found'] = results[0] if results else None
+        match = patient_directory.lookup(search_term)
+        if match is None:
+            results = PatientObjectService.where(Patient.object_type.name == search_term).take(1)
+            st.session_state['patient_found'] = results[0] if results else None
+            if results:
+                patient_directory.add(results[0])
+        elif match.ambiguous:
+            st.warning(f"Several patients match '{search_term}': " + ", ".join(c.name for c in match.candidates) + ". Please refine the name.")
+            st.session_state['patient_found'] = None
+        else:
+            st.session_state['patient_found'] = match.patient
+            if match.method != "exact":
+                st.info(f"Showing closest match '{match.patient.name}' for '{search_term}'.")
 
     patient_found = st.session_state['patient_found']
     if patient_found:
-        st.subheader(f"{search_term}'s EHR")
+        st.subheader(f"{getattr(patient_found, 'name', None) or search_term}'s EHR")
+        if st.button("Refresh patient data"):
+            ehr_data.invalidate(patient_found.id)
         st.markdown("---")
         properties = vars(patient_found)
         col1, col2 = st.columns(2)
@@ -98,44 +298,29 @@ try:
                         st.error("Please enter your check-in notes before submitting.")
                     else:
                         try:
-                            sentiment_resp = client_ai.chat.completions.create(
-                                model="gpt-3.5-turbo",
-                                messages=[
-                                    {"role": "system", "content": "You are a healthcare assistant. Classify the sentiment of the following patient check-in note as Positive or Negative. Respond with only one word: Positive or Negative."},
-                                    {"role": "user", "content": pro_free_text}
-                                ]
-                            )
-                            sentiment = sentiment_resp.choices[0].message.content.strip()
-
-                            symptoms_resp = client_ai.chat.completions.create(
-                                model="gpt-3.5-turbo",
-                                messages=[
-                                    {"role": "system", "content": "You are a healthcare assistant. Extract all symptoms mentioned in the following patient check-in note. Return a JSON array of strings only. If no symptoms are mentioned, return [\"none\"]. No commentary or explanation."},
-                                    {"role": "user", "content": pro_free_text}
-                                ]
-                            )
-                            symptoms_str = symptoms_resp.choices[0].message.content.strip()
-                            try:
-                                symptoms = json.loads(symptoms_str)
-                            except json.JSONDecodeError:
-                                symptoms = ["none"]
-                            if not symptoms:
-                                symptoms = ["none"]
+                            sentiment, symptoms = enrich_note(client_ai, pro_free_text)
+                            if sentiment is None:
+                                st.warning("AI enrichment was unavailable; the PRO will be submitted with the default sentiment and no symptoms.")
 
                             action_cfg = ActionConfig(
                                 mode=ActionMode.VALIDATE_AND_EXECUTE,
-                                return_edits=ReturnEditsMode.ALL,
+                                return_edits=ReturnEditsMode.NONE,
                             )
                             response = ontology_client.ontology.actions.create_proentity(
                                 action_config=action_cfg,
                                 patient=patient_found.id,
                                 submitted_at=date.today().isoformat(),
                                 free_text=pro_free_text,
-                                sentiment=sentiment,
+                                sentiment=sentiment or "Negative",
                                 symptoms=symptoms,
                             )
                             if response.validation.validation_result == "VALID":
                                 st.success("PRO submitted successfully!")
+                                ehr_data.invalidate(patient_found.id, "pros")
+                                if alert_dispatcher is not None and alert_dispatcher.check(patient_found.id, getattr(patient_found, "name", None), sentiment=sentiment, symptoms=symptoms):
+                                    st.info("Your care team has been notified.")
+                                for pro_state_key in [k for k in st.session_state if k.startswith(f"pro_page_tokens_{patient_found.id}_")]:
+                                    del st.session_state[pro_state_key]
                         except Exception as e:
                             st.error(f"Error during PRO submission: {e}")
                             st.exception(e)
@@ -143,27 +328,45 @@ try:
         st.markdown("---")
         with st.expander("Submit New Daily Vitals", expanded=False):
             with st.form("new_vitals_form", clear_on_submit=True):
-                hrv = st.number_input("Heart Rate Variability (HRV):", min_value=0, step=1)
-                heart_rate = st.number_input("Heart Rate:", min_value=0, step=1)
-                sleep_hours = st.number_input("Sleep Hours:", min_value=0.0, step=0.1, format="%.1f")
+                vitals_input = {}
+                vitals_cols = st.columns(2)
+                # Only vitals create_vitals stores (VITALS_ACTION_FIELDS); the rest would be dropped on submit.
+                for i, spec in enumerate(s for s in VITALS_SCHEMA.specs if s.name in VITALS_SCHEMA.action_fields):
+                    with vitals_cols[i % 2]:
+                        vitals_input[spec.name] = st.number_input(
+                            f"{spec.label} ({spec.unit}):",
+                            min_value=spec.dtype(0),
+                            value=None if spec.fill is None else spec.dtype(spec.fill),
+                            step=spec.dtype(spec.step),
+                            format="%.1f" if spec.dtype is float else "%d",
+                            placeholder="optional",
+                        )
                 submitted_vitals = st.form_submit_button("Submit Vitals")
                 if submitted_vitals:
+                    validated_v = VITALS_SCHEMA.validate({name: value for name, value in vitals_input.items() if value})
+                    for name, reason in validated_v.errors.items():
+                        st.warning(f"{VITALS_SCHEMA.labels[name]} not submitted: {reason}")
+                    vitals_params = VITALS_SCHEMA.action_params(validated_v.values)
                     action_cfg_v = ActionConfig(
                         mode=ActionMode.VALIDATE_AND_EXECUTE,
-                        return_edits=ReturnEditsMode.ALL,
+                        return_edits=ReturnEditsMode.NONE,
                     )
                     try:
                         response_v = ontology_client.ontology.actions.create_vitals(
                             action_config=action_cfg_v,
                             date_=date.today(),
-                            hrv=hrv,
-                            sleep_hours=sleep_hours,
                             patient=patient_found.id,
-                            heart_rate=heart_rate,
+                            **vitals_params,
                         )
                         if response_v.validation.validation_result == "VALID":
                             st.success("Vitals submitted successfully!")
-                            st.info("Click 'Search' again to refresh the vitals list.")
+                            ehr_data.record_vitals(patient_found.id, VITALS_SCHEMA.record(date.today(), vitals_params))
+                            anomaly_engine = get_anomaly_engine()
+                            anomalies = anomaly_engine.observe(patient_found.id, validated_v.values) if anomaly_engine is not None else []
+                            for anomaly in anomalies:
+                                st.warning(anomaly.describe())
+                            if alert_dispatcher is not None and alert_dispatcher.check(patient_found.id, getattr(patient_found, "name", None), vitals=validated_v.values, anomalies=anomalies):
+                                st.info("Your care team has been notified.")
                         else:
                             st.error(f"Vitals submission failed validation: {response_v.validation.validation_result}")
                             try:
@@ -177,77 +380,8 @@ try:
                         st.exception(err_v)
 
         st.markdown("---")
-        st.subheader("Patient Vitals Trend")
-        try:
-            vitals_list = list(client.ontology.objects.Vitals.where(Vitals.object_type.patient == patient_found.id).iterate())
-            if vitals_list:
-                records = [{
-                    'date': v.date_,
-                    'HRV': v.hrv,
-                    'Heart Rate': v.heart_rate,
-                    'Sleep Hours': v.sleep_hours
-                } for v in vitals_list]
-                df_v = pd.DataFrame(records)
-                df_v['date'] = pd.to_datetime(df_v['date'])
-                df_v = df_v.set_index('date').sort_index()
-                st.line_chart(df_v)
-            else:
-                st.info("No vitals found for this patient.")
-        except Exception as e:
-            st.error(f"Error loading vitals: {e}")
-        st.subheader("Linked Patient Reported Outcomes")
-        try:
-            linked_pro_entities_iterator = patient_found.proentities.iterate()
-            linked_pro_entities = list(linked_pro_entities_iterator)
-            
-            if linked_pro_entities:
-                for pro_entity in linked_pro_entities:
-                    with st.container(border=True):
-                        submitted_at = getattr(pro_entity, 'submittedAt', None)
-                        sentiment = getattr(pro_entity, 'sentiment', None)
-                        symptoms = getattr(pro_entity, 'symptoms', [])
-                        free_text = getattr(pro_entity, 'freeText', None)
-
-                        if sentiment:
-                            st.markdown(f"**Sentiment:** {sentiment}")
-                        
-                        if symptoms:
-                            symptom_str = ", ".join(symptoms)
-                            st.markdown(f"**Symptoms:** {symptom_str}")
-                        else:
-                            st.markdown("**Symptoms:** _None reported_")
-
-                        if free_text:
-                            st.markdown("**Notes:**")
-                            st.markdown(f"> {free_text}")
-                        
-                        linked_col1, linked_col2 = st.columns(2)
-                        linked_count = 0
-                        remaining_props_displayed = False
-                        for linked_prop_name, linked_prop_value in vars(pro_entity).items():
-                            if not linked_prop_name.startswith('_') and linked_prop_name not in ['rid', 'primary_key', 'id', 'submittedAt', 'sentiment', 'symptoms', 'freeText', 'patient']:
-                                remaining_props_displayed = True
-                                linked_display_value = f"`{linked_prop_value}`" if linked_prop_value is not None else "_Not set_"
-                                if linked_count % 2 == 0:
-                                    with linked_col1:
-                                        st.markdown(f"**{linked_prop_name.replace('_', ' ').title()}:** {linked_display_value}")
-                                else:
-                                    with linked_col2:
-                                        st.markdown(f"**{linked_prop_name.replace('_', ' ').title()}:** {linked_display_value}")
-                                linked_count += 1
-                        if not remaining_props_displayed:
-                             st.markdown("_No other details available._")
-
-            else:
-                st.info("No linked PRO Entities found for this patient.")
-                
-        except AttributeError as attr_error:
-             if 'proentities' in str(attr_error):
-                 st.warning("Could not find the 'proentities' link. Please verify the link API name in the Ontology.")
-             else:
-                 st.warning(f"An attribute error occurred: {attr_error}")
-        except Exception as link_error:
-            st.error(f"An error occurred while fetching or displaying linked PRO Entities: {link_error}")
+        vitals_trend_section(patient_found)
+        pro_feed_section(patient_found)
     
     elif search_button and not patient_found:
         st.warning(f"Could not find patient with name '{search_term}'.")
@@ -255,4 +389,32 @@ try:
 
 except Exception as e:
     st.error(f"An error occurred during setup or search:")
-    st.exception(e)
\ No newline at end of file
+    st.exception(e)
+
+
+st.markdown("---")
+st.subheader("Cohort Insights (consenting patients)")
+try:
+    cohort_analytics = get_cohort_analytics()
+    if cohort_analytics is None:
+        st.info("Cohort analytics are disabled (COHORT_ANALYTICS_ENABLED=false).")
+    else:
+        cohort_analytics.reload_if_changed()
+        conditions = cohort_analytics.conditions()
+        if not conditions:
+            st.info("Cohort aggregates are still being built; check back shortly." if cohort_analytics.warming else "No cohort data yet.")
+        else:
+            condition = st.selectbox("Condition:", ["All conditions"] + conditions)
+            condition = None if condition == "All conditions" else condition
+            rates = cohort_analytics.sentiment_rates(condition)
+            st.markdown("**Positive sentiment rate by treatment**")
+            st.bar_chart(rates.groupby("treatment")[["pros", "positive"]].sum().eval("positive_rate = positive / pros")["positive_rate"])
+            cohort_col1, cohort_col2 = st.columns(2)
+            with cohort_col1:
+                st.markdown("**Most reported symptoms**")
+                st.dataframe(cohort_analytics.symptom_frequencies(condition, top=5), hide_index=True)
+            with cohort_col2:
+                st.markdown("**Vitals change after treatment start**")
+                st.dataframe(cohort_analytics.vitals_deltas(condition), hide_index=True)
+except Exception as e:
+    st.error(f"Error loading cohort analytics: {e}")
@@ -0,0 +1,239 @@
+"""Capture of verified post-call webhook bodies and time-scaled replay against a target.
+
+    python traffic_capture.py replay data/capture --target http://localhost:5000 --speed 4
+    python traffic_capture.py replay data/capture/capture-1700000000.jsonl.gz --speed 0   # as fast as possible
+
+Captured deliveries are gzip JSON lines ({"t": arrival time, "body": payload}) in size-rotated files.
+Redactors run on the writer thread, never on the request path. Replay re-signs every body with the
+target's webhook secret and preserves the original inter-arrival gaps divided by --speed.
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from webhook_signature import sign
+
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "data/capture")
+CAPTURE_MAX_FILE_BYTES = int(os.getenv("CAPTURE_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "20"))
+CAPTURE_REDACTION_SALT = os.getenv("CAPTURE_REDACTION_SALT", "")
+
+_WORD = re.compile(r"[^\W\d_]")
+
+
+def pseudonym(name, salt=CAPTURE_REDACTION_SALT):
+    """Stable stand-in for a patient name, so repeat callers still look like the same patient."""
+    digest = hashlib.sha256((salt + name.strip().lower()).encode("utf-8")).hexdigest()[:8]
+    return f"Patient {digest}"
+
+
+def mask_text(text):
+    """Replace letters with 'x', keeping length, digits and punctuation (so payload sizes are preserved)."""
+    return _WORD.sub("x", text) if isinstance(text, str) else text
+
+
+def redact_phi(data):
+    """Default redactor: pseudonymise the collected name and mask free text, transcript and summary."""
+    conversation = data.get("data") if isinstance(data, dict) else None
+    if not isinstance(conversation, dict):
+        return data
+    for turn in conversation.get("transcript") or []:
+        if isinstance(turn, dict): turn["message"] = mask_text(turn.get("message"))
+    analysis = conversation.get("analysis") or {}
+    if "transcript_summary" in analysis: analysis["transcript_summary"] = mask_text(analysis["transcript_summary"])
+    results = analysis.get("data_collection_results") or {}
+    for key, redact in (("name", lambda v: pseudonym(v) if isinstance(v, str) else v), ("free_text", mask_text)):
+        item = results.get(key)
+        if isinstance(item, dict): item["value"] = redact(item.get("value"))
+        elif item is not None: results[key] = redact(item)
+    return data
+
+
+REDACTORS = {"phi": [redact_phi], "none": []}
+
+
+class TrafficCapture:
+    """Appends deliveries to gzip JSON-lines files from a background thread.
+
+    Files rotate at `max_bytes` (compressed) and only the newest `max_files` are kept. Each
+    redactor takes the parsed payload and returns it redacted; a failing redactor drops the record.
+    """
+
+    def __init__(self, directory=CAPTURE_DIR, max_bytes=CAPTURE_MAX_FILE_BYTES, max_files=CAPTURE_MAX_FILES, redactors=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.redactors = list(REDACTORS["phi"] if redactors is None else redactors)
+        self.stats = {"captured": 0, "dropped": 0, "files": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(maxsize=10000)
+        self._file = None
+        self._raw = None
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def add_redactor(self, redactor):
+        self.redactors.append(redactor)
+
+    def record(self, raw_body, arrived_at=None):
+        """Non-blocking; drops the record if the writer has fallen behind."""
+        try: self._queue.put_nowait((time.time() if arrived_at is None else arrived_at, raw_body))
+        except queue.Full: self.stats["dropped"] += 1
+
+    def _open(self):
+        path = os.path.join(self.directory, f"capture-{time.time_ns()}.jsonl.gz")
+        self._raw = open(path, "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        self.stats["files"] += 1
+        files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl.gz")))
+        for old in files[:max(0, len(files) - self.max_files)]:
+            os.remove(old)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close(); self._raw.close()
+            self._file = self._raw = None
+
+    def _write(self, arrived_at, raw_body):
+        data = json.loads(raw_body.decode("utf-8"))
+        for redactor in self.redactors:
+            data = redactor(data)
+        if self._file is None:
+            self._open()
+        self._file.write((json.dumps({"t": arrived_at, "body": data}, separators=(",", ":")) + "\n").encode("utf-8"))
+        self.stats["captured"] += 1
+        if self._raw.tell() >= self.max_bytes:
+            self._close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._close(); return
+            try: self._write(*item)
+            except Exception as e: self.stats["dropped"] += 1; logger.warning(f"Traffic capture dropped a delivery: {e}")
+            if self._queue.empty() and self._file is not None:
+                self._file.flush()
+
+    def close(self, timeout=5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+def read_capture(paths):
+    """Yield (arrival time, payload dict) from capture files or directories, in arrival order."""
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, "capture-*.jsonl.gz"))) if os.path.isdir(path) else [path]
+    records = []
+    for path in files:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip(): records.append(json.loads(line))
+        except (EOFError, OSError) as e:
+            # The newest file may still be open for writing; keep the records read so far.
+            logger.info(f"Stopped reading {path} early: {e}")
+    records.sort(key=lambda r: r["t"])
+    for record in records:
+        yield record["t"], record["body"]
+
+
+def _post(url, raw_body, secret, timeout):
+    headers = {"Content-Type": "application/json"}
+    if secret: headers["ElevenLabs-Signature"] = sign(raw_body, secret)
+    req = urllib.request.Request(url, data=raw_body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception as e:
+        return type(e).__name__
+
+
+def _with_run_suffix(body, suffix):
+    conversation = body.get("data") if isinstance(body, dict) else None
+    if isinstance(conversation, dict) and conversation.get("conversation_id"):
+        conversation["conversation_id"] = f"{conversation['conversation_id']}-{suffix}"
+    return body
+
+
+def replay(paths, target, secret, speed=1.0, concurrency=16, timeout=30.0, limit=None, keep_ids=False):
+    """Send captured deliveries to `target`; speed 0 means as fast as `concurrency` allows.
+
+    Conversation ids get a per-run suffix unless `keep_ids`, so the target's duplicate detection
+    treats a second replay as new traffic while retries within the capture still collide.
+    """
+    url = target.rstrip("/") + "/webhook/elevenlabs/postcall" if "/webhook/" not in target else target
+    events = list(read_capture(paths))[:limit]
+    if not events:
+        print("No captured deliveries found.")
+        return {}
+    statuses, latencies, lags = {}, [], []
+    lock = threading.Lock()
+
+    def send(raw_body, scheduled):
+        started = time.perf_counter()
+        status = _post(url, raw_body, secret, timeout)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            lags.append(max(0.0, started - scheduled))
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    run_suffix = f"replay{int(time.time())}"
+    first_t = events[0][0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for t, body in events:
+            scheduled = started + (t - first_t) / speed if speed else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            if not keep_ids: body = _with_run_suffix(body, run_suffix)
+            pool.submit(send, json.dumps(body).encode("utf-8"), scheduled)
+    wall = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        "deliveries": len(events),
+        "original_span_seconds": round(events[-1][0] - first_t, 3),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(events) / wall, 2) if wall else None,
+        "latency_ms_p50": round(latencies[len(latencies) // 2] * 1000.0, 3),
+        "latency_ms_p99": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000.0, 3),
+        "max_schedule_lag_ms": round(max(lags) * 1000.0, 3),
+        "status_counts": statuses,
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Replay captured post-call webhook traffic.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay")
+    replay_parser.add_argument("paths", nargs="+", help="Capture files or directories")
+    replay_parser.add_argument("--target", default="http://localhost:5000")
+    replay_parser.add_argument("--secret", default=os.getenv("ELEVENLABS_WEBHOOK_SECRET"), help="Secret used to re-sign bodies")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Time scale (2 = twice as fast, 0 = no delays)")
+    replay_parser.add_argument("--concurrency", type=int, default=16)
+    replay_parser.add_argument("--timeout", type=float, default=30.0)
+    replay_parser.add_argument("--limit", type=int)
+    replay_parser.add_argument("--keep-ids", action="store_true", help="Send conversation ids unchanged")
+    args = parser.parse_args()
+
+    replay(args.paths, args.target, args.secret, speed=args.speed, concurrency=args.concurrency, timeout=args.timeout, limit=args.limit, keep_ids=args.keep_ids)
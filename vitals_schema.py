@@ -0,0 +1,196 @@
+import math
+import os
+from typing import Callable, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class VitalSpec(NamedTuple):
+    name: str                      # create_vitals parameter / Vitals property
+    label: str                     # chart and form label
+    dtype: type                    # int or float
+    unit: str
+    minimum: float
+    maximum: float
+    source_keys: Tuple[str, ...]   # payload keys accepted for this vital, first match wins
+    fill: Optional[float] = None   # value sent when the vital is missing (None = omit the parameter)
+    step: float = 1.0
+    normalize: Optional[Callable] = None  # applied to numpy arrays before the range check
+    alert_below: Optional[float] = None   # clinician alert thresholds (plausible but abnormal readings)
+    alert_above: Optional[float] = None
+
+
+def _fahrenheit_to_celsius(values):
+    # Anything above 50 cannot be a body temperature in Celsius, so treat it as Fahrenheit.
+    return np.where(values > 50, (values - 32) * 5.0 / 9.0, values)
+
+
+VITALS = (
+    VitalSpec("hrv", "HRV", int, "ms", 1, 300, ("hrv", "heart_rate_variability"), fill=0),
+    VitalSpec("heart_rate", "Heart Rate", int, "bpm", 20, 250, ("heart_rate", "pulse", "bpm"), fill=0, alert_below=40, alert_above=130),
+    VitalSpec("sleep_hours", "Sleep Hours", float, "h", 0, 24, ("sleep_hours", "sleep"), fill=0.0, step=0.1),
+    VitalSpec("spo2", "SpO2", int, "%", 50, 100, ("spo2", "oxygen_saturation", "o2_saturation"), alert_below=92),
+    VitalSpec("systolic_bp", "Systolic BP", int, "mmHg", 50, 260, ("systolic_bp", "blood_pressure_systolic", "systolic"), alert_below=90, alert_above=180),
+    VitalSpec("diastolic_bp", "Diastolic BP", int, "mmHg", 25, 160, ("diastolic_bp", "blood_pressure_diastolic", "diastolic"), alert_above=120),
+    VitalSpec("steps", "Steps", int, "steps", 0, 100000, ("steps", "step_count")),
+    VitalSpec("temperature_c", "Temperature", float, "°C", 30, 45, ("temperature_c", "temperature", "body_temperature"), step=0.1,
+              normalize=_fahrenheit_to_celsius, alert_below=35.0, alert_above=38.5),
+)
+
+# Payload keys holding "systolic/diastolic" in one string.
+COMBINED_BLOOD_PRESSURE_KEYS = ("blood_pressure", "bp")
+
+# Vitals the create_vitals action accepts; the others are still validated and logged but not sent
+# until the action has a parameter for them.
+VITALS_ACTION_FIELDS = [f.strip() for f in os.getenv("VITALS_ACTION_FIELDS", "hrv,heart_rate,sleep_hours").split(",") if f.strip()]
+
+
+class VitalsValidation(NamedTuple):
+    values: dict   # name -> coerced value, only for vitals present and valid
+    errors: dict   # name -> reason, for vitals present but rejected
+
+
+def _as_float(column):
+    """Float array for a column; text columns are parsed once per distinct value, since readings repeat a lot."""
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=float, na_value=np.nan)
+    codes, uniques = pd.factorize(column)
+    parsed = np.append(pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce").to_numpy(dtype=float), np.nan)
+    return parsed[codes]
+
+
+def _split_combined(column):
+    """(systolic, diastolic) text columns from "120/80"-style values, split once per distinct value."""
+    codes, uniques = pd.factorize(column)
+    parts = [str(u).partition("/") for u in uniques] + [("", "", "")]
+    systolic = np.array([p[0].strip() if p[1] else None for p in parts], dtype=object)[codes]
+    diastolic = np.array([p[2].strip() if p[1] else None for p in parts], dtype=object)[codes]
+    return pd.Series(systolic, index=column.index), pd.Series(diastolic, index=column.index)
+
+
+def _unwrap(value):
+    return value.get("value") if isinstance(value, dict) else value
+
+
+class VitalsSchema:
+    """Compiled validator over a set of VitalSpecs for single payloads and columnar batches."""
+
+    def __init__(self, specs=VITALS, action_fields=None):
+        self.specs = tuple(specs)
+        self.by_name = {s.name: s for s in self.specs}
+        self.labels = {s.name: s.label for s in self.specs}
+        self.action_fields = set(action_fields if action_fields is not None else VITALS_ACTION_FIELDS)
+        self._lookup = [(s, s.source_keys) for s in self.specs]
+        self._minimum = np.array([s.minimum for s in self.specs], dtype=float)
+        self._maximum = np.array([s.maximum for s in self.specs], dtype=float)
+
+    def _raw_values(self, payload):
+        raw = {}
+        for spec, keys in self._lookup:
+            for key in keys:
+                value = _unwrap(payload.get(key))
+                if value not in (None, ""):
+                    raw[spec.name] = value
+                    break
+        for key in COMBINED_BLOOD_PRESSURE_KEYS:
+            combined = _unwrap(payload.get(key))
+            if isinstance(combined, str) and "/" in combined:
+                systolic, _, diastolic = combined.partition("/")
+                raw.setdefault("systolic_bp", systolic.strip())
+                raw.setdefault("diastolic_bp", diastolic.strip())
+        return raw
+
+    def validate(self, payload):
+        """Coerce and range-check the vitals in one payload (plain values or {"value": ...} dicts)."""
+        raw = self._raw_values(payload)
+        values, errors = {}, {}
+        for name, value in raw.items():
+            spec = self.by_name[name]
+            try: number = float(value)
+            except (TypeError, ValueError): errors[name] = f"not a number: {value!r}"; continue
+            if spec.normalize is not None: number = float(spec.normalize(np.array(number)))
+            if not math.isfinite(number) or not spec.minimum <= number <= spec.maximum:
+                errors[name] = f"{number:g} outside {spec.minimum:g}-{spec.maximum:g} {spec.unit}"; continue
+            values[name] = int(round(number)) if spec.dtype is int else round(number, 2)
+        return VitalsValidation(values, errors)
+
+    def validate_batch(self, frame):
+        """Vectorized validation of a DataFrame (or dict of columns) keyed by vital name or source key.
+
+        Returns (clean, invalid): `clean` has one float column per vital with NaN where the reading was
+        missing or rejected; `invalid` is a boolean frame marking rejected readings.
+        """
+        frame = pd.DataFrame(frame)
+        columns = {}
+        for spec, keys in self._lookup:
+            key = next((k for k in keys if k in frame.columns), None)
+            columns[spec.name] = frame[key] if key is not None else pd.Series(np.nan, index=frame.index)
+        for key in COMBINED_BLOOD_PRESSURE_KEYS:
+            if key in frame.columns and not pd.api.types.is_numeric_dtype(frame[key]):
+                systolic, diastolic = _split_combined(frame[key])
+                columns["systolic_bp"] = columns["systolic_bp"].where(columns["systolic_bp"].notna(), systolic)
+                columns["diastolic_bp"] = columns["diastolic_bp"].where(columns["diastolic_bp"].notna(), diastolic)
+
+        # Only text columns can hold blank strings; numeric columns are present wherever they are not NaN.
+        present = np.column_stack([
+            columns[s.name].notna().to_numpy(dtype=bool) if pd.api.types.is_numeric_dtype(columns[s.name])
+            else (columns[s.name].notna() & (columns[s.name] != "")).to_numpy(dtype=bool)
+            for s in self.specs
+        ])
+        numeric = np.column_stack([_as_float(columns[s.name]) for s in self.specs])
+        for i, spec in enumerate(self.specs):
+            if spec.normalize is not None: numeric[:, i] = spec.normalize(numeric[:, i])
+        with np.errstate(invalid="ignore"):
+            ok = np.isfinite(numeric) & (numeric >= self._minimum) & (numeric <= self._maximum)
+        names = [s.name for s in self.specs]
+        clean = pd.DataFrame(np.where(ok, numeric, np.nan), columns=names, index=frame.index)
+        for spec in self.specs:
+            if spec.dtype is int: clean[spec.name] = clean[spec.name].round()
+        invalid = pd.DataFrame(present & ~ok, columns=names, index=frame.index)
+        return clean, invalid
+
+    def mask_fills(self, clean):
+        """Blank out stored readings equal to a vital's fill (the 0 written when it was not measured)."""
+        for spec in self.specs:
+            if spec.fill is not None and spec.name in clean.columns:
+                clean.loc[clean[spec.name] == spec.fill, spec.name] = np.nan
+        return clean
+
+    def action_params(self, values):
+        """create_vitals parameters for validated values, filling required vitals that are missing."""
+        params = {}
+        for spec in self.specs:
+            if spec.name not in self.action_fields: continue
+            value = values.get(spec.name, spec.fill)
+            if value is not None: params[spec.name] = value
+        return params
+
+    def abnormal(self, values):
+        """Descriptions of validated values outside their vital's alert thresholds."""
+        findings = []
+        for name, value in values.items():
+            spec = self.by_name[name]
+            if spec.alert_below is not None and value < spec.alert_below:
+                findings.append(f"{spec.label} {value:g} {spec.unit} (below {spec.alert_below:g})")
+            elif spec.alert_above is not None and value > spec.alert_above:
+                findings.append(f"{spec.label} {value:g} {spec.unit} (above {spec.alert_above:g})")
+        return findings
+
+    def has_measurement(self, params):
+        return any(params.get(spec.name) for spec in self.specs)
+
+    def record(self, day, values):
+        """EHR Hub chart record (label-keyed); vitals missing from `values` are left out."""
+        record = {'date': day}
+        for spec in self.specs:
+            value = values.get(spec.name)
+            if value is not None: record[spec.label] = value
+        return record
+
+    def object_record(self, vitals):
+        """Chart record for a Vitals object, reading whichever registered properties it has."""
+        return self.record(vitals.date_, {spec.name: getattr(vitals, spec.name, None) for spec in self.specs})
+
+
+VITALS_SCHEMA = VitalsSchema()
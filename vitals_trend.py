@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+BUCKET_RULES = {"Daily": "D", "Weekly": "W-MON", "Monthly": "MS"}
+
+
+def lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points that preserve the shape of `y`."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(areas)) if len(areas) else start
+        selected[i + 1] = prev
+    return selected
+
+
+def vitals_frame(records):
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+    df['date'] = pd.to_datetime(df['date'])
+    # Vitals nobody has recorded for this patient would only add empty series to the chart.
+    return df.set_index('date').sort_index().dropna(axis=1, how="all")
+
+
+def aggregate(df, bucket):
+    rule = BUCKET_RULES.get(bucket)
+    if rule is None or df.empty:
+        return df
+    return df.resample(rule).mean().dropna(how="all")
+
+
+def downsample(df, max_points):
+    """Keep at most `max_points` rows, chosen by LTTB on each column; gaps are interpolated for selection only."""
+    if df.empty or len(df) <= max_points:
+        return df
+    per_column = max(3, max_points // max(1, len(df.columns)))
+    keep = set()
+    for column in df.columns:
+        series = df[column].interpolate(limit_direction="both").fillna(0.0).to_numpy()
+        keep.update(lttb_indices(series, per_column).tolist())
+    return df.iloc[sorted(keep)]
+
+
+def trend_frame(records, bucket="Daily", max_points=500):
+    return downsample(aggregate(vitals_frame(records), bucket), max_points)
@@ -0,0 +1,26 @@
+import hashlib
+import hmac
+import time
+
+
+def parse_signature_header(header_value):
+    timestamp = None
+    signature_v0 = None
+    items = header_value.split(',')
+    for item in items:
+        parts = item.split('=', 1)
+        if len(parts) == 2:
+            key = parts[0].strip()
+            value = parts[1].strip()
+            if key == 't':
+                timestamp = int(value)
+            elif key == 'v0':
+                signature_v0 = value
+    return timestamp, signature_v0
+
+
+def sign(raw_body, secret, timestamp=None):
+    """ElevenLabs-Signature header value for `raw_body` (bytes)."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode("utf-8"), msg=f"{timestamp}.{raw_body.decode('utf-8')}".encode("utf-8"), digestmod=hashlib.sha256).hexdigest()
+    return f"t={timestamp},v0={digest}"
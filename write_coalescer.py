@@ -0,0 +1,143 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple, Optional
+
+from foundry_sdk_runtime.types import ActionConfig, ActionMode, ReturnEditsMode
+
+try: from foundry_sdk_runtime.types import BatchActionConfig; BATCH_ACTIONS_AVAILABLE = True
+except ImportError: BatchActionConfig = None; BATCH_ACTIONS_AVAILABLE = False
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActionResult(NamedTuple):
+    validation_result: Optional[str]
+    details: Optional[dict] = None
+
+
+def apply_action(client, action_name, params):
+    """Run one Ontology action without returning edits and reduce the response to an ActionResult."""
+    action_cfg = ActionConfig(mode=ActionMode.VALIDATE_AND_EXECUTE, return_edits=ReturnEditsMode.NONE)
+    response = getattr(client.ontology.actions, action_name)(action_config=action_cfg, **params)
+    if not response or not hasattr(response, 'validation'):
+        return ActionResult(None)
+    details = None
+    if response.validation.validation_result != "VALID":
+        try: details = response.validation._asdict(include_type_field=True)
+        except Exception: pass
+    return ActionResult(response.validation.validation_result, details)
+
+
+def rejected(error):
+    """True when Foundry definitely refused the request (a 4xx other than 429), so nothing was applied.
+
+    Timeouts, dropped connections and 5xx responses are ambiguous: the batch may already have been applied.
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+def _batch_results(response, count):
+    """Per-item ActionResults for an applied batch, or None when the response does not confirm every item.
+
+    Batches are validated atomically, so a batch-level validation result applies to each item; without one,
+    the returned edits must account for one object per item.
+    """
+    validation = getattr(response, "validation", None)
+    if getattr(validation, "validation_result", None):
+        return [ActionResult(validation.validation_result)] * count
+    edits = getattr(response, "edits", None)
+    touched = (getattr(edits, "added_object_count", 0) or 0) + (getattr(edits, "modified_objects_count", 0) or 0)
+    return [ActionResult("VALID")] * count if touched >= count else None
+
+
+class _PendingWrite(NamedTuple):
+    action_name: str
+    params: dict
+    future: Future
+
+
+class WriteCoalescer:
+    """Collects Ontology action calls for a short window and applies them through batch actions.
+
+    If Foundry rejects a batch outright, its items are re-applied one at a time so each caller
+    still gets its own validation result. Ambiguous failures (timeouts, dropped connections, 5xx)
+    are passed to every caller instead, since the batch may already have been applied.
+    """
+
+    def __init__(self, client, window=0.05, max_batch=20):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {"submitted": 0, "batches": 0, "batched_items": 0, "single_calls": 0, "batch_fallbacks": 0, "batch_errors": 0, "unconfirmed_items": 0}
+        self._thread = threading.Thread(target=self._run, name="foundry-write-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, action_name, **params):
+        future = Future()
+        self._queue.put(_PendingWrite(action_name, params, future))
+        with self._stats_lock:
+            self.stats["submitted"] += 1
+        return future
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try: pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty: break
+            groups = {}
+            for item in pending:
+                groups.setdefault(item.action_name, []).append(item)
+            for action_name, items in groups.items():
+                try: self._flush(action_name, items)
+                except Exception as e:
+                    logger.error(f"Unexpected error flushing '{action_name}' writes: {e}", exc_info=True)
+                    for item in items:
+                        if not item.future.done(): item.future.set_exception(e)
+
+    def _flush(self, action_name, items):
+        batch_actions = getattr(self.client.ontology, 'batch_actions', None)
+        if len(items) > 1 and BATCH_ACTIONS_AVAILABLE and hasattr(batch_actions, action_name):
+            try:
+                response = getattr(batch_actions, action_name)(
+                    batch_action_config=BatchActionConfig(return_edits=ReturnEditsMode.ALL),
+                    requests=[item.params for item in items],
+                )
+            except Exception as e:
+                if not rejected(e):
+                    self._count("batch_errors")
+                    logger.error(f"Batch '{action_name}' of {len(items)} failed and may have been applied; not retrying individually: {e}")
+                    for item in items: item.future.set_exception(e)
+                    return
+                self._count("batch_fallbacks")
+                logger.warning(f"Batch '{action_name}' of {len(items)} rejected, applying individually: {e}")
+            else:
+                self._count("batches"); self._count("batched_items", len(items))
+                results = _batch_results(response, len(items))
+                if results is None:
+                    self._count("unconfirmed_items", len(items))
+                    logger.warning(f"Batch '{action_name}' of {len(items)} returned no per-item result; reporting it as unconfirmed")
+                    results = [ActionResult(None, {"batch_size": len(items)})] * len(items)
+                for item, result in zip(items, results):
+                    item.future.set_result(result)
+                return
+
+        for item in items:
+            self._count("single_calls")
+            try: item.future.set_result(apply_action(self.client, action_name, item.params))
+            except Exception as e: item.future.set_exception(e)